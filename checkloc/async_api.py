@@ -0,0 +1,213 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Validate localization files from asyncio code without blocking the event loop.
+
+Requires Python 3.6 or higher. e.g.
+
+    async for result in async_api.validate_languages('/your/amazing/extension'):
+        print(result.lang, result.errors, result.warnings)
+"""
+
+import asyncio
+import functools
+import logging
+import warnings
+
+# allow importing both as a package and from the command line
+try:
+    from . import checkloc
+    from . import diagnostic
+    from . import file_source
+except (ImportError, ValueError):
+    import checkloc
+    import diagnostic
+    import file_source
+
+class LanguageResult(object):
+    """
+    The errors and warnings found in one language.
+    """
+
+    def __init__(self, lang):
+        self.lang = lang
+        self.errors = []
+        self.warnings = []
+
+    @property
+    def any_errors(self):
+        """
+        True if any errors were found in this language.
+        """
+        return len(self.errors) > 0
+
+    def __repr__(self):
+        return "LanguageResult({0!r}, {1} errors, {2} warnings)".format(
+            self.lang, len(self.errors), len(self.warnings))
+
+class AsyncCheckLoc(checkloc.CheckLoc):
+    """
+    Validate localization files from asyncio code without blocking the event loop.
+
+    Finding, reading, and parsing files runs in an executor,
+    one step at a time, and the result for each language
+    is yielded as soon as it has been checked.
+    Each AsyncCheckLoc has its own state, so many extensions
+    can be checked at the same time, each with its own AsyncCheckLoc.
+    """
+
+    def __init__(self, manifest_dir, locales_only=False, baselines=None,
+                 default_baseline=None, all_keys=False, executor=None):
+        """
+        Create a new AsyncCheckLoc.
+        'executor' runs the blocking work; if it is None the event loop's default
+        executor is used. It must run work in threads rather than processes,
+        since the parsed languages are kept in this object.
+        """
+        super().__init__(
+            locales_only=locales_only, manifest_dir=manifest_dir, all_keys=all_keys,
+            baselines=baselines, default_baseline=default_baseline)
+        self.executor = executor
+        # LanguageResult for every language with errors or warnings
+        # that have not been yielded yet, by language name
+        self._pending = {}
+        # work still running in the executor after being cancelled or timing out
+        self._abandoned = None
+
+    def _log_message(self, msg, lang, log_func):
+        """
+        Collect errors and warnings into the result for their language
+        rather than printing them.
+        """
+        if log_func == logging.error:
+            self.any_errors = True
+            results = self._get_result(lang).errors
+        elif log_func == warnings.warn:
+            results = self._get_result(lang).warnings
+        else:
+            return
+        results.append(msg)
+
+    def _get_result(self, lang):
+        """
+        Return the pending LanguageResult for 'lang'.
+        """
+        lang = lang or "Main"
+        if lang not in self._pending:
+            self._pending[lang] = LanguageResult(lang)
+        return self._pending[lang]
+
+    async def validate_languages(self, timeout=None):
+        """
+        Validate localization contents inside the given base directory,
+        yielding a LanguageResult for each language as soon as it has been checked.
+
+        Problems that do not belong to one language (e.g. a missing chrome.manifest)
+        are yielded last, under the name 'Main'.
+        If 'timeout' is given raise asyncio.TimeoutError if validation
+        takes longer than that many seconds.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = None
+        if timeout is not None:
+            deadline = loop.time() + timeout
+
+        self.any_errors = False
+        self._pending = {}
+        self.source = file_source.FileSource()
+        try:
+            langs = await self._run(deadline, self._find_languages)
+            assigned_baselines = None
+            if langs is not None:
+                assigned_baselines = self._assign_baselines(langs)
+
+            if assigned_baselines is not None:
+                check_langs = self._get_shard_languages(assigned_baselines)
+                parsed = {}
+                baseline = await self._run(
+                    deadline, self._get_language, self.default_baseline, langs, parsed)
+                if len(baseline.keys) < 1:
+                    self._log_error(diagnostic.Diagnostic(
+                        diagnostic.NO_KEYS,
+                        "Did not find any keys in '{0}'!",
+                        (baseline.name,)))
+                    check_langs = []
+
+                used_baselines = set(assigned_baselines.values())
+                for lang in check_langs:
+                    await self._run(
+                        deadline, self._check_language, lang, langs, parsed,
+                        assigned_baselines[lang])
+                    if lang not in used_baselines:
+                        del parsed[lang]
+                    yield self._pending.pop(lang, None) or LanguageResult(lang)
+
+            # e.g. problems with the manifests or with parsing a baseline
+            for lang in sorted(self._pending, key=lambda name: (name == "Main", name)):
+                yield self._pending[lang]
+            self._pending = {}
+        finally:
+            if self._abandoned is not None and not self._abandoned.done():
+                # don't close archives that are still being read
+                source = self.source
+                self._abandoned.add_done_callback(lambda _: source.close())
+            else:
+                self.source.close()
+
+    def _check_language(self, lang, langs, parsed, baseline_name):
+        """
+        Parse one language and its baseline, if needed, and compare them.
+        """
+        loc = self._get_language(lang, langs, parsed)
+        baseline = self._get_language(baseline_name, langs, parsed)
+        self._compare_languages(baseline, loc)
+
+    async def _run(self, deadline, func, *args):
+        """
+        Run func(*args) in the executor and return its result.
+        If the deadline passes first raise asyncio.TimeoutError.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(self.executor, functools.partial(func, *args))
+        timeout = None
+        if deadline is not None:
+            timeout = max(0, deadline - loop.time())
+        try:
+            # shield the work so it is not marked as finished while the thread
+            # is still running; see the end of validate_languages()
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            self._abandoned = future
+            raise
+
+def validate_languages(manifest_dir, timeout=None, **options):
+    """
+    Validate localization contents inside the given base directory
+    and return an asynchronous iterator of LanguageResults, one for each language.
+    'options' are passed on to AsyncCheckLoc.
+    """
+    return AsyncCheckLoc(manifest_dir, **options).validate_languages(timeout)
+
+async def validate(manifest_dir, timeout=None, **options):
+    """
+    Validate localization contents inside the given base directory
+    and return a list of LanguageResults, one for each language.
+    'options' are passed on to AsyncCheckLoc.
+    """
+    return [result async for result in validate_languages(manifest_dir, timeout, **options)]
+
+if __name__ == '__main__':
+    pass
@@ -23,14 +23,50 @@ to make sure all localizations have the same strings in the same places.
 from __future__ import print_function
 
 import argparse
+import contextlib
+import fnmatch
+import io
 import json
 import logging
+import multiprocessing
 import os
+import platform
+import re
 import sys
+import time
 import warnings
 
-import loc_language
-import manifest_set
+try:
+    import resource
+except ImportError:
+    # not available on Windows; peak memory is not recorded there
+    resource = None
+
+# allow importing both as a package and from the command line
+try:
+    from . import diagnostic
+    from . import file_source
+    from . import history_store
+    from . import key_index
+    from . import loc_file
+    from . import loc_language
+    from . import manifest_set
+    from . import perf_store
+    from . import phase_profiler
+    from . import rename_index
+    from . import resource_limits
+except (ImportError, ValueError):
+    import diagnostic
+    import file_source
+    import history_store
+    import key_index
+    import loc_file
+    import loc_language
+    import manifest_set
+    import perf_store
+    import phase_profiler
+    import rename_index
+    import resource_limits
 
 # Attempt to version meaningfully, following semver.org:
 # Given a version number MAJOR.MINOR.PATCH, increment the:
@@ -39,6 +75,14 @@ import manifest_set
 # PATCH version when you make backwards-compatible bug fixes.
 VERSION = "2.1.4"
 
+# exit status when no errors were found,
+# but some languages were not checked because the time budget was used up
+PARTIAL_EXIT_CODE = 3
+
+# key of the --json message output that holds the number of untranslated keys
+# in each language and file, when checking for untranslated keys
+UNTRANSLATED_COUNTS = 'untranslated-counts'
+
 class CheckLoc(object):
     """
     Validate Mozilla-style localization files (XUL and string bundle)
@@ -49,14 +93,88 @@ class CheckLoc(object):
     _BASE_LOC = 'en-US'
 
     def __init__(self, group_by_language=False, output_json=False, locales_only=False,
-                 manifest_dir=None):
+                 manifest_dir=None, summary=False, all_keys=False, history_path=None,
+                 baselines=None, default_baseline=None, shard=None, changed_files=None,
+                 time_budget=None, detect_renames=False, untranslated=False,
+                 untranslated_allowlist=None, perf_store_path=None, perf_label=None,
+                 profile_dir=None, limits=None, index_path=None, baseline_report=None,
+                 report_path=None, known_entities=None, parse_processes=None):
         self.any_errors = False
         self.messages_by_language = {}
+        # count of diagnostics, stored as
+        # summary_counts[language][file_name][category] = count
+        self.summary_counts = {}
 
         self.group_by_language = group_by_language
         self.locales_only = locales_only
         self.manifest_dir = manifest_dir
         self.output_json = output_json
+        self.summary = summary
+        self.all_keys = all_keys
+        self.history_path = history_path
+        self.source = None
+        # fallback chain of baseline languages to compare each language against,
+        # stored as baselines[language] = [first choice, second choice, ...].
+        # languages not listed here are compared against the default baseline.
+        self.baselines = baselines or {}
+        self.default_baseline = default_baseline or self._BASE_LOC
+        # (index, count): only check every count'th language, starting at index (from 1).
+        # used to split one run across several machines
+        self.shard = shard
+        # if given, only check these files (e.g. the files staged in a commit)
+        # rather than every file in every language
+        self.changed_files = changed_files
+        # if given, stop starting new languages after this many seconds
+        self.time_budget = time_budget
+        # languages that were not checked because the time budget was used up
+        self.unchecked_languages = []
+        # report keys that look renamed once, rather than as one missing and one extra key
+        self.detect_renames = detect_renames
+        # warn about values that are the same as in the default baseline,
+        # except for keys or values that match a pattern in the allowlist
+        self.untranslated = untranslated
+        self.untranslated_allowlist = untranslated_allowlist or []
+        # number of untranslated keys found in each file, stored as
+        # untranslated_counts[language][file_name] = count
+        self.untranslated_counts = {}
+        # hash of every default baseline value, by key;
+        # built once and used for every language
+        self._baseline_hashes = None
+        # if given, save the time taken by each run and the size of its input
+        # in this SQLite database, under the given label (e.g. a revision)
+        self.perf_store_path = perf_store_path
+        self.perf_label = perf_label
+        # seconds spent in each phase of the last run, by phase name
+        self.phase_times = {}
+        self._languages_read = 0
+        self._keys_read = 0
+        # if given, profile each phase separately and save the results in this folder
+        self.profile_dir = profile_dir
+        self._profiler = None
+        # resource_limits.ResourceLimits for reading each file;
+        # files that exceed them are skipped. If None the defaults are used
+        self.limits = limits
+        # if given, save every key, file, and language found in this SQLite database,
+        # so they can be looked up with 'checkloc query'
+        self.index_path = index_path
+        # if given, the set of diagnostic fingerprints from an earlier report.
+        # problems already in it are only counted, and only new errors fail the run
+        self.baseline_report = baseline_report
+        self.any_new_errors = False
+        # number of known problems that were not shown, by level ('error' or 'warning')
+        self.known_counts = {}
+        self._known_found = set()
+        # if given, save a report of every diagnostic's fingerprint to this file,
+        # for use as a later run's baseline report
+        self.report_path = report_path
+        # details of every diagnostic found, by fingerprint
+        self.report = {}
+        # names of entities declared outside the extension that DTD values can refer to
+        self.known_entities = known_entities or []
+        # if more than 1, scan large .properties files in parallel chunks
+        # with a pool of this many processes, created the first time it is needed in each run
+        self.parse_processes = parse_processes
+        self._parse_pool = None
 
         if output_json:
             self.group_by_language = True
@@ -87,6 +205,9 @@ class CheckLoc(object):
     def _log_message(self, msg, lang, log_func):
         """
         Log a message to the appropriate place via log_func().
+
+        'msg' may be a string or a diagnostic.Diagnostic;
+        the text of a Diagnostic is only built if the message is actually displayed.
         """
         # this function wraps setting the error flag
         # to keep all error code in one place
@@ -97,13 +218,23 @@ class CheckLoc(object):
         if not lang:
             lang = "Main"
 
-        msg_out = "({0}) {1}".format(lang, msg)
+        if log_func == logging.error or log_func == warnings.warn:
+            if not isinstance(msg, diagnostic.Diagnostic):
+                # errors and warnings logged as plain text are counted as setup problems
+                msg = diagnostic.Diagnostic(diagnostic.SETUP, '{0}', (msg,))
+            if self._is_known(msg, lang, log_func == logging.error):
+                return
 
-        if self.group_by_language:
+        if self.summary:
+            if log_func != logging.error and log_func != warnings.warn:
+                return
+            self._count_message(msg, lang)
+        elif self.group_by_language:
             if lang not in self.messages_by_language:
                 self.messages_by_language[lang] = []
 
             if self.output_json:
+                msg_out = "({0}) {1}".format(lang, msg)
                 if log_func == logging.error:
                     msg_out = "ERROR: " + msg_out
                 elif log_func == warnings.warn:
@@ -114,127 +245,803 @@ class CheckLoc(object):
                 # and not have to re-calculate what to do with them
                 # or where they should be sent.
                 self.messages_by_language[lang].append(
-                    lambda: log_func(msg_out))
+                    lambda: self._emit_message(msg, lang, log_func))
+        else:
+            self._emit_message(msg, lang, log_func)
+
+    def _is_known(self, msg, lang, is_error):
+        """
+        Add an error or warning to the report, if one is being saved,
+        and return True if it was already in the baseline report, so it is not shown.
+        """
+        if self.baseline_report is None and not self.report_path:
+            return False
+
+        fingerprints = msg.get_fingerprints(lang)
+        level = 'error' if is_error else 'warning'
+        if self.report_path:
+            # each key of a grouped diagnostic is saved separately
+            keys = msg.keys if msg.keys is not None else [msg.key]
+            count = 1 if msg.keys is not None else msg.count
+            for (fingerprint, key) in zip(fingerprints, keys):
+                entry = self.report.get(fingerprint)
+                if entry is None:
+                    self.report[fingerprint] = {
+                        'level': level, 'category': msg.category, 'language': lang,
+                        'file': msg.file_name, 'key': key, 'count': count}
+                else:
+                    entry['count'] += count
+
+        if self.baseline_report is None:
+            return False
+        known = [fingerprint for fingerprint in fingerprints if fingerprint in self.baseline_report]
+        self._known_found.update(known)
+        if len(known) == len(fingerprints):
+            self.known_counts[level] = self.known_counts.get(level, 0) + msg.count
+            return True
+        # a group with any new key is shown in full
+        if is_error:
+            self.any_new_errors = True
+        return False
+
+    @staticmethod
+    def _emit_message(msg, lang, log_func):
+        """
+        Send a message to log_func().
+        """
+        if log_func == logging.error:
+            # let logging build the string, so nothing is formatted
+            # for errors that are filtered out by the log level (e.g. --quiet)
+            log_func("(%s) %s", lang, msg)
         else:
-            log_func(msg_out)
+            log_func("({0}) {1}".format(lang, msg))
+
+    def _count_message(self, msg, lang):
+        """
+        Count a message in the summary without formatting it.
+        """
+        category = getattr(msg, 'category', diagnostic.SETUP)
+        file_name = getattr(msg, 'file_name', None) or '-'
+
+        lang_counts = self.summary_counts.setdefault(lang, {})
+        file_counts = lang_counts.setdefault(file_name, {})
+        file_counts[category] = file_counts.get(category, 0) + getattr(msg, 'count', 1)
 
     def validate_loc_files(self):
         """
         Validate localization contents inside the given base directory.
         Return True if there were any errors and False otherwise.
+        The base directory can also be a packaged extension (.xpi file).
         """
         self.any_errors = False
+        self.unchecked_languages = []
+        self._baseline_hashes = None
+        self.untranslated_counts = {}
+        self.phase_times = {}
+        self._languages_read = 0
+        self._keys_read = 0
+        self.any_new_errors = False
+        self.known_counts = {}
+        self._known_found = set()
+        self.report = {}
+        if self.profile_dir:
+            self._profiler = phase_profiler.PhaseProfiler(self.profile_dir)
+        start = _clock()
+        self.source = file_source.FileSource()
+        try:
+            errors = self._validate_loc_files()
+            if self.report_path:
+                self._write_report()
+            if self.baseline_report is not None:
+                self._log_known_problems()
+                # only problems that are new since the baseline report fail the run
+                errors = self.any_new_errors
+            return errors
+        finally:
+            self.source.close()
+            self._close_parse_pool()
+            if self.perf_store_path:
+                self._record_perf(_clock() - start)
+            if self._profiler:
+                written = self._profiler.write()
+                self._log_normal(
+                    "Saved {0} profiles in {1}.".format(len(written) // 2, self.profile_dir))
+                self._profiler = None
 
-        langs = {}
+    def _get_parse_pool(self):
+        """
+        Return the pool of processes used to scan large .properties files in this run,
+        creating it the first time.
+        """
+        if self._parse_pool is None:
+            self._parse_pool = multiprocessing.Pool(self.parse_processes)
+        return self._parse_pool
+
+    def _close_parse_pool(self):
+        """
+        Stop the processes in the parse pool, if one was created.
+        """
+        if self._parse_pool is not None:
+            # any chunks still being scanned after an early stop are not needed
+            self._parse_pool.terminate()
+            self._parse_pool.join()
+            self._parse_pool = None
 
+    def _write_report(self):
+        """
+        Save the fingerprint and details of every error and warning found by the last run.
+        """
+        with open(self.report_path, 'w') as report_file:
+            json.dump({'version': VERSION, 'fingerprints': self.report},
+                      report_file, sort_keys=True, indent=4)
+
+    def _log_known_problems(self):
+        """
+        Print how many problems were left out because they were in the baseline report.
+        """
+        self._log_normal(
+            "{0} known errors and {1} known warnings from the baseline report were not shown."
+            .format(self.known_counts.get('error', 0), self.known_counts.get('warning', 0)))
+        not_found = len(self.baseline_report - self._known_found)
+        if not_found:
+            self._log_normal(
+                "{0} problems in the baseline report were not found by this run."
+                .format(not_found))
+
+    @contextlib.contextmanager
+    def _phase(self, name, lang=None):
+        """
+        Add the time taken by the enclosed code to the total for the named phase.
+        If profiling, profile it as well, separately for each language.
+        """
+        profile_name = name if lang is None else name + '-' + lang
+        if self._profiler:
+            self._profiler.enable(profile_name)
+        start = _clock()
+        try:
+            yield
+        finally:
+            self.phase_times[name] = self.phase_times.get(name, 0) + _clock() - start
+            if self._profiler:
+                self._profiler.disable(profile_name)
+
+    def _record_perf(self, seconds):
+        """
+        Save the time taken by the last run, and the size of its input, in the performance store.
+        """
+        store = perf_store.PerfStore(self.perf_store_path)
+        try:
+            store.record_run(
+                self.perf_label, VERSION, platform.python_version(),
+                {'languages': self._languages_read, 'files': self.source.files_read,
+                 'bytes': self.source.bytes_read, 'keys': self._keys_read},
+                _get_peak_memory_kb(), seconds, self.phase_times)
+        finally:
+            store.close()
+
+    def _validate_loc_files(self):
+        """
+        Validate localization contents inside the given base directory.
+        Return True if there were any errors and False otherwise.
+        """
         self._log_normal("Starting Localization tests...")
+        deadline = None
+        if self.time_budget is not None:
+            deadline = _clock() + self.time_budget
 
-        manifest_dir = os.path.abspath(self.manifest_dir)
-        if not os.path.exists(manifest_dir):
-            self._log_error("The localization directory {0} does not exist!".format(manifest_dir))
+        with self._phase('manifest'):
+            langs = self._find_languages()
+        if langs is None:
+            return True # error message has already been printed above
+
+        assigned_baselines = self._assign_baselines(langs)
+        if assigned_baselines is None:
+            return True # error message has already been printed above
+
+        check_langs = self._get_shard_languages(assigned_baselines)
+        only_files = None
+        if self.changed_files is not None:
+            (check_langs, only_files) = self._get_changed_languages(
+                langs, assigned_baselines, check_langs)
+            if not only_files:
+                self._log_normal("No localization files to check.")
+                return self.any_errors
+
+        # every language is only parsed once.
+        # languages used as a baseline are kept until all languages have been checked
+        parsed = {}
+        with self._phase('baseline', self.default_baseline):
+            baseline = self._get_language(self.default_baseline, langs, parsed, only_files)
+
+        # when only checking some files the baseline may not have any of them
+        if len(baseline.keys) < 1 and only_files is None:
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.NO_KEYS,
+                "Did not find any keys in '{0}'!",
+                (baseline.name,)))
             return True
+
+        baseline_errors = self.any_errors
+        if self.baseline_report is not None:
+            # problems already in the baseline report don't stop the other languages being checked
+            baseline_errors = self.any_new_errors
+        if baseline_errors:
+            return True # error message has already been printed above
+
+        self._log_normal(
+            "{0} keys found in baseline '{1}'."
+            .format(len(baseline.keys), baseline.name))
+
+        history = None
+        recorded_baselines = set()
+        if self.history_path:
+            history = history_store.HistoryStore(self.history_path)
+
+        index = None
+        if self.index_path:
+            index = key_index.KeyIndex(self.index_path)
+            with self._phase('index', baseline.name):
+                index.record_language(baseline, None, only_files)
+                if only_files is None and not self.shard:
+                    # forget languages that have been removed
+                    index.remove_languages_except(langs)
+
+        used_baselines = set(assigned_baselines.values())
+        for (i, lang) in enumerate(check_langs):
+            if deadline is not None and _clock() > deadline:
+                # every language that was started has been finished;
+                # don't start any more
+                self._skip_languages(check_langs[i:])
+                break
+
+            with self._phase('parse', lang):
+                loc = self._get_language(lang, langs, parsed, only_files)
+                lang_baseline = self._get_language(
+                    assigned_baselines[lang], langs, parsed, only_files)
+            if index:
+                with self._phase('index', lang):
+                    index.record_language(loc, lang_baseline.name, only_files)
+
+            with self._phase('compare', lang):
+                self._compare_languages(lang_baseline, loc, history)
+                if self.untranslated:
+                    self._check_untranslated(baseline, loc)
+            if history:
+                with self._phase('history', lang):
+                    if lang_baseline.name not in recorded_baselines:
+                        history.record_baseline(lang_baseline)
+                        recorded_baselines.add(lang_baseline.name)
+                    self._check_stale_keys(history, lang_baseline, loc)
+
+            if lang not in used_baselines:
+                del parsed[lang]
+
+        if history:
+            history.close()
+        if index:
+            index.close()
+
+        self._log_normal("Done!")
+        return self.any_errors
+
+    def _find_languages(self):
+        """
+        Find the folder of every language, validating the manifests on the way.
+        Return a dict of folder paths by language name,
+        or None if there was a problem that stops validation.
+        """
+        langs = {}
+
+        manifest_dir = os.path.abspath(self.manifest_dir)
+        if not self.source.exists(manifest_dir):
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.SETUP,
+                "The localization directory {0} does not exist!",
+                (manifest_dir,)))
+            return None
         logging.info("Loc directory %s exists.", manifest_dir)
 
-        if not os.path.isdir(manifest_dir):
+        if self.source.is_archive(manifest_dir):
+            # read packaged extensions (.xpi files) without extracting them
+            manifest_dir = self.source.get_archive_root(manifest_dir)
+        elif not self.source.isdir(manifest_dir):
             # if the user invokes with the exact path to the chrome.manifest file
             # still attempt to run using the given directory
             manifest_dir = os.path.dirname(manifest_dir)
 
-        ms = manifest_set.ManifestSet(manifest_dir, self._log_error, self._log_warning)
+        ms = manifest_set.ManifestSet(
+            manifest_dir, self._log_error, self._log_warning, self.source)
 
         loc_dirs = []
         if self.locales_only:
             loc_dirs.append(manifest_dir) # script should be pointed to main locale folder instead
         else:
+            if self.changed_files is not None and not self._manifest_changed(manifest_dir):
+                # the manifests are still needed to find the locale folders,
+                # but there is no need to report problems that were already there
+                ms = manifest_set.ManifestSet(
+                    manifest_dir, _ignore_message, _ignore_message, self.source)
             ms.validate_manifests()
             loc_dirs.extend(ms.get_loc_base_dirs())
 
         if not loc_dirs:
-            self._log_error("No localization directories found in {0}".format(manifest_dir))
-            return True
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.SETUP,
+                "No localization directories found in {0}",
+                (manifest_dir,)))
+            return None
 
         for ld in loc_dirs:
-            for (_, dirs, _) in os.walk(ld):
+            for (_, dirs, _) in self.source.walk(ld):
                 for d in dirs:
                     langs[d] = os.path.join(ld, d)
 
         if len(langs) < 1:
-            self._log_error("Did not find any language folders inside {0}!".format(loc_dirs))
-            return True
-        self._log_normal("Found {0} languages: {1}.".format(len(langs), langs.keys()))
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.SETUP,
+                "Did not find any language folders inside {0}!",
+                (loc_dirs,)))
+            return None
+        self._log_normal("Found {0} languages: {1}.".format(len(langs), list(langs)))
 
-        if self._BASE_LOC not in langs:
-            self._log_error("Base language folder '{0}' was not found in {1}".format(\
-                self._BASE_LOC, loc_dirs))
-            return True
+        if self.default_baseline not in langs:
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.SETUP,
+                "Base language folder '{0}' was not found in {1}",
+                (self.default_baseline, loc_dirs)))
+            return None
 
+        return langs
 
-        baseline = loc_language.LocalizationLanguage(
-            langs[self._BASE_LOC], self._BASE_LOC, self._log_warning, self._log_error)
-        parse_errors = baseline.get_loc_keys()
-        self.any_errors = self.any_errors or parse_errors
+    def _compare_languages(self, baseline, loc, history=None):
+        """
+        Log an error for every key and string substitution
+        that differs between the baseline and the given language.
+        'history' is the history_store.HistoryStore for this run, if there is one.
+        """
+        lang = loc.name
 
-        if len(baseline.keys) < 1:
-            self._log_error("Did not find any keys in '{0}'!".format(baseline.name))
-            return True
+        # files with the same fingerprint have the same keys and string substitutions,
+        # so there is no need to compare them key by key.
+        # for most languages this is every file.
+        same_files = set()
+        for file_name in baseline.files:
+            if file_name in loc.files and \
+                baseline.files[file_name].get_fingerprint() == \
+                loc.files[file_name].get_fingerprint():
+                same_files.add(file_name)
+        if len(same_files) == len(baseline.files) == len(loc.files):
+            return
 
-        if self.any_errors:
-            return True # error message has already been printed above
+        renames = {}
+        if self.detect_renames:
+            renames = self._find_renames(baseline, loc, same_files, history)
+            for old_key in sorted(renames):
+                new_key = renames[old_key]
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.RENAMED_KEY,
+                    "Key '{0}' in '{1}' looks like it was renamed to '{2}' in '{3}'. "
+                    "Rename it in '{1}' rather than translating it again.",
+                    (old_key, loc.name, new_key, baseline.name), loc.get_file_name(old_key),
+                    old_key, location=loc.get_location(old_key),
+                    related_location=baseline.get_location(new_key)), lang)
+        # renamed keys have already been reported
+        skip_keys = set(renames) | set(renames.values())
+
+        if self.all_keys:
+            for key in loc.keys:
+                if key not in baseline.keys and key not in skip_keys:
+                    self._log_error(diagnostic.Diagnostic(
+                        diagnostic.EXTRA_KEY,
+                        "Key '{0}' in '{1}' but not in '{2}'",
+                        (key, loc.name, baseline.name), loc.get_file_name(key), key,
+                        location=loc.get_location(key)), lang)
+
+            for key in baseline.keys:
+                if key not in loc.keys and key not in skip_keys:
+                    self._log_error(diagnostic.Diagnostic(
+                        diagnostic.MISSING_KEY,
+                        "Key '{0}' in '{1}' but not in '{2}'",
+                        (key, baseline.name, loc.name), baseline.get_file_name(key), key,
+                        location=baseline.get_location(key)), lang)
+        else:
+            self._compare_files(
+                loc, baseline, diagnostic.EXTRA_KEY, lang, same_files, skip_keys)
+            self._compare_files(
+                baseline, loc, diagnostic.MISSING_KEY, lang, same_files, skip_keys)
+
+        # make sure .properties string substitutions match.
+        # keys that don't exist in one loc will already have been caught above,
+        # so skip them here rather than reporting them twice
+        for key in loc.subs:
+            if key not in baseline.keys or loc.get_file_name(key) in same_files:
+                continue
+            if key not in baseline.subs:
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.SUBS_MISMATCH,
+                    "String substitution for key '{0}' found in '{1}' but not in baseline {2}!",
+                    (key, loc.name, baseline.name), loc.get_file_name(key), key,
+                    location=loc.get_location(key),
+                    related_location=baseline.get_location(key)), lang)
+            elif loc.subs[key] != baseline.subs[key]:
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.SUBS_MISMATCH,
+                    "String substitution for key '{0}' in '{1}' "
+                    "is not the same as baseline '{2}'. "
+                    "Substitution count and type must match.\n{1}:{3}\n{2}:{4}",
+                    (key, loc.name, baseline.name, loc.subs[key], baseline.subs[key]),
+                    loc.get_file_name(key), key,
+                    location=loc.get_location(key),
+                    related_location=baseline.get_location(key)), lang)
+
+        for key in baseline.subs:
+            if key not in loc.keys or baseline.get_file_name(key) in same_files:
+                continue
+            if key not in loc.subs:
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.SUBS_MISMATCH,
+                    "String substitution for key '{0}' found in baseline {1} but not in '{2}'!",
+                    (key, baseline.name, loc.name), baseline.get_file_name(key), key,
+                    location=loc.get_location(key),
+                    related_location=baseline.get_location(key)), lang)
+            elif loc.subs[key] != baseline.subs[key]:
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.SUBS_MISMATCH,
+                    "String substitution for key '{0}' in baseline '{1}' "
+                    "is not the same as '{2}'. "
+                    "Substitution count and type must match.\n{1}:{4}\n{2}:{3}",
+                    (key, baseline.name, loc.name, loc.subs[key], baseline.subs[key]),
+                    baseline.get_file_name(key), key,
+                    location=loc.get_location(key),
+                    related_location=baseline.get_location(key)), lang)
+
+    def _find_renames(self, baseline, loc, same_files, history=None):
+        """
+        Return a dict of the new name in the baseline
+        of each key in 'loc' that looks like it was renamed.
 
+        Keys missing from 'loc' are paired with extra keys in 'loc':
+        first by the baseline value of a missing key being the same
+        as the last value the extra key had in the baseline (if there is a history),
+        then by similar key names and similar parts of values
+        that are not usually translated (string substitutions, numbers, markup, and so on).
+        Only keys in files that exist in both languages are paired.
+        """
+        missing = []
+        extra = []
+        for file_name in baseline.files:
+            if file_name in same_files or file_name not in loc.files:
+                continue
+            baseline_file = baseline.files[file_name]
+            (only_baseline, only_loc) = baseline_file.compare_keys(loc.files[file_name])
+            missing.extend(_get_run_keys(baseline, baseline_file, only_baseline))
+            extra.extend(_get_run_keys(loc, loc.files[file_name], only_loc))
+        if not missing or not extra:
+            return {}
+
+        renames = {}
+        if history:
+            # a key whose value did not change when it was renamed
+            # still has the value last recorded for its old name
+            old_hashes = history.get_baseline_hashes(baseline.name, extra)
+            new_keys = {}
+            for key in missing:
+                new_keys.setdefault(history_store.hash_value(baseline.keys[key]), []).append(key)
+            for key in sorted(old_hashes):
+                matches = new_keys.get(old_hashes[key], [])
+                if len(matches) == 1 and matches[0] not in renames.values():
+                    renames[key] = matches[0]
+
+        # keys are only paired if their string substitutions match
+        paired = set(renames.values())
+        missing_features = dict(
+            (key, (baseline.subs.get(key), rename_index.get_features(
+                baseline.get_key_name(key), baseline.keys[key])))
+            for key in missing if key not in paired)
+        extra_features = dict(
+            (key, (loc.subs.get(key), rename_index.get_features(
+                loc.get_key_name(key), loc.keys[key])))
+            for key in extra if key not in renames)
+        renames.update(rename_index.find_renames(missing_features, extra_features))
+        return renames
+
+    def _get_shard_languages(self, assigned_baselines):
+        """
+        Return the list of languages to check in this run,
+        i.e. every language except the default baseline,
+        or only the languages that belong to this shard.
+        """
+        # don't test the baseline localization against itself
+        check_langs = sorted(assigned_baselines)
+        if not self.shard:
+            return check_langs
+
+        # sort so every shard gets the same order and the shards never overlap.
+        # baselines are parsed by every shard that needs them
+        (index, count) = self.shard
+        shard_langs = check_langs[index - 1::count]
         self._log_normal(
-            "{0} keys found in baseline '{1}'."
-            .format(len(baseline.keys), baseline.name))
+            "Shard {0}/{1}: checking {2} of {3} languages."
+            .format(index, count, len(shard_langs), len(check_langs)))
+        return shard_langs
 
-        del langs[self._BASE_LOC] # don't test the baseline localization against itself
+    def _manifest_changed(self, manifest_dir):
+        """
+        Return True if chrome.manifest or install.rdf is one of the changed files.
+        """
+        for path in self.changed_files:
+            path = os.path.abspath(path)
+            if os.path.dirname(path) == manifest_dir and \
+                    os.path.basename(path) in ('chrome.manifest', 'install.rdf'):
+                return True
+        return False
 
+    def _get_changed_languages(self, langs, assigned_baselines, check_langs):
+        """
+        Work out what to check when only some files have changed.
+        Return a tuple (languages to check, names of the files to read in each language).
+
+        Every language with a changed file is checked,
+        along with every language that uses a language with a changed file as its baseline.
+        Only files with the same names as the changed files are read,
+        since the same file has the same name in every language.
+        """
+        lang_dirs = {}
         for lang in langs:
+            lang_dirs[os.path.normcase(os.path.abspath(langs[lang]))] = lang
+
+        changed_langs = set()
+        only_files = set()
+        for path in self.changed_files:
+            path = os.path.abspath(path)
+            lang = lang_dirs.get(os.path.normcase(os.path.dirname(path)))
+            if lang is None:
+                logging.info("%s is not inside a locale folder. Ignoring.", path)
+                continue
+            changed_langs.add(lang)
+            only_files.add(os.path.basename(path))
+
+        check_langs = [
+            lang for lang in check_langs
+            if lang in changed_langs or assigned_baselines[lang] in changed_langs]
+        self._log_normal(
+            "Checking {0} changed files in {1} languages."
+            .format(len(only_files), len(check_langs)))
+        return (check_langs, only_files)
+
+    def _get_language(self, lang, langs, parsed, only_files=None):
+        """
+        Return the LocalizationLanguage for 'lang',
+        parsing it only the first time it is needed.
+        'langs' maps each language name to its directory,
+        and 'parsed' holds the languages that have already been parsed.
+        If 'only_files' is given only files with those names are read.
+        """
+        if lang not in parsed:
             loc = loc_language.LocalizationLanguage(
-                langs[lang], lang, self._log_warning, self._log_error)
-            parse_errors = loc.get_loc_keys()
+                langs[lang], lang, self._log_warning, self._log_error, self.source,
+                self.limits, self.known_entities,
+                self._get_parse_pool if (self.parse_processes or 0) > 1 else None)
+            parse_errors = loc.get_loc_keys(only_files)
             self.any_errors = self.any_errors or parse_errors
+            parsed[lang] = loc
+            self._languages_read += 1
+            self._keys_read += len(loc.keys)
+        return parsed[lang]
 
-            for key in loc.keys:
-                if key not in baseline.keys:
-                    self._log_error(
-                        "Key '{0}' in '{1}' but not in '{2}'"
-                        .format(key, loc.name, baseline.name), lang)
+    def _assign_baselines(self, langs):
+        """
+        Return a dict of the baseline language to compare each language against:
+        the first language in its fallback chain that exists,
+        or the default baseline if there is none.
+        Log an error and return None if the baselines loop back on themselves.
+        """
+        assigned = {}
+        for lang in langs:
+            if lang == self.default_baseline:
+                continue
+            assigned[lang] = self.default_baseline
+            for base in self.baselines.get(lang, []):
+                if base in langs:
+                    assigned[lang] = base
+                    break
+                self._log_normal(
+                    "Baseline '{0}' for '{1}' was not found; trying the next one."
+                    .format(base, lang))
 
-            for key in baseline.keys:
-                if key not in loc.keys:
-                    self._log_error(
-                        "Key '{0}' in '{1}' but not in '{2}'"
-                        .format(key, baseline.name, loc.name), lang)
-
-            # make sure .properties string substitutions match
-            # keys that don't exist in one loc will already have been caught above
-            for key in loc.subs:
-                if key not in baseline.subs:
-                    self._log_error(
-                        "String substitution for key '{0}' found in '{1}' but not in baseline {2}!"
-                        .format(key, loc.name, baseline.name), lang)
-                elif loc.subs[key] != baseline.subs[key]:
-                    self._log_error(
-                        "String substitution for key '{0}' in '{1}' "
-                        "is not the same as baseline '{2}'. "
-                        "Substitution count and type must match.\n{1}:{3}\n{2}:{4}"
-                        .format(key, loc.name, baseline.name, loc.subs[key], baseline.subs[key]),
-                        lang)
-
-            for key in baseline.subs:
-                if key not in loc.subs:
-                    self._log_error(
-                        "String substitution for key '{0}' found in baseline {1} but not in '{2}'!"
-                        .format(key, baseline.name, loc.name), lang)
-                elif loc.subs[key] != baseline.subs[key]:
-                    self._log_error(
-                        "String substitution for key '{0}' in baseline '{1}' "
-                        "is not the same as '{2}'. "
-                        "Substitution count and type must match.\n{1}:{4}\n{2}:{3}"
-                        .format(key, baseline.name, loc.name, loc.subs[key], baseline.subs[key]),
-                        lang)
+        # each chain of baselines must end at the default baseline,
+        # otherwise no language in the loop would be checked for
+        # keys added to the default baseline
+        for lang in sorted(assigned):
+            chain = [lang]
+            while chain[-1] != self.default_baseline:
+                next_lang = assigned[chain[-1]]
+                if next_lang in chain:
+                    self._log_error(diagnostic.Diagnostic(
+                        diagnostic.SETUP,
+                        "Baselines for '{0}' loop back on themselves: {1}",
+                        (lang, ' -> '.join(chain + [next_lang]))))
+                    return None
+                chain.append(next_lang)
 
-        self._log_normal("Done!")
-        return self.any_errors
+        return assigned
+
+    def _skip_languages(self, langs):
+        """
+        Report the given languages as not checked because the time budget was used up.
+        """
+        self.unchecked_languages = list(langs)
+        self._log_normal(
+            "Time budget of {0:g} seconds used up; {1} languages were not checked: {2}."
+            .format(self.time_budget, len(langs), ', '.join(langs)))
+        for lang in langs:
+            self._log_warning(diagnostic.Diagnostic(
+                diagnostic.NOT_CHECKED,
+                "Language '{0}' was not checked: the time budget of {1:g} seconds was used up.",
+                (lang, self.time_budget)), lang)
+
+    def _check_stale_keys(self, history, baseline, loc):
+        """
+        Log a warning for every key whose baseline value has changed
+        since the given language last changed its translation.
+        """
+        for key in history.find_stale_keys(baseline, loc):
+            self._log_warning(diagnostic.Diagnostic(
+                diagnostic.STALE_TRANSLATION,
+                "Key '{0}' has changed in '{1}' since it was last translated in '{2}'. "
+                "The translation may be out of date.",
+                (key, baseline.name, loc.name), loc.get_file_name(key), key,
+                location=loc.get_location(key),
+                related_location=baseline.get_location(key)), loc.name)
+
+    def _check_untranslated(self, baseline, loc):
+        """
+        Log a warning for the keys in each file whose value is the same
+        as in the default baseline, i.e. that have not been translated.
+        Values without any letters (e.g. numbers or punctuation),
+        and keys or values that match a pattern in the allowlist, are skipped.
+        """
+        if baseline.name == loc.name:
+            return
+        if self._baseline_hashes is None:
+            self._baseline_hashes = {}
+            for (key, value) in baseline.keys.items():
+                if _LETTER.search(value):
+                    self._baseline_hashes[key] = hash(value)
+
+        for file_name in sorted(loc.files):
+            current_file = loc.files[file_name]
+            key_names = current_file.get_sorted_key_names()
+
+            def is_untranslated(index, file_name=file_name, key_names=key_names):
+                """
+                Return True if the value of the key at 'index' is the same as in the baseline.
+                """
+                key = loc.get_key(file_name, key_names[index])
+                value = loc.keys[key]
+                # compare hashes first so most translated values are rejected cheaply
+                return (self._baseline_hashes.get(key) == hash(value)
+                        and value == baseline.keys[key]
+                        and not self._is_allowed_untranslated(key, value))
+
+            runs = loc_file.filter_runs([(0, len(key_names) - 1)], is_untranslated)
+            if not runs:
+                continue
+
+            count = sum(end - start + 1 for (start, end) in runs)
+            self.untranslated_counts.setdefault(loc.name, {})[file_name] = count
+            location = current_file.get_location(key_names[runs[0][0]])
+            if count == 1 or self.all_keys:
+                for key in _get_run_keys(loc, current_file, runs):
+                    self._log_warning(diagnostic.Diagnostic(
+                        diagnostic.UNTRANSLATED,
+                        "Key '{0}' in '{1}' has the same value as in '{2}'. "
+                        "Has it been translated?",
+                        (key, loc.name, baseline.name), file_name, key,
+                        location=loc.get_location(key),
+                        related_location=baseline.get_location(key)), loc.name)
+            else:
+                self._log_warning(diagnostic.Diagnostic(
+                    diagnostic.UNTRANSLATED,
+                    "{0} keys from '{1}' in '{2}' have the same value as in '{3}': {4}",
+                    (count, file_name, loc.name, baseline.name, _KeyRuns(key_names, runs)),
+                    file_name, count=count, location=location,
+                    keys=_get_run_keys(loc, current_file, runs)), loc.name)
+
+    def _is_allowed_untranslated(self, key, value):
+        """
+        Return True if the given 'filename/keyname' key or its value
+        matches a pattern in the untranslated allowlist.
+        """
+        for pattern in self.untranslated_allowlist:
+            if fnmatch.fnmatchcase(key, pattern) or fnmatch.fnmatchcase(value, pattern):
+                return True
+        return False
+
+    def _compare_files(self, first, second, category, lang, same_files, skip_keys=None):
+        """
+        Log an error for every file and key that is in language 'first' but not in 'second'.
+        Missing files are reported once, and missing keys are reported once per file
+        as runs of consecutive keys, rather than one error per key.
+        Files named in 'same_files' are already known to match and are skipped,
+        as are keys in 'skip_keys'.
+        """
+        for file_name in sorted(first.files):
+            if file_name in same_files:
+                continue
+            first_file = first.files[file_name]
+            if file_name not in second.files:
+                self._log_error(diagnostic.Diagnostic(
+                    category,
+                    "File '{0}' with {1} keys in '{2}' but not in '{3}'",
+                    (file_name, len(first_file.key_names), first.name, second.name),
+                    file_name, count=len(first_file.key_names),
+                    location=first_file.get_location()), lang)
+                continue
+
+            second_file = second.files[file_name]
+            (runs, _) = first_file.compare_keys(second_file)
+            key_names = first_file.get_sorted_key_names()
+            if skip_keys:
+                runs = loc_file.filter_runs(
+                    runs,
+                    lambda index, file_name=file_name, key_names=key_names:
+                    first.get_key(file_name, key_names[index]) not in skip_keys)
+            if not runs:
+                continue
+
+            count = sum(end - start + 1 for (start, end) in runs)
+            location = first_file.get_location(key_names[runs[0][0]])
+            if count == 1:
+                key = first.get_key(file_name, key_names[runs[0][0]])
+                self._log_error(diagnostic.Diagnostic(
+                    category,
+                    "Key '{0}' in '{1}' but not in '{2}'",
+                    (key, first.name, second.name), file_name, key,
+                    location=location, related_location=second_file.get_location()), lang)
+            else:
+                self._log_error(diagnostic.Diagnostic(
+                    category,
+                    "{0} keys from '{1}' in '{2}' but not in '{3}': {4}",
+                    (count, file_name, first.name, second.name, _KeyRuns(key_names, runs)),
+                    file_name, count=count,
+                    location=location, related_location=second_file.get_location(),
+                    keys=_get_run_keys(first, first_file, runs)), lang)
+
+def _get_run_keys(loc, current_file, runs):
+    """
+    Return the 'filename/keyname' keys for the given runs of indexes
+    into the sorted key names of a LocalizationFile.
+    """
+    key_names = current_file.get_sorted_key_names()
+    return [
+        loc.get_key(current_file.name, key_names[index])
+        for (start, end) in runs for index in range(start, end + 1)]
+
+# the most accurate clock available for measuring the time budget
+_clock = getattr(time, 'monotonic', time.time)
+
+def _get_peak_memory_kb():
+    """
+    Return the most memory this process has used so far, in kilobytes,
+    or None if it can't be found.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # macOS gives bytes rather than kilobytes
+        peak //= 1024
+    return peak
+
+# values without any letters (e.g. '...' or '100%') are the same in every language
+_LETTER = re.compile(r'[^\W\d_]', re.UNICODE)
+
+def _ignore_message(msg, lang=None):
+    """
+    Logging callback that throws messages away.
+    """
+    pass
 
 def _cb_format_warning(message, category, filename, lineno, line=None):
     """
@@ -245,6 +1052,69 @@ def _cb_format_warning(message, category, filename, lineno, line=None):
     """
     return message
 
+class _KeyRuns(object):
+    """
+    Describe runs of consecutive keys from one file's sorted key names,
+    e.g. "'a'..'d' (4 keys), 'g'".
+    The text is only built when the message is displayed.
+    """
+
+    # show at most this many runs, to keep messages short
+    _MAX_RUNS = 5
+
+    def __init__(self, sorted_key_names, runs):
+        self.sorted_key_names = sorted_key_names
+        self.runs = runs
+
+    def __str__(self):
+        parts = []
+        for (start, end) in self.runs[:self._MAX_RUNS]:
+            if start == end:
+                parts.append("'{0}'".format(self.sorted_key_names[start]))
+            else:
+                parts.append("'{0}'..'{1}' ({2} keys)".format(
+                    self.sorted_key_names[start], self.sorted_key_names[end], end - start + 1))
+        if len(self.runs) > self._MAX_RUNS:
+            parts.append(
+                "and {0} more ranges. Use --all-keys to list every key"
+                .format(len(self.runs) - self._MAX_RUNS))
+        return ', '.join(parts)
+
+def _format_summary_table(summary_counts):
+    """
+    Return diagnostic counts as a compact table:
+    one column per category, and one row per language
+    followed by one row for each file in that language with diagnostics.
+    """
+    categories = set()
+    for files in summary_counts.values():
+        for counts in files.values():
+            categories.update(counts)
+    if not categories:
+        return "No errors or warnings found."
+    categories = sorted(categories)
+
+    rows = [['Language', 'File'] + categories]
+    for lang in sorted(summary_counts):
+        totals = {}
+        file_rows = []
+        for file_name in sorted(summary_counts[lang]):
+            counts = summary_counts[lang][file_name]
+            for category in counts:
+                totals[category] = totals.get(category, 0) + counts[category]
+            file_rows.append(
+                ['', file_name] + [str(counts.get(c, '-')) for c in categories])
+        rows.append([lang, '(all files)'] + [str(totals.get(c, '-')) for c in categories])
+        rows.extend(file_rows)
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = []
+    for row in rows:
+        cells = [row[0].ljust(widths[0]), row[1].ljust(widths[1])]
+        cells.extend(cell.rjust(width) for (cell, width) in zip(row[2:], widths[2:]))
+        lines.append('  '.join(cells).rstrip())
+    return '\n'.join(lines)
+
 def _get_parser():
     """
     Return a CheckLoc argument parser
@@ -290,14 +1160,602 @@ def _get_parser():
         help="Output messages as JSON rather than standard messages. "
         "Enabling this implies also enabling --group-by-language.")
 
+    parser.add_argument(
+        '--all-keys',
+        default=False,
+        action='store_true',
+        help="Report every missing or extra key individually, "
+        "rather than reporting missing files once "
+        "and grouping missing keys by file.")
+
+    parser.add_argument(
+        '--summary',
+        default=False,
+        action='store_true',
+        help="Only count errors and warnings, rather than printing each message. "
+        "Prints a table of counts by language, file, and category "
+        "(or the counts as JSON, if --json is also specified).")
+
+    parser.add_argument(
+        '--history',
+        metavar='DB',
+        default=None,
+        help="Remember a hash of every localized value in the given SQLite database file, "
+        "and warn about translations that have not changed "
+        "since their baseline value changed in a previous run. "
+        "The file is created if it does not exist.")
+
+    parser.add_argument(
+        '--baseline',
+        metavar='LANG=BASE[,BASE...]',
+        action='append',
+        type=_parse_baseline,
+        default=[],
+        help="Compare LANG against BASE rather than against the default baseline "
+        "(e.g. pt-BR=pt-PT). If more than one BASE is given, "
+        "the first one that exists is used. Can be specified more than once.")
+
+    parser.add_argument(
+        '--default-baseline',
+        metavar='LANG',
+        default=CheckLoc._BASE_LOC,
+        help="Compare languages against LANG unless --baseline says otherwise. "
+        "Default: %(default)s.")
+
+    parser.add_argument(
+        '--shard',
+        metavar='I/N',
+        type=_parse_shard,
+        default=None,
+        help="Split the languages into N groups and only check group I (from 1 to N), "
+        "so a large run can be spread across several machines. "
+        "Combine the --json output of every shard with 'checkloc merge'.")
+
+    parser.add_argument(
+        '--files',
+        metavar='FILE',
+        action='append',
+        default=None,
+        help="Only check the given localization file (e.g. a file changed in a commit), "
+        "in every language it belongs to or is the baseline for. "
+        "Can be specified more than once, once for each file. "
+        "chrome.manifest and install.rdf are only checked if they are listed. "
+        "Use '-' to read a list of files from stdin, one per line.")
+
+    parser.add_argument(
+        '--time-budget',
+        metavar='SECONDS',
+        type=_parse_time_budget,
+        default=None,
+        help="Stop starting new languages after SECONDS. "
+        "Languages already started are finished and reported as usual; "
+        "the rest are listed as not checked, "
+        "and the exit status is {0} if no errors were found.".format(PARTIAL_EXIT_CODE))
+
+    parser.add_argument(
+        '--detect-renames',
+        default=False,
+        action='store_true',
+        help="Report a key that looks like it was renamed in the baseline once, "
+        "as a suggestion to rename it, rather than as one missing key and one extra key.")
+
+    parser.add_argument(
+        '--untranslated',
+        default=False,
+        action='store_true',
+        help="Warn about keys whose value is the same as in the default baseline, "
+        "i.e. that have not been translated.")
+
+    parser.add_argument(
+        '--untranslated-allowlist',
+        metavar='FILE',
+        type=_read_allowlist,
+        default=None,
+        help="File of keys and values that may stay the same in every language "
+        "(e.g. brand names and web addresses), one per line. "
+        "Each line is a pattern matched against both the 'file/key' name and the value, "
+        "where * matches anything (e.g. 'brand.dtd/*' or 'https://*'). "
+        "Lines starting with # are ignored. Implies --untranslated.")
+
+    parser.add_argument(
+        '--known-entity',
+        metavar='NAME',
+        action='append',
+        default=[],
+        help="The name of an entity declared outside the extension "
+        "(e.g. in the application's global .dtd files) that DTD values can refer to "
+        "without an 'undeclared-entity' warning. Can be specified more than once.")
+
+    parser.add_argument(
+        '--parse-processes',
+        metavar='N',
+        type=_parse_process_count,
+        default=None,
+        help=".properties files of 4 MB or more are split into chunks "
+        "that are scanned in parallel by a pool of N processes, "
+        "shared by every language in the run. Defaults to one process per CPU. "
+        "Use 1 to scan every file in the main process.")
+
+    parser.add_argument(
+        '--perf-store',
+        metavar='DB',
+        default=None,
+        help="Save the time taken by each phase of this run, the number of languages, "
+        "files, bytes, and keys read, and the peak memory used, in the given SQLite database file. "
+        "Compare runs with 'checkloc perf-compare'. The file is created if it does not exist.")
+
+    parser.add_argument(
+        '--perf-label',
+        metavar='LABEL',
+        default=None,
+        help="Label this run in the --perf-store database (e.g. with the current revision), "
+        "so all runs with the same label can be compared at once.")
+
+    parser.add_argument(
+        '--profile',
+        metavar='DIR',
+        default=None,
+        help="Profile each phase of the run separately (reading the manifests, "
+        "and parsing and comparing each language) and save the results in DIR: "
+        "a .pstats file for each phase, and a .collapsed file of stacks for flame graph tools. "
+        "File names include the language, e.g. parse-fr.pstats.")
+
+    parser.add_argument(
+        '--limit',
+        metavar='NAME=VALUE',
+        action='append',
+        type=_parse_limit,
+        default=[],
+        help="Skip, with an error, any localization file that exceeds a resource limit, "
+        "so a broken or hostile file can't make a run take too long. Limits and defaults: "
+        "{0}. Can be specified more than once.".format(', '.join(
+            '{0}={1}'.format(name, _format_limit(resource_limits.ResourceLimits.DEFAULTS[name]))
+            for name in sorted(resource_limits.ResourceLimits.DEFAULTS))))
+
+    parser.add_argument(
+        '--save-report',
+        metavar='FILE',
+        default=None,
+        help="Save a JSON report of every error and warning found, "
+        "each with a fingerprint built from its category, language, file, and key, "
+        "for use with --baseline-report.")
+
+    parser.add_argument(
+        '--baseline-report',
+        metavar='FILE',
+        type=_read_report,
+        default=None,
+        help="Only show errors and warnings that are not in FILE, a report saved by an earlier run "
+        "with --save-report, and only exit with an error status for new errors. "
+        "Known problems are counted rather than shown, "
+        "so a project with old problems can stop new ones being added.")
+
+    parser.add_argument(
+        '--index',
+        metavar='DB',
+        default=None,
+        help="Save every key, file, and language found in the given SQLite database file, "
+        "so they can be looked up across all languages with 'checkloc query'. "
+        "Each language checked replaces its own entries. "
+        "The file is created if it does not exist.")
+
     return parser
 
+def _parse_baseline(value):
+    """
+    Parse a LANG=BASE[,BASE...] argument into a tuple (LANG, [BASE, ...]).
+    """
+    (lang, _, bases) = value.partition('=')
+    bases = [base.strip() for base in bases.split(',') if base.strip()]
+    if not lang.strip() or not bases:
+        raise argparse.ArgumentTypeError(
+            "'{0}' is not in the form LANG=BASE[,BASE...]".format(value))
+    return (lang.strip(), bases)
+
+def _read_allowlist(path):
+    """
+    Read an --untranslated-allowlist file into a list of patterns.
+    """
+    try:
+        with io.open(path, 'r', encoding='utf-8') as allowlist_file:
+            lines = [line.strip() for line in allowlist_file]
+    except (IOError, UnicodeDecodeError) as ex:
+        raise argparse.ArgumentTypeError(
+            "could not read allowlist '{0}': {1}".format(path, ex))
+    return [line for line in lines if line and not line.startswith('#')]
+
+def _read_report(path):
+    """
+    Read a --save-report file into a set of diagnostic fingerprints.
+    """
+    try:
+        with open(path, 'r') as report_file:
+            return set(json.load(report_file)['fingerprints'])
+    except (IOError, ValueError, KeyError, TypeError) as ex:
+        raise argparse.ArgumentTypeError(
+            "could not read report '{0}': {1}".format(path, ex))
+
+def _format_limit(number):
+    """
+    Return the text shown for the default value of a resource limit.
+    """
+    return 'off' if number is None else str(number)
+
+def _parse_limit(value):
+    """
+    Parse a NAME=VALUE --limit argument into a tuple (name, number),
+    where the name can be passed to resource_limits.ResourceLimits().
+    """
+    (name, _, number) = value.partition('=')
+    name = name.strip()
+    defaults = resource_limits.ResourceLimits.DEFAULTS
+    if name not in defaults:
+        raise argparse.ArgumentTypeError(
+            "'{0}' is not one of: {1}".format(name, ', '.join(sorted(defaults))))
+    try:
+        # the same type as the default, e.g. whole numbers of bytes.
+        # limits that are off by default are in seconds
+        number = (float if defaults[name] is None else type(defaults[name]))(number)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise argparse.ArgumentTypeError(
+            "'{0}' is not in the form NAME=VALUE, with a VALUE of 0 or more".format(value))
+    return (name.replace('-', '_'), number)
+
+def _parse_time_budget(value):
+    """
+    Parse a --time-budget argument into a number of seconds.
+    """
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = -1
+    if seconds < 0:
+        raise argparse.ArgumentTypeError(
+            "'{0}' is not a number of seconds".format(value))
+    return seconds
+
+def _parse_process_count(value):
+    """
+    Parse a --parse-processes argument into a number of processes.
+    """
+    try:
+        processes = int(value)
+    except ValueError:
+        processes = 0
+    if processes < 1:
+        raise argparse.ArgumentTypeError(
+            "'{0}' is not a positive number of processes".format(value))
+    return processes
+
+def _get_cpu_count():
+    """
+    Return the number of CPUs, or 1 if it is not known.
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def _parse_shard(value):
+    """
+    Parse an I/N argument into a tuple (I, N).
+    """
+    try:
+        (index, count) = [int(part) for part in value.split('/')]
+    except ValueError:
+        index = count = 0
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            "'{0}' is not in the form I/N, with I from 1 to N".format(value))
+    return (index, count)
+
+def _merge_results(results):
+    """
+    Combine the --json output of several --shard runs into one result.
+    Return a tuple (merged result, True if there were any errors).
+    """
+    merged = {}
+    # number of copies of each message kept so far, by language
+    copies = {}
+    errors = False
+    summary = any(_is_summary_result(result) for result in results)
+
+    for result in results:
+        for lang in result:
+            if lang == UNTRANSLATED_COUNTS:
+                # each language is only checked by one shard
+                for (untranslated_lang, counts) in result[lang].items():
+                    merged.setdefault(lang, {}).setdefault(untranslated_lang, {}).update(counts)
+            elif summary:
+                # each language is only checked by one shard,
+                # and anything found by more than one shard
+                # (e.g. problems in manifests, or in a baseline every shard parses)
+                # is found the same number of times by each of them.
+                # so take the largest count rather than adding them up.
+                lang_counts = merged.setdefault(lang, {})
+                for file_name in result[lang]:
+                    file_counts = lang_counts.setdefault(file_name, {})
+                    for (category, count) in result[lang][file_name].items():
+                        file_counts[category] = max(count, file_counts.get(category, 0))
+                        if category not in diagnostic.WARNING_CATEGORIES:
+                            errors = True
+            else:
+                # the same goes for messages: keep as many copies of each message
+                # as the shard that found it the most times.
+                messages = merged.setdefault(lang, [])
+                lang_copies = copies.setdefault(lang, {})
+                shard_copies = {}
+                for msg in result[lang]:
+                    shard_copies[msg] = shard_copies.get(msg, 0) + 1
+                    if shard_copies[msg] > lang_copies.get(msg, 0):
+                        lang_copies[msg] = shard_copies[msg]
+                        messages.append(msg)
+                        if msg.startswith("ERROR: "):
+                            errors = True
+
+    return (merged, errors)
+
+def _merge_main(argv):
+    """
+    Run the 'merge' subcommand:
+    print the combined --json output of several --shard runs,
+    and exit with an error code if any of them found errors.
+    """
+    parser = argparse.ArgumentParser(
+        prog='checkloc merge',
+        description="Combine the --json output of several --shard runs into one report. "
+        "Exits with status 1 if any shard found errors, or {0} if there were no errors "
+        "but some languages were not checked because of --time-budget."
+        .format(PARTIAL_EXIT_CODE))
+    parser.add_argument(
+        'results',
+        metavar='FILE',
+        nargs='+',
+        help="File containing the --json (or --summary --json) output of one shard.")
+    args = parser.parse_args(argv)
+
+    results = []
+    for path in args.results:
+        with open(path, 'r') as result_file:
+            results.append(json.load(result_file))
+    if len(set(_is_summary_result(result) for result in results if result)) > 1:
+        parser.error("Cannot merge --summary output with message output.")
+
+    (merged, errors) = _merge_results(results)
+    print(json.dumps(merged, sort_keys=True, indent=4))
+    if errors:
+        sys.exit(1)
+    elif _is_partial_result(merged):
+        sys.exit(PARTIAL_EXIT_CODE)
+    else:
+        sys.exit(0)
+
+# a 'not-checked' warning in --json message output
+_NOT_CHECKED_MESSAGE = re.compile(r"^WARNING: \((.*)\) Language '\1' was not checked: ")
+
+def _is_partial_result(result):
+    """
+    Return True if the given --json output (e.g. merged from several shards)
+    reports languages that were not checked because a time budget was used up.
+    """
+    for lang in result:
+        if lang == UNTRANSLATED_COUNTS:
+            continue
+        if isinstance(result[lang], dict):
+            # --summary counts
+            if any(diagnostic.NOT_CHECKED in counts for counts in result[lang].values()):
+                return True
+        elif any(_NOT_CHECKED_MESSAGE.match(msg) for msg in result[lang]):
+            return True
+    return False
+
+def _perf_compare_main(argv):
+    """
+    Run the 'perf-compare' subcommand:
+    compare two runs, or two labels, from a --perf-store database,
+    and exit with an error code if the new runs are significantly slower.
+    """
+    parser = argparse.ArgumentParser(
+        prog='checkloc perf-compare',
+        description="Compare the runs saved with --perf-store. "
+        "Times are divided by the megabytes read, so a bigger input does not look like a slowdown. "
+        "Exits with status 1 if the new runs are significantly slower.")
+    parser.add_argument(
+        'db',
+        help="--perf-store database file.")
+    parser.add_argument(
+        'old',
+        help="Run id, or --perf-label of the runs, to compare against.")
+    parser.add_argument(
+        'new',
+        help="Run id, or --perf-label of the runs, to compare.")
+    parser.add_argument(
+        '--alpha',
+        type=float,
+        default=0.05,
+        help="Largest p-value counted as significant. Default: %(default)s.")
+    parser.add_argument(
+        '--min-change',
+        type=float,
+        default=0.05,
+        help="Smallest change counted as a slowdown, e.g. 0.05 for 5%%. Default: %(default)s.")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error("'{0}' does not exist.".format(args.db))
+    store = perf_store.PerfStore(args.db)
+    try:
+        (old_runs, new_runs) = (store.get_runs(args.old), store.get_runs(args.new))
+    finally:
+        store.close()
+    for (selector, runs) in ((args.old, old_runs), (args.new, new_runs)):
+        if not runs:
+            parser.error("No runs with id or label '{0}'.".format(selector))
+
+    rows = perf_store.compare_runs(old_runs, new_runs, args.alpha, args.min_change)
+    print("Comparing {0} run(s) of '{1}' with {2} run(s) of '{3}'.".format(
+        len(old_runs), args.old, len(new_runs), args.new))
+    print(perf_store.format_comparison(rows))
+    if len(old_runs) < 2 or len(new_runs) < 2:
+        print("Save at least two runs of each to test whether differences are significant.")
+    sys.exit(1 if any(row[4] == 'slower' for row in rows) else 0)
+
+def _query_main(argv):
+    """
+    Run the 'query' subcommand:
+    look up keys, files, or a language in an --index database,
+    and exit with an error code if nothing matched.
+    """
+    parser = argparse.ArgumentParser(
+        prog='checkloc query',
+        description="Look up keys, files, or a language in the database saved with --index. "
+        "Names can be exact or globs, where * matches anything "
+        "(e.g. 'browser.dtd/menu.*' for every key starting with 'menu.' in browser.dtd). "
+        "Exits with status 1 if nothing matched.")
+    parser.add_argument(
+        'db',
+        help="--index database file.")
+    parser.add_argument(
+        'key',
+        nargs='?',
+        default=None,
+        help="Show the value of the matching keys in every language, "
+        "and the languages that are missing them. "
+        "A 'file/key' name is matched against whole names, "
+        "and a name without a '/' is matched against keys in any file.")
+    lookup_group = parser.add_mutually_exclusive_group()
+    lookup_group.add_argument(
+        '--file',
+        metavar='FILE',
+        default=None,
+        help="Show the languages that have the matching files, and the languages that lack them.")
+    lookup_group.add_argument(
+        '--locale',
+        metavar='LANG',
+        default=None,
+        help="Show the files in LANG, and the files it lacks that its baseline has.")
+    parser.add_argument(
+        '--json',
+        default=False,
+        action='store_true',
+        help="Output the results as JSON.")
+    args = parser.parse_args(argv)
+
+    if [args.key, args.file, args.locale].count(None) != 2:
+        parser.error("Give exactly one of a key, --file, or --locale.")
+    if not os.path.exists(args.db):
+        parser.error("'{0}' does not exist.".format(args.db))
+
+    index = key_index.KeyIndex(args.db)
+    try:
+        if args.file is not None:
+            results = _query_files(index, args.file)
+        elif args.locale is not None:
+            results = _query_locale(index, args.locale)
+        else:
+            results = _query_keys(index, args.key)
+    finally:
+        index.close()
+
+    if args.json:
+        print(json.dumps(results, sort_keys=True, indent=4))
+    else:
+        for line in _format_query_results(results):
+            print(line)
+    sys.exit(0 if results else 1)
+
+def _query_keys(index, pattern):
+    """
+    Return a dict of the keys matching 'pattern' in an --index database,
+    with the value and location of each key by language, and the languages missing it.
+    """
+    results = {}
+    for (name, lang, value, path, line) in index.find_keys(pattern):
+        result = results.setdefault(name, {'languages': {}})
+        result['languages'][lang] = {'value': value, 'location': '{0}:{1}'.format(path, line)}
+    for name in results:
+        results[name]['missing'] = index.get_missing(results[name]['languages'])
+    return results
+
+def _query_files(index, pattern):
+    """
+    Return a dict of the files matching 'pattern' in an --index database,
+    with the number of keys in each file by language, and the languages missing it.
+    """
+    results = {}
+    files = index.find_files(pattern)
+    for file_name in files:
+        results[file_name] = {
+            'languages': files[file_name], 'missing': index.get_missing(files[file_name])}
+    return results
+
+def _query_locale(index, lang):
+    """
+    Return a dict describing one language in an --index database:
+    the number of keys in each of its files, and the files in its baseline that it lacks.
+    Return an empty dict if the language has not been indexed.
+    """
+    languages = index.get_languages()
+    if lang not in languages:
+        return {}
+    files = index.get_files(lang)
+    baseline = languages[lang]
+    missing = []
+    if baseline is not None:
+        missing = sorted(set(index.get_files(baseline)) - set(files))
+    return {lang: {'baseline': baseline, 'files': files, 'missing': missing}}
+
+def _format_query_results(results):
+    """
+    Return a list of lines showing the results of 'checkloc query'.
+    """
+    lines = []
+    for name in sorted(results):
+        result = results[name]
+        if 'baseline' in result:
+            # a language
+            lines.append("{0}: {1} files, {2} keys{3}".format(
+                name, len(result['files']), sum(result['files'].values()),
+                '' if result['baseline'] is None else
+                ", compared against {0}".format(result['baseline'])))
+            for file_name in sorted(result['files']):
+                lines.append("  {0}: {1} keys".format(file_name, result['files'][file_name]))
+        else:
+            lines.append(name)
+            for lang in sorted(result['languages']):
+                entry = result['languages'][lang]
+                if isinstance(entry, dict):
+                    # a key
+                    lines.append("  {0}: {1}  ({2})".format(
+                        lang, entry['value'], entry['location']))
+                else:
+                    # a file
+                    lines.append("  {0}: {1} keys".format(lang, entry))
+        if result['missing']:
+            lines.append("  missing: {0}".format(', '.join(result['missing'])))
+    if not results:
+        lines.append("Nothing found.")
+    return lines
+
+def _is_summary_result(result):
+    """
+    Return True if the given --json output holds --summary counts
+    rather than messages.
+    """
+    return any(isinstance(result[lang], dict) for lang in result if lang != UNTRANSLATED_COUNTS)
+
 def _parse_args():
     """
     Parse the args and set everything up.
     """
     args = _get_parser().parse_args()
 
+    if args.files and '-' in args.files:
+        args.files = [path for path in args.files if path != '-'] + \
+            [line.strip() for line in sys.stdin if line.strip()]
+
     loglevel = logging.WARNING
     if args.verbose:
         loglevel = logging.INFO
@@ -312,17 +1770,60 @@ def _parse_args():
 
     return args
 
+def _lsp_main(argv):
+    """
+    Run the 'lsp' subcommand: check files as they are edited,
+    as a Language Server Protocol server.
+    """
+    # only needed for this command
+    try:
+        from . import lsp_server
+    except (ImportError, ValueError):
+        import lsp_server
+    lsp_server.main(argv)
+
+# commands other than validating, given as the first argument
+# e.g. 'checkloc merge shard1.json shard2.json'
+_SUBCOMMANDS = {
+    'merge': _merge_main,
+    'lsp': _lsp_main,
+    'perf-compare': _perf_compare_main,
+    'query': _query_main,
+}
+
 def main():
     """
     Parse args and run the program.
     """
+    if len(sys.argv) > 1 and sys.argv[1] in _SUBCOMMANDS:
+        _SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
     args = _parse_args()
-    checkloc = CheckLoc(args.group_by_language, args.json, args.locales_only, args.manifest_dir)
+    checkloc = CheckLoc(args.group_by_language, args.json, args.locales_only, args.manifest_dir,
+                        args.summary, args.all_keys, args.history,
+                        dict(args.baseline), args.default_baseline, args.shard, args.files,
+                        args.time_budget, args.detect_renames,
+                        args.untranslated or args.untranslated_allowlist is not None,
+                        args.untranslated_allowlist, args.perf_store, args.perf_label,
+                        args.profile, resource_limits.ResourceLimits(**dict(args.limit)),
+                        args.index, args.baseline_report, args.save_report,
+                        args.known_entity, args.parse_processes or _get_cpu_count())
     errors = checkloc.validate_loc_files()
 
-    if args.group_by_language:
+    if args.summary:
+        if args.json:
+            print(json.dumps(checkloc.summary_counts, sort_keys=True, indent=4))
+        else:
+            print(_format_summary_table(checkloc.summary_counts))
+    elif checkloc.group_by_language: # also set by --json
         if args.json:
-            print(json.dumps(checkloc.messages_by_language, sort_keys=True, indent=4))
+            output = dict(checkloc.messages_by_language)
+            if checkloc.untranslated:
+                # the counts are also in the text of grouped messages;
+                # give them as numbers as well
+                output[UNTRANSLATED_COUNTS] = checkloc.untranslated_counts
+            print(json.dumps(output, sort_keys=True, indent=4))
         else:
             for lang in sorted(checkloc.messages_by_language):
                 for log_call in checkloc.messages_by_language[lang]:
@@ -330,6 +1831,8 @@ def main():
 
     if errors:
         sys.exit(1)
+    elif checkloc.unchecked_languages:
+        sys.exit(PARTIAL_EXIT_CODE)
     else:
         sys.exit(0)
 
@@ -0,0 +1,130 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hold the details of one error or warning found
+while validating localization data.
+"""
+
+import hashlib
+import re
+
+# Categories used to group and count diagnostics.
+# Each category is only ever used for one level (error or warning)
+# so a count per category is never ambiguous.
+SETUP = 'setup'
+MANIFEST = 'manifest'
+MANIFEST_WARNING = 'manifest-warning'
+NO_KEYS = 'no-keys'
+MISSING_KEY = 'missing-key'
+EXTRA_KEY = 'extra-key'
+SUBS_MISMATCH = 'subs-mismatch'
+RENAMED_KEY = 'renamed-key'
+BOM = 'bom'
+ENCODING = 'encoding'
+RESOURCE_LIMIT = 'resource-limit'
+PARSE_ERROR = 'parse-error'
+DUPLICATE_KEY = 'duplicate-key'
+BLANK_VALUE = 'blank-value'
+EMPTY_VALUE = 'empty-value'
+INVALID_VALUE = 'invalid-value'
+ENTITY_REFERENCE = 'entity-reference'
+UNDECLARED_ENTITY = 'undeclared-entity'
+DEEP_ENTITY_REFERENCE = 'deep-entity-reference'
+TOO_MANY_SUBS = 'too-many-subs'
+EMPTY_FILE = 'empty-file'
+IGNORED_FILE = 'ignored-file'
+STALE_TRANSLATION = 'stale-translation'
+UNTRANSLATED = 'untranslated'
+NOT_CHECKED = 'not-checked'
+
+# line and column numbers inside message text, left out of fingerprints
+# e.g. 'on line 3', 'Line 2, Col 21', 'byte offset 81', or '<string>:2:21:'
+_POSITION = re.compile(r'(\b(?:[Ll]ine|Col|offset)\s+|:)\d+')
+
+# categories only used for warnings. every other category is an error.
+WARNING_CATEGORIES = frozenset([
+    MANIFEST_WARNING, EMPTY_VALUE, UNDECLARED_ENTITY, DEEP_ENTITY_REFERENCE, EMPTY_FILE,
+    IGNORED_FILE, STALE_TRANSLATION, UNTRANSLATED, NOT_CHECKED])
+
+class Diagnostic(object):
+    """
+    One error or warning found while validating localization data.
+
+    The message text is only built when something actually asks for it
+    (i.e. when the diagnostic is printed or saved),
+    so runs that only count diagnostics never pay for formatting.
+    """
+
+    def __init__(self, category, template, args=(), file_name=None, key=None, count=1,
+                 location=None, related_location=None, keys=None):
+        """
+        Create a new Diagnostic.
+        'template' is a str.format() string that is filled in with 'args' on demand.
+        'count' is the number of problems this one diagnostic reports
+        (e.g. the number of keys missing from a file).
+        'location' is where the problem was found,
+        and 'related_location' is the matching place in another file (e.g. in the baseline),
+        if any. Both are shown as path:line:col.
+        'keys' is the list of every key a grouped diagnostic reports
+        (e.g. keys missing from a file), so each of them has its own fingerprint.
+        """
+        self.category = category
+        self.template = template
+        self.args = args
+        self.file_name = file_name
+        self.key = key
+        self.count = count
+        self.location = location
+        self.related_location = related_location
+        self.keys = keys
+
+    def get_fingerprints(self, lang):
+        """
+        Return a list of the fingerprints of the problems this diagnostic reports:
+        one for each key of a grouped diagnostic, so a key reported in a group
+        has the same fingerprint as when it is reported alone,
+        and adding a key to a group adds a new fingerprint.
+        """
+        if self.keys is None:
+            return [self.get_fingerprint(lang)]
+        return [self.get_fingerprint(lang, key) for key in self.keys]
+
+    def get_fingerprint(self, lang, key=None):
+        """
+        Return a short hash identifying this problem from one run to the next,
+        built from the category, the language it was found in, the file, and the key.
+        Line numbers and message wording are left out, so editing other parts of a file
+        (or changing how a message is worded) does not change the fingerprint.
+        Problems with no key (e.g. parse errors, or problems in chrome.manifest)
+        include their message instead, without any line or column numbers,
+        so two different problems in one file have different fingerprints.
+        'key' is used in place of the diagnostic's own key, e.g. for one key of a group.
+        """
+        key = key or self.key
+        parts = [self.category, lang, self.file_name or '', key or '']
+        if key is None:
+            parts.append(_POSITION.sub(r'\1', self.template.format(*self.args)))
+        data = b'\0'.join(
+            part if isinstance(part, bytes) else part.encode('utf-8') for part in parts)
+        return hashlib.sha1(data).hexdigest()[:16]
+
+    def __str__(self):
+        message = self.template.format(*self.args)
+        if self.location is not None:
+            message = "{0}: {1}".format(self.location, message)
+        if self.related_location is not None:
+            message = "{0} (see {1})".format(message, self.related_location)
+        return message
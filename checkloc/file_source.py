@@ -0,0 +1,240 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Read files and folders either from disk
+or from inside .xpi and .jar archives, without extracting them.
+"""
+
+import io
+import os
+import posixpath
+import zipfile
+
+class FileSource(object):
+    """
+    Read files and folders either from disk
+    or from inside .xpi and .jar archives, without extracting them.
+
+    Paths inside an archive are written the same way as in jar: URIs:
+    the path of the archive, then '!/', then the path inside the archive. e.g.
+        /path/to/extension.xpi!/chrome/locale/en-US/main.dtd
+    An archive inside another archive adds another '!/', e.g.
+        /path/to/extension.xpi!/chrome/extension.jar!/locale/en-US/main.dtd
+    Any other path is read from disk as usual.
+    """
+
+    ARCHIVE_SEPARATOR = '!/'
+    # the top folder of an archive is written as the archive path followed by this
+    _ARCHIVE_ROOT = '!'
+
+    def __init__(self):
+        # every archive that has been opened, by archive path.
+        # each entry is a tuple (zip file, folder index),
+        # or None if the path is not an archive.
+        # the folder index holds the (set of sub-folders, list of files)
+        # inside each folder of the archive.
+        self._archives = {}
+        # number of whole files and of bytes read so far
+        self.files_read = 0
+        self.bytes_read = 0
+
+    def is_archive(self, path):
+        """
+        Return True if the given path is an archive (e.g. an .xpi or .jar file)
+        that can be read from.
+        """
+        return self._get_archive(path) is not None
+
+    def get_archive_root(self, path):
+        """
+        Return the path of the top folder inside the given archive.
+        """
+        return path + self._ARCHIVE_ROOT
+
+    def exists(self, path):
+        """
+        Return True if the given file or folder exists.
+        """
+        (archive, member) = self._split(path)
+        if archive is None:
+            return os.path.exists(path)
+        return member in archive[1] or self._is_member_file(archive, member)
+
+    def isdir(self, path):
+        """
+        Return True if the given path is a folder.
+        """
+        (archive, member) = self._split(path)
+        if archive is None:
+            return os.path.isdir(path)
+        return member in archive[1]
+
+    def walk(self, path):
+        """
+        Yield a tuple (folder path, sub-folder names, file names)
+        for the given folder and every folder below it, like os.walk().
+        """
+        (archive, member) = self._split(path)
+        if archive is None:
+            for entry in os.walk(path):
+                yield entry
+            return
+
+        index = archive[1]
+        pending = [(path, member)]
+        while pending:
+            (folder_path, folder) = pending.pop(0)
+            if folder not in index:
+                continue
+            (sub_folders, files) = index[folder]
+            sub_folders = sorted(sub_folders)
+            yield (folder_path, sub_folders, list(files))
+            for sub_folder in sub_folders:
+                pending.append((
+                    os.path.join(folder_path, sub_folder),
+                    posixpath.join(folder, sub_folder)))
+
+    def getsize(self, path):
+        """
+        Return the size of the given file in bytes, without reading it.
+        """
+        (archive, member) = self._split(path)
+        if archive is None:
+            return os.path.getsize(path)
+        return archive[0].getinfo(member).file_size
+
+    def read(self, path, size=-1):
+        """
+        Return the contents of the given file as bytes.
+        If 'size' is given only read up to that many bytes.
+        """
+        (archive, member) = self._split(path)
+        if archive is None:
+            with open(path, 'rb') as openfile:
+                data = openfile.read(size)
+        else:
+            # members are read straight out of the archive
+            with archive[0].open(member) as openfile:
+                data = openfile.read(size)
+        if size < 0:
+            self.files_read += 1
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        """
+        Close every open archive.
+        """
+        for archive in self._archives.values():
+            if archive is not None:
+                archive[0].close()
+        self._archives = {}
+
+    def _split(self, path):
+        """
+        Split a path into a tuple (archive, path inside the archive).
+        If the path is not inside an archive return (None, path).
+        """
+        if path.endswith(self._ARCHIVE_ROOT):
+            (archive_path, member) = (path[:-1], '')
+        else:
+            pos = path.rfind(self.ARCHIVE_SEPARATOR)
+            if pos == -1:
+                return (None, path)
+            (archive_path, member) = (path[:pos], path[pos + len(self.ARCHIVE_SEPARATOR):])
+
+        archive = self._get_archive(archive_path)
+        if archive is None:
+            return (None, path)
+
+        member = member.replace(os.sep, '/').strip('/')
+        if member:
+            member = posixpath.normpath(member)
+        return (archive, member)
+
+    def _get_archive(self, path):
+        """
+        Open the archive at the given path, if it has not already been opened,
+        and return a tuple (zip file, folder index),
+        or None if the path is not an archive.
+        """
+        if path in self._archives:
+            return self._archives[path]
+
+        archive = None
+        (outer_archive, member) = self._split(path)
+        try:
+            if outer_archive is None:
+                if os.path.isfile(path):
+                    archive = _open_zip(path)
+            elif self._is_member_file(outer_archive, member):
+                # zipfile needs to seek, which archive members can't do,
+                # so read archives inside archives into memory
+                archive = _open_zip(io.BytesIO(outer_archive[0].read(member)))
+        except (zipfile.BadZipfile, IOError):
+            archive = None
+
+        self._archives[path] = archive
+        return archive
+
+    @staticmethod
+    def _is_member_file(archive, member):
+        """
+        Return True if 'member' is a file inside the given archive.
+        """
+        try:
+            archive[0].getinfo(member)
+        except KeyError:
+            return False
+        return not member.endswith('/')
+
+def to_text(data):
+    """
+    Return bytes read from a file as str, so they can be displayed and compared.
+    Files are UTF-8; invalid byte sequences are reported separately,
+    so they are replaced here rather than raising an error.
+    On Python 2 bytes already are str, and are returned unchanged.
+    """
+    if isinstance(data, str):
+        return data
+    return data.decode('utf-8', 'replace')
+
+def _open_zip(source):
+    """
+    Open a zip file and index its folders.
+    Return a tuple (zip file, folder index).
+    """
+    zip_file = zipfile.ZipFile(source)
+    index = {'': (set(), [])}
+    for name in zip_file.namelist():
+        parts = name.strip('/').split('/')
+        folder = ''
+        for part in parts[:-1]:
+            index[folder][0].add(part)
+            folder = posixpath.join(folder, part)
+            if folder not in index:
+                index[folder] = (set(), [])
+        if name.endswith('/'):
+            index[folder][0].add(parts[-1])
+            folder = posixpath.join(folder, parts[-1])
+            if folder not in index:
+                index[folder] = (set(), [])
+        else:
+            index[folder][1].append(parts[-1])
+    return (zip_file, index)
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,165 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Remember hashes of localization values between runs,
+so translations that were not updated after their baseline string changed
+can be found.
+"""
+
+import hashlib
+import sqlite3
+import time
+
+class HistoryStore(object):
+    """
+    Remember hashes of localization values between runs,
+    so translations that were not updated after their baseline string changed
+    can be found.
+
+    Data is kept in an SQLite database:
+    - runs records each run in which a baseline changed.
+    - baseline_values records the hash of each baseline value
+      every time it changes, along with the run it changed in.
+    - translations records, for each translated key and the baseline it was compared against,
+      the hash of the translated value and the hash of the baseline value
+      at the time the translation last changed.
+      A language compared against a different baseline (e.g. with a new fallback)
+      starts again from its current values, rather than comparing against another baseline.
+    """
+
+    def __init__(self, db_path):
+        """
+        Open (or create) the history database at the given path.
+        """
+        self.connection = sqlite3.connect(db_path)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(translations)")]
+        if columns and 'baseline' not in columns:
+            # histories from older versions don't record which baseline each translation
+            # was compared against, so start them again
+            self.connection.execute("DROP TABLE translations")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                started REAL NOT NULL,
+                baseline TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS baseline_values (
+                baseline TEXT NOT NULL,
+                key TEXT NOT NULL,
+                run_id INTEGER NOT NULL,
+                value_hash TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS baseline_values_by_key
+                ON baseline_values (baseline, key, run_id);
+            CREATE TABLE IF NOT EXISTS translations (
+                lang TEXT NOT NULL,
+                baseline TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value_hash TEXT NOT NULL,
+                baseline_hash TEXT NOT NULL,
+                PRIMARY KEY (lang, baseline, key));
+            """)
+        self.run_id = None
+
+    def record_baseline(self, baseline):
+        """
+        Record the hash of every baseline value that has changed since it was last recorded,
+        in a new run. Nothing is added if no value has changed,
+        so the history only grows when the baseline does.
+        """
+        latest = dict(self.connection.execute(
+            "SELECT key, value_hash FROM baseline_values AS b "
+            "WHERE baseline = ? AND run_id = "
+            "(SELECT MAX(run_id) FROM baseline_values "
+            "WHERE baseline = b.baseline AND key = b.key)",
+            (baseline.name,)))
+
+        changed = []
+        for key in baseline.keys:
+            value_hash = hash_value(baseline.keys[key])
+            if latest.get(key) != value_hash:
+                changed.append((key, value_hash))
+        if not changed:
+            return
+
+        cursor = self.connection.execute(
+            "INSERT INTO runs (started, baseline) VALUES (?, ?)", (time.time(), baseline.name))
+        self.run_id = cursor.lastrowid
+        self.connection.executemany(
+            "INSERT INTO baseline_values (baseline, key, run_id, value_hash) "
+            "VALUES (?, ?, ?, ?)",
+            [(baseline.name, key, self.run_id, value_hash) for (key, value_hash) in changed])
+
+    def get_baseline_hashes(self, baseline_name, keys):
+        """
+        Return a dict of the last recorded hash of each given key in the baseline,
+        for keys that have been recorded.
+        Keys that have since been removed from the baseline keep their last hash.
+        """
+        hashes = {}
+        for key in keys:
+            row = self.connection.execute(
+                "SELECT value_hash FROM baseline_values WHERE baseline = ? AND key = ? "
+                "ORDER BY run_id DESC LIMIT 1", (baseline_name, key)).fetchone()
+            if row:
+                hashes[key] = row[0]
+        return hashes
+
+    def find_stale_keys(self, baseline, loc):
+        """
+        Return a sorted list of keys in 'loc' whose value in 'baseline'
+        has changed since the translation last changed,
+        and remember the current translated values for next time.
+        """
+        stored = {}
+        for (key, value_hash, baseline_hash) in self.connection.execute(
+                "SELECT key, value_hash, baseline_hash FROM translations "
+                "WHERE lang = ? AND baseline = ?", (loc.name, baseline.name)):
+            stored[key] = (value_hash, baseline_hash)
+
+        stale = []
+        updates = []
+        for key in loc.keys:
+            if key not in baseline.keys:
+                continue
+            value_hash = hash_value(loc.keys[key])
+            baseline_hash = hash_value(baseline.keys[key])
+            if key not in stored or stored[key][0] != value_hash:
+                # new or changed translation: it matches the current baseline
+                updates.append((loc.name, baseline.name, key, value_hash, baseline_hash))
+            elif stored[key][1] != baseline_hash:
+                stale.append(key)
+
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO translations "
+            "(lang, baseline, key, value_hash, baseline_hash) VALUES (?, ?, ?, ?, ?)", updates)
+        return sorted(stale)
+
+    def close(self):
+        """
+        Save all changes and close the database.
+        """
+        self.connection.commit()
+        self.connection.close()
+
+def hash_value(value):
+    """
+    Return a short hash of a localization value.
+    """
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return hashlib.sha1(value).hexdigest()[:16]
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,195 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Keep an index of every key, file, and language found by a run,
+so they can be looked up across all languages without reading any files.
+"""
+
+import sqlite3
+import time
+
+class KeyIndex(object):
+    """
+    Keep an index of every key, file, and language found by a run,
+    so they can be looked up across all languages without reading any files.
+
+    Data is kept in an SQLite database:
+    - languages records each language, the language it is compared against,
+      and when it was last indexed.
+    - files records the number of keys in each file of each language.
+    - entries records the value and location of each key in each language.
+
+    Each language replaces its own rows when it is indexed,
+    so shards of a run can share one index.
+    """
+
+    # characters that make a pattern a glob rather than an exact name
+    _GLOB_CHARS = '*?['
+
+    def __init__(self, db_path):
+        """
+        Open (or create) the index database at the given path.
+        """
+        self.connection = sqlite3.connect(db_path)
+        # keep native strings: on Python 2 keys and values are UTF-8 bytes
+        self.connection.text_factory = str
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS languages (
+                lang TEXT PRIMARY KEY,
+                baseline TEXT,
+                indexed REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS files (
+                lang TEXT NOT NULL,
+                file TEXT NOT NULL,
+                keys INTEGER NOT NULL,
+                PRIMARY KEY (lang, file));
+            CREATE INDEX IF NOT EXISTS files_by_file ON files (file);
+            CREATE TABLE IF NOT EXISTS entries (
+                name TEXT NOT NULL,
+                key TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                file TEXT NOT NULL,
+                value TEXT NOT NULL,
+                path TEXT NOT NULL,
+                line INTEGER NOT NULL,
+                PRIMARY KEY (name, lang));
+            CREATE INDEX IF NOT EXISTS entries_by_key ON entries (key);
+            CREATE INDEX IF NOT EXISTS entries_by_file ON entries (lang, file);
+            """)
+
+    def record_language(self, loc, baseline_name=None, only_files=None):
+        """
+        Replace everything indexed for the given LocalizationLanguage with its current keys.
+        'baseline_name' is the language it is compared against, if any.
+        If 'only_files' is given only those files were read,
+        so only the entries for those files are replaced.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO languages (lang, baseline, indexed) VALUES (?, ?, ?)",
+            (loc.name, baseline_name, time.time()))
+        if only_files is None:
+            for table in ('files', 'entries'):
+                self.connection.execute(
+                    "DELETE FROM {0} WHERE lang = ?".format(table), (loc.name,))
+        else:
+            for file_name in only_files:
+                for table in ('files', 'entries'):
+                    self.connection.execute(
+                        "DELETE FROM {0} WHERE lang = ? AND file = ?".format(table),
+                        (loc.name, file_name))
+
+        self.connection.executemany(
+            "INSERT INTO files (lang, file, keys) VALUES (?, ?, ?)",
+            [(loc.name, file_name, len(loc.files[file_name].key_names))
+             for file_name in loc.files])
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO entries (name, key, lang, file, value, path, line) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            self._get_entries(loc))
+
+    @staticmethod
+    def _get_entries(loc):
+        """
+        Yield a row of the entries table for every key in the given LocalizationLanguage.
+        """
+        for file_name in loc.files:
+            loc_file = loc.files[file_name]
+            for key_name in loc_file.key_names:
+                key = loc.get_key(file_name, key_name)
+                location = loc_file.get_location(key_name)
+                yield (key, key_name, loc.name, file_name, loc.keys[key],
+                       location.path, location.get_line_and_column()[0])
+
+    def remove_languages_except(self, langs):
+        """
+        Remove every language that is not in 'langs',
+        e.g. because it is no longer on disk.
+        """
+        for (lang,) in self.connection.execute("SELECT lang FROM languages").fetchall():
+            if lang not in langs:
+                for table in ('languages', 'files', 'entries'):
+                    self.connection.execute(
+                        "DELETE FROM {0} WHERE lang = ?".format(table), (lang,))
+
+    def get_languages(self):
+        """
+        Return a dict of the language each indexed language is compared against
+        (None for the default baseline), by language.
+        """
+        return dict(self.connection.execute("SELECT lang, baseline FROM languages"))
+
+    def get_missing(self, present):
+        """
+        Return a sorted list of the languages that lack something their baseline has,
+        given the collection of languages that have it.
+        """
+        return sorted(
+            lang for (lang, baseline) in self.get_languages().items()
+            if baseline in present and lang not in present)
+
+    def find_keys(self, pattern):
+        """
+        Return a sorted list of tuples (name, lang, value, path, line)
+        for every key matching 'pattern' in every language.
+        A pattern with a '/' is matched against the whole 'file/key' name,
+        and one without is matched against the key name in any file.
+        Patterns can be exact names or globs, e.g. 'browser.dtd/menu.*' or '*.label'.
+        """
+        column = 'name' if '/' in pattern else 'key'
+        (condition, args) = self._get_match(column, pattern)
+        return self.connection.execute(
+            "SELECT name, lang, value, path, line FROM entries WHERE " + condition +
+            " ORDER BY name, lang", args).fetchall()
+
+    def find_files(self, pattern):
+        """
+        Return a dict of files whose names match 'pattern' (an exact name or a glob),
+        where each file has a dict of its number of keys by language.
+        """
+        (condition, args) = self._get_match('file', pattern)
+        files = {}
+        for (file_name, lang, keys) in self.connection.execute(
+                "SELECT file, lang, keys FROM files WHERE " + condition, args):
+            files.setdefault(file_name, {})[lang] = keys
+        return files
+
+    def get_files(self, lang):
+        """
+        Return a dict of the number of keys in each file of the given language.
+        """
+        return dict(self.connection.execute(
+            "SELECT file, keys FROM files WHERE lang = ?", (lang,)))
+
+    def _get_match(self, column, pattern):
+        """
+        Return an SQL condition, and its arguments, matching 'column' against
+        an exact name or a glob.
+        GLOB is case sensitive, so SQLite uses the column's index
+        for the text before the first wildcard (e.g. for prefixes such as 'browser.dtd/*').
+        """
+        if any(char in pattern for char in self._GLOB_CHARS):
+            return ("{0} GLOB ?".format(column), (pattern,))
+        return ("{0} = ?".format(column), (pattern,))
+
+    def close(self):
+        """
+        Save all changes and close the database.
+        """
+        self.connection.commit()
+        self.connection.close()
+
+if __name__ == '__main__':
+    pass
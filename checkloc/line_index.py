@@ -0,0 +1,114 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Map byte offsets inside a file to line and column numbers.
+"""
+
+import array
+import bisect
+import re
+
+class LineIndex(object):
+    """
+    Map byte offsets inside a file to line and column numbers.
+
+    Lines end with '\n', '\r\n', '\r', or '\f',
+    the same characters that end a line in .properties files.
+    Only the offset where each line starts is stored,
+    so the index stays small even for very large files.
+    """
+
+    _LINE_BREAK = re.compile(br'\r\n|[\n\r\f]')
+
+    def __init__(self, data):
+        """
+        Create a new LineIndex for the given file contents.
+        """
+        self._line_starts = array.array('L', [0])
+        # lines that end with the two bytes '\r\n'
+        self._crlf_lines = set()
+        if b'\r' not in data and b'\f' not in data:
+            # the usual case, and much faster than a regular expression
+            pos = data.find(b'\n')
+            while pos != -1:
+                self._line_starts.append(pos + 1)
+                pos = data.find(b'\n', pos + 1)
+            return
+
+        for line_break in self._LINE_BREAK.finditer(data):
+            if line_break.end() - line_break.start() == 2:
+                self._crlf_lines.add(len(self._line_starts))
+            self._line_starts.append(line_break.end())
+
+    def get_line_count(self):
+        """
+        Return the number of lines in the file.
+        """
+        return len(self._line_starts)
+
+    def get_line_and_column(self, offset):
+        """
+        Return a tuple (line, column) for the given byte offset.
+        Both numbers start at 1.
+        """
+        line = bisect.bisect_right(self._line_starts, offset)
+        return (line, offset - self._line_starts[line - 1] + 1)
+
+    def get_line_offsets(self, line):
+        """
+        Return a tuple (start, end) of the byte offsets of the given line,
+        not including the line break.
+        """
+        start = self._line_starts[line - 1]
+        if line < len(self._line_starts):
+            end = self._line_starts[line] - (2 if line in self._crlf_lines else 1)
+        else:
+            end = None
+        return (start, end)
+
+class FileLocation(object):
+    """
+    A place inside a file, shown as path:line:col.
+    The line and column are only calculated when the location is displayed.
+    """
+
+    def __init__(self, path, line_index=None, offset=0, line=None, column=1):
+        """
+        Create a new FileLocation,
+        either from a LineIndex and byte offset or from an explicit line and column.
+        """
+        self.path = path
+        self.line_index = line_index
+        self.offset = offset
+        self._line = line
+        self._column = column
+
+    def get_line_and_column(self):
+        """
+        Return a tuple (line, column) for this location. Both numbers start at 1.
+        """
+        if self._line is not None:
+            return (self._line, self._column)
+        if self.line_index is None:
+            return (1, 1)
+        return self.line_index.get_line_and_column(self.offset)
+
+    def __str__(self):
+        (line, column) = self.get_line_and_column()
+        return "{0}:{1}:{2}".format(self.path, line, column)
+
+if __name__ == '__main__':
+    pass
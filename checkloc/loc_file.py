@@ -0,0 +1,161 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hold the keys read from one localization file,
+so files can be compared to each other as a whole.
+"""
+
+import hashlib
+import struct
+
+# allow importing both as a package and from the command line
+try:
+    from . import line_index
+except (ImportError, ValueError):
+    import line_index
+
+class LocalizationFile(object):
+    """
+    Hold the keys read from one localization file,
+    so files can be compared to each other as a whole.
+    """
+
+    def __init__(self, name, path, index=None):
+        """
+        Create a new LocalizationFile.
+        'index' is a line_index.LineIndex for the file contents, if available.
+        """
+        self.name = name
+        self.path = path
+        self.line_index = index
+        # names of the valid keys in this file (without the file name),
+        # in the order they were read
+        self.key_names = []
+        # byte offset where each key is defined, by key name
+        self.key_offsets = {}
+        self._sorted_key_names = None
+        self._fingerprint = 0
+
+    def add_key_name(self, key_name, offset=0, subs=None):
+        """
+        Record a valid key found in this file, and the byte offset where it is defined.
+        'subs' is the string substitution signature of the key's value, if it has one.
+        """
+        self.key_names.append(key_name)
+        self.key_offsets[key_name] = offset
+        self._sorted_key_names = None
+
+        # add the hash of each key to a running total,
+        # so the fingerprint does not depend on the order keys are read in
+        entry = _to_bytes(key_name) + b'\0'
+        if subs is not None:
+            entry += b'\0' + _to_bytes(subs)
+        (entry_hash,) = struct.unpack('<Q', hashlib.md5(entry).digest()[:8])
+        self._fingerprint = (self._fingerprint + entry_hash) & 0xFFFFFFFFFFFFFFFF
+
+    def get_fingerprint(self):
+        """
+        Return a number that identifies the set of keys in this file
+        and their string substitution signatures, regardless of their order.
+        Two files with the same fingerprint have the same keys and substitutions.
+        """
+        return self._fingerprint
+
+    def get_offset_location(self, offset):
+        """
+        Return a line_index.FileLocation for the given byte offset in this file.
+        """
+        return line_index.FileLocation(self.path, self.line_index, offset)
+
+    def get_location(self, key_name=None):
+        """
+        Return a line_index.FileLocation for where the given key is defined,
+        or for the start of the file if no key is given.
+        """
+        return self.get_offset_location(self.key_offsets.get(key_name, 0))
+
+    def get_sorted_key_names(self):
+        """
+        Return the names of all keys in this file, in sorted order.
+        """
+        if self._sorted_key_names is None:
+            self._sorted_key_names = sorted(self.key_names)
+        return self._sorted_key_names
+
+    def compare_keys(self, other):
+        """
+        Compare the keys in this file to the keys in another LocalizationFile.
+
+        Return a tuple (only_here, only_there) of lists of runs.
+        Each run is a tuple (start, end) of indexes into the sorted key names
+        of this file or the other file respectively,
+        covering consecutive keys that only exist in that file.
+        """
+        here = self.get_sorted_key_names()
+        there = other.get_sorted_key_names()
+        only_here = []
+        only_there = []
+
+        i = j = 0
+        while i < len(here) and j < len(there):
+            if here[i] == there[j]:
+                i += 1
+                j += 1
+            elif here[i] < there[j]:
+                _add_to_runs(only_here, i)
+                i += 1
+            else:
+                _add_to_runs(only_there, j)
+                j += 1
+        for i in range(i, len(here)):
+            _add_to_runs(only_here, i)
+        for j in range(j, len(there)):
+            _add_to_runs(only_there, j)
+
+        return (only_here, only_there)
+
+def filter_runs(runs, keep):
+    """
+    Return a list of (start, end) runs of indexes
+    with only the indexes for which keep(index) is True.
+    """
+    filtered = []
+    for (start, end) in runs:
+        for index in range(start, end + 1):
+            if keep(index):
+                _add_to_runs(filtered, index)
+    return filtered
+
+def _to_bytes(text):
+    """
+    Return the given text as bytes, so it can be hashed.
+    """
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+def _add_to_runs(runs, index):
+    """
+    Add an index to a list of (start, end) runs of consecutive indexes,
+    extending the last run if possible.
+    """
+    if runs and runs[-1][1] == index - 1:
+        runs[-1] = (runs[-1][0], index)
+    else:
+        runs.append((index, index))
+
+if __name__ == '__main__':
+    pass
@@ -19,11 +19,12 @@ to create, hold, and work with one particular localization language.
 """
 
 import codecs
-import linecache
+import io
 import logging
 import os
 import re
 import sys
+import time
 
 try:
     from lxml import etree
@@ -33,6 +34,20 @@ except ImportError:
         "Please install the python 'lxml' library to run localization tests.")
     sys.exit(1)
 
+# allow importing both as a package and from the command line
+try:
+    from . import diagnostic
+    from . import file_source
+    from . import line_index
+    from . import loc_file
+    from . import resource_limits
+except (ImportError, ValueError):
+    import diagnostic
+    import file_source
+    import line_index
+    import loc_file
+    import resource_limits
+
 class LocalizationLanguage(object):
     """
     Encapsulate all of the parsing, storage, and logic necessary
@@ -56,18 +71,52 @@ class LocalizationLanguage(object):
     #   name=string
     #   name:string
     # Assumptions: both comments and entries exist only on a single line.
-    _PROP_COMMENT = re.compile(r'^\s*[#!]+[^\n\r\f]*[\n\r\f]+', re.MULTILINE)
-    _PROP_SEP = re.compile(r'[\n\r\f]')
+    _PROP_COMMENT = re.compile(br'^\s*[#!]+[^\n\r\f]*[\n\r\f]+', re.MULTILINE)
+    _PROP_SEP = re.compile(br'[\n\r\f]')
     # almost any character is a valid .properties key
     # except : and = , which note the transition to a value,
     # and spaces.
     # Because we parse and remove PROP_COMMENTs first, that regex will catch any
     # '#' or '!' characters that are found as the first non-whitespace part of a line.
     # This means we can allow # and ! inside this regex and it's not as complex.
-    _PROP_LINE = re.compile(r'^\s*([A-Za-z0-9_.\-+\\{}\[\]!@#$%^&*()/<>,?;\'"`~|]+)\s*[=:]\s*([^\n\r\f]*)')
+    _PROP_LINE = re.compile(br'^\s*([A-Za-z0-9_.\-+\\{}\[\]!@#$%^&*()/<>,?;\'"`~|]+)\s*[=:]\s*([^\n\r\f]*)')
+
+    # if a parse pool is given, .properties files at least this large are split
+    # into chunks of about _PROPERTIES_CHUNK_BYTES, and the chunks are scanned in parallel.
+    # keep this well under the default 'bytes' resource limit, or no file would ever be split
+    _PARALLEL_PROPERTIES_BYTES = 4 * 1024 * 1024
+    _PROPERTIES_CHUNK_BYTES = 1024 * 1024
+    # chunks end after a line break that is followed by something other than whitespace.
+    # no comment can continue past such a break,
+    # so every chunk has exactly the lines and comments it would have in the whole file
+    _PROP_CHUNK_BOUNDARY = re.compile(br'\n(?=\S)')
 
     _DTD_PARSE_ERROR = re.compile(r'([^:]*):([^:]*):([^:]*):([^:]*):([^:]*):([^:]*):(.*)', re.DOTALL)
 
+    # find where each DTD entity is declared, so keys can be given a line and column.
+    # lxml does not report this itself.
+    # comments are matched as well so that declarations inside them can be skipped.
+    _DTD_ENTITY_DECL = re.compile(br'<!--.*?-->|<!ENTITY\s+([^\s%"\'>]+)', re.DOTALL)
+
+    # references to other entities inside a DTD entity value, e.g. '&brandShortName;'.
+    # character references such as '&#38;' are not matched.
+    _DTD_ENTITY_REF = re.compile(r'&([A-Za-z_:][A-Za-z0-9_:.\-]*);')
+    # entities that every XML parser already knows
+    _XML_PREDEFINED_ENTITIES = frozenset(['amp', 'lt', 'gt', 'quot', 'apos'])
+    # entities defined by the application rather than by the extension, in
+    # chrome://branding/locale/brand.dtd , which extensions often include alongside their own files.
+    # entities from any other application .dtd file can be added with 'known_entities'
+    _BRAND_ENTITIES = frozenset([
+        'brandShortName', 'brandShorterName', 'brandFullName',
+        'vendorShortName', 'trademarkInfo'])
+    # warn about values that expand references inside references more deeply than this
+    _MAX_ENTITY_DEPTH = 8
+
+    # localization files must be UTF-8.
+    # most files are plain ASCII, which is always valid UTF-8,
+    # so only decode from the first byte outside ASCII
+    _NON_ASCII = re.compile(br'[\x80-\xff]')
+
     # Firefox does not allow more than ten string substitution parameters, for performance reasons.
     # For details see nsStringBundle.cpp
     # https://mxr.mozilla.org/mozilla-central/source/intl/strres/nsStringBundle.cpp
@@ -79,19 +128,45 @@ class LocalizationLanguage(object):
     # as it probably won't do what the author intended.
     _MOZILLA_MAX_PROPERTIES_STRING_SUBS = 10
 
-    def __init__(self, localization_base_dir, language, log_warning, log_error):
+    def __init__(self, localization_base_dir, language, log_warning, log_error, source=None,
+                 limits=None, known_entities=None, get_parse_pool=None):
         """
         Create a new LocalizationLanguage.
+        'source' is the file_source.FileSource used to read files,
+        so localizations inside .xpi or .jar archives can be read.
+        'limits' is the resource_limits.ResourceLimits for reading each file;
+        files that exceed them are skipped.
+        'known_entities' is a list of the names of entities declared outside the extension
+        (e.g. in the application's global .dtd files) that values can refer to.
+        'get_parse_pool' is a function that returns the multiprocessing.Pool
+        used to scan large .properties files in parallel chunks.
+        It is only called when there is a large file, and should return the same pool every time,
+        so one pool can be shared by every language in a run.
+        If it is None every file is scanned in this process.
         """
         # all localization keys, in the form filename/keyname
         self.keys = {}
         # all string substitutions found in .properties files
         self.subs = {}
+        # every file that contains at least one valid key, by file name
+        self.files = {}
+        # names of the entities referenced inside each DTD key's value
+        self.entity_refs = {}
+        # names of every entity declared in each .dtd file, by file name,
+        # including entities that were not kept as keys because of an error
+        self.entity_names = {}
+        self.known_entities = (
+            self._XML_PREDEFINED_ENTITIES | self._BRAND_ENTITIES | frozenset(known_entities or []))
 
         self.loc_dir = localization_base_dir
         self.name = language
         self._log_warning = log_warning
         self._parent_log_error = log_error
+        self.source = source or file_source.FileSource()
+        self.limits = limits or resource_limits.ResourceLimits()
+        self.get_parse_pool = get_parse_pool
+        # when the file being parsed must be finished by
+        self._parse_deadline = None
 
         self.parsing_errors = False
 
@@ -104,6 +179,44 @@ class LocalizationLanguage(object):
         self.parsing_errors = True
         self._parent_log_error(msg, self.name)
 
+    def _add_key(self, current_file, key_name, value, offset, subs=None):
+        """
+        Store a valid key and its value,
+        along with the byte offset where the key is defined
+        and its .properties string substitutions, if any.
+        """
+        key = self.get_key(current_file.name, key_name)
+        self.keys[key] = value
+        if subs is not None:
+            self.subs[key] = subs
+        if current_file.name not in self.files:
+            self.files[current_file.name] = current_file
+        current_file.add_key_name(key_name, offset, subs)
+
+    def get_key(self, file_name, key_name):
+        """
+        Return the 'filename/keyname' key used to store the given key.
+        """
+        return file_name + self._LSEP + key_name
+
+    def get_file_name(self, key):
+        """
+        Return the name of the file that the given 'filename/keyname' key was found in.
+        """
+        return key.split(self._LSEP, 1)[0]
+
+    def get_key_name(self, key):
+        """
+        Return the name of the given 'filename/keyname' key inside its file.
+        """
+        return key.split(self._LSEP, 1)[1]
+
+    def get_location(self, key):
+        """
+        Return a line_index.FileLocation for where the given 'filename/keyname' key is defined.
+        """
+        (file_name, key_name) = key.split(self._LSEP, 1)
+        return self.files[file_name].get_location(key_name)
 
     def _extract_first_dtd_parse_error_info(self, err):
         """
@@ -121,10 +234,11 @@ class LocalizationLanguage(object):
             (string, line, column, errlevel, place, errname, message) = match.groups()
             return [string, line, column, errlevel, place, errname, message.strip()]
 
-    def get_loc_keys(self):
+    def get_loc_keys(self, only_files=None):
         """
         Read the localization string keys and values from all files in
         this localization's directory.
+        If 'only_files' is given, only read the files with those names.
 
         This function only reads data from Mozilla-style localization files:
         XML DTD and .properties files.
@@ -132,189 +246,554 @@ class LocalizationLanguage(object):
         Returns True if there were any parsing errors,
         and False otherwise.
         """
-        loc_files = []
+        logging.info("Checking files in %s", self.loc_dir)
+        for (file_name, file_path) in self.get_file_paths():
+            if only_files is not None and file_name not in only_files:
+                continue
+
+            if not self.is_loc_file(file_path):
+                self._check_bom(file_path, file_name)
+                # not neccesarily a failure - there may just be extra files lying around.
+                self._log_warning(diagnostic.Diagnostic(
+                    diagnostic.IGNORED_FILE,
+                    "File {0} is not a .dtd or .properties file. Ignoring.",
+                    (file_path,), file_name), self.name)
+                continue
+
+            # don't read files that are too large to check
+            problem = self.limits.check_size(self.source.getsize(file_path))
+            if problem:
+                self._log_skipped_file(file_name, file_path, problem)
+                continue
 
+            # read each file only once; everything else works on the data in memory
+            self.load_file(file_name, file_path, self.source.read(file_path))
+
+        # references can only be resolved once every .dtd file has been read
+        if only_files is None:
+            self.check_entity_references()
+
+        return self.parsing_errors
+
+    def get_file_paths(self):
+        """
+        Return a list of tuples (file name, file path)
+        for every file in this localization's directory.
+        """
+        file_paths = []
         # we assume that loc directries do not have sub-directories
-        for (_, _, files) in os.walk(self.loc_dir):
-            loc_files.extend(files)
+        for (_, _, files) in self.source.walk(self.loc_dir):
+            for file_name in files:
+                file_path = os.path.normpath(os.path.join(self.loc_dir, file_name))
+                file_paths.append((file_name.replace(self._LSEP, ''), file_path))
+        return file_paths
+
+    @staticmethod
+    def is_loc_file(file_path):
+        """
+        Return True if the given file is a .dtd or .properties file.
+        """
+        return file_path.endswith('.dtd') or file_path.endswith('.properties')
 
-        logging.info("Checking files in %s", self.loc_dir)
-        for file_name in loc_files:
-            file_path = os.path.normpath(os.path.join(self.loc_dir, file_name))
-            file_name = file_name.replace(self._LSEP, '')
-
-            # check each file for the Byte Order Marker;
-            # according to the MDN spec, localization files should *not* contain BOM
-            # https://developer.mozilla.org/en/XUL_Tutorial/Localization
-            bytes_to_read = min(32, os.path.getsize(file_path))
-            with open(file_path, 'rb') as rawfile:
-                if rawfile.read(bytes_to_read).startswith(codecs.BOM_UTF8):
-                    self._log_error(
-                        "File '{0}' contains Byte Order Marker; "
-                        "localization files should not contain BOM."
-                        .format(file_path))
+    def load_file(self, file_name, file_path, data):
+        """
+        Read the localization keys from the contents of one .dtd or .properties file.
+        Any keys previously read from a file with the same name are replaced,
+        so a file can be read again after it changes.
+        """
+        self._remove_file(file_name)
+
+        problem = self.limits.check_data(data, file_path.endswith('.dtd'))
+        if problem:
+            self._log_skipped_file(file_name, file_path, problem)
+            return
+
+        current_file = loc_file.LocalizationFile(
+            file_name, file_path, line_index.LineIndex(data))
 
+        self._check_bom(file_path, file_name, data[:32])
+        self._check_encoding(current_file, data)
+
+        if self.limits.max_parse_seconds is not None:
+            self._parse_deadline = _clock() + self.limits.max_parse_seconds
+        try:
             if file_path.endswith('.dtd'):
-                with open(file_path, 'r') as openfile:
-                    try:
-                        dtd = etree.DTD(openfile)
-                        for entity in dtd.entities():
-                            # note: lxml actually removes duplicate entities when parsing;
-                            # it always takes the first entry.
-                            key = file_name + self._LSEP + entity.name
-                            if key in self.keys:
-                                self._log_error(
-                                    "Duplicate dtd key '{0}' found in {1}"
-                                    .format(key, file_path))
-                            # check for invalid content
-                            # lxml will already check for '%' in values when it parses the file
-                            elif '<' in entity.content:
-                                self._log_error(
-                                    "The value for '{0}' in {1} contains the invalid character "
-                                    "'<'. This is not allowed; please remove this character."
-                                    .format(key, file_path))
-                            else:
-                                if len(entity.content) < 1:
-                                    self._log_warning(
-                                        "Key '{0}' in {1} has a blank value. "
-                                        "Is this desired?"
-                                        .format(key, file_path), self.name)
-                                self.keys[key] = entity.content
-
-                    except (etree.DTDParseError) as ex:
-                        (_, line, column, _, _, _, message) =\
-                            self._extract_first_dtd_parse_error_info(ex)
-
-                        # get the error line so we can show the user where the problem may be
-                        error_line = linecache.getline(file_path, int(line)).strip()
-                        linecache.clearcache()
-                        highlight_string = (" " * (int(column) - 1)) + "^"
-
-                        error_message = "DTD syntax error starting at "\
-                            "Line {0}, Col {1}: {2}\n{3}\n{4}\n{5}\n{6}\n{7}".format(
-                                line,
-                                column,
-                                message,
-                                "Error line shown below, problem marked with ^:",
-                                error_line,
-                                highlight_string,
-                                "Full error details:",
-                                ex.error_log)
-                        self._log_error(
-                            "Could not parse {0}: {1}"
-                            .format(file_path, error_message))
-
-            elif file_path.endswith('.properties'):
-                self._parse_properties_file(file_path)
+                self._parse_dtd_file(current_file, data)
             else:
-                # not neccesarily a failure - there may just be extra files lying around.
-                self._log_warning(
-                    "File {0} is not a .dtd or .properties file. Ignoring."
-                    .format(file_path), self.name)
+                self._parse_properties_file(current_file, data)
+        except _ParseTimeLimit:
+            # don't keep part of a file
+            self._remove_file(file_name)
+            self._log_skipped_file(
+                file_name, file_path, "reading it took longer than {0:g} seconds".format(
+                    self.limits.max_parse_seconds))
+        finally:
+            self._parse_deadline = None
+
+    def _remove_file(self, file_name):
+        """
+        Forget every key read from the file with the given name, if any.
+        """
+        self.entity_names.pop(file_name, None)
+        if file_name in self.files:
+            for key_name in self.files.pop(file_name).key_names:
+                key = self.get_key(file_name, key_name)
+                del self.keys[key]
+                self.subs.pop(key, None)
+                self.entity_refs.pop(key, None)
+
+    def _log_skipped_file(self, file_name, file_path, problem):
+        """
+        Log an error for a file that was not checked because it exceeds a resource limit.
+        """
+        self._log_error(diagnostic.Diagnostic(
+            diagnostic.RESOURCE_LIMIT,
+            "File '{0}' was skipped because {1}.",
+            (file_path, problem), file_name,
+            location=line_index.FileLocation(file_path)))
 
-        return self.parsing_errors
+    def _check_parse_time(self):
+        """
+        Raise _ParseTimeLimit if the file being parsed has taken too long.
+        """
+        if self._parse_deadline is not None and _clock() >= self._parse_deadline:
+            raise _ParseTimeLimit()
+
+    def _check_bom(self, file_path, file_name, first_bytes=None):
+        """
+        Check a file for the Byte Order Marker.
+        If the start of the file has not already been read, read it.
+        """
+        # according to the MDN spec, localization files should *not* contain BOM
+        # https://developer.mozilla.org/en/XUL_Tutorial/Localization
+        if first_bytes is None:
+            first_bytes = self.source.read(file_path, 32)
+
+        if first_bytes.startswith(codecs.BOM_UTF8):
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.BOM,
+                "File '{0}' contains Byte Order Marker; "
+                "localization files should not contain BOM.",
+                (file_path,), file_name,
+                location=line_index.FileLocation(file_path)))
+
+    def _check_encoding(self, current_file, data):
+        """
+        Log an error if the contents of a file are not valid UTF-8,
+        giving the position of the first invalid byte sequence.
+        """
+        match = self._NON_ASCII.search(data)
+        if match is None:
+            return
+
+        # everything before the first non-ASCII byte is valid,
+        # and can't be the middle of a multi-byte sequence
+        start = match.start()
+        try:
+            data[start:].decode('utf-8')
+        except UnicodeDecodeError as ex:
+            offset = start + ex.start
+            location = current_file.get_offset_location(offset)
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.ENCODING,
+                "File '{0}' is not valid UTF-8: invalid byte sequence "
+                "at byte offset {1} (line {2}).",
+                (current_file.path, offset, location.get_line_and_column()[0]),
+                current_file.name, location=location))
+
+    def _parse_dtd_file(self, current_file, data):
+        """
+        Extract localization string keys and values from an XML DTD file
+        and add the results to the 'keys' dictionary.
+        """
+        file_name = current_file.name
+        file_path = current_file.path
+
+        try:
+            dtd = etree.DTD(io.BytesIO(data))
+        except etree.DTDParseError as ex:
+            # building the full error context is only worth doing
+            # if the message is actually displayed
+            error_info = self._extract_first_dtd_parse_error_info(ex)
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.PARSE_ERROR,
+                "Could not parse {0}: {1}",
+                (file_path, _DTDErrorContext(error_info, ex.error_log, data, current_file)),
+                file_name,
+                location=line_index.FileLocation(
+                    file_path, line=int(error_info[1]), column=int(error_info[2]))))
+            return
+
+        self._check_parse_time()
+        entity_offsets = {}
+        for match in self._DTD_ENTITY_DECL.finditer(data):
+            if match.group(1):
+                entity_name = file_source.to_text(match.group(1))
+                if entity_name not in entity_offsets:
+                    entity_offsets[entity_name] = match.start(1)
+
+        declared = self.entity_names[file_name] = set()
+        for entity in dtd.entities():
+            self._check_parse_time()
+            declared.add(entity.name)
+            # note: lxml actually removes duplicate entities when parsing;
+            # it always takes the first entry.
+            key = file_name + self._LSEP + entity.name
+            offset = entity_offsets.get(entity.name, 0)
+            location = current_file.get_offset_location(offset)
+            if key in self.keys:
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.DUPLICATE_KEY,
+                    "Duplicate dtd key '{0}' found in {1}",
+                    (key, file_path), file_name, key, location=location))
+            # check for invalid content
+            # lxml will already check for '%' in values when it parses the file
+            elif '<' in entity.content:
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.INVALID_VALUE,
+                    "The value for '{0}' in {1} contains the invalid character "
+                    "'<'. This is not allowed; please remove this character.",
+                    (key, file_path), file_name, key, location=location))
+            else:
+                if len(entity.content) < 1:
+                    self._log_warning(diagnostic.Diagnostic(
+                        diagnostic.EMPTY_VALUE,
+                        "Key '{0}' in {1} has a blank value. "
+                        "Is this desired?",
+                        (key, file_path), file_name, key, location=location), self.name)
+                self._add_key(current_file, entity.name, entity.content, offset)
+                self.entity_refs[key] = set(self._DTD_ENTITY_REF.findall(entity.orig or ''))
+
+    def check_entity_references(self):
+        """
+        Resolve every entity reference inside the values of this language's .dtd files
+        against the entities declared in all of them.
+        Log an error for every chain of references that leads back to where it started,
+        and a warning for every reference to an entity that is not declared
+        (it may come from a .dtd file outside the extension)
+        and for values that nest references more than _MAX_ENTITY_DEPTH deep.
+
+        Each entity is visited once, and its depth remembered,
+        so this takes time linear in the total number of entities and references.
+        """
+        # the key for each entity name. if several files declare the same name
+        # the first file, in name order, is used
+        names = {}
+        for key in sorted(self.entity_refs):
+            names.setdefault(self.get_key_name(key), key)
+        # entities that were declared but not kept (e.g. duplicates) have already been reported
+        declared = set(self.known_entities)
+        for file_names in self.entity_names.values():
+            declared.update(file_names)
+
+        # the deepest chain of references below each key;
+        # None while the key is still being visited
+        depths = {}
+        for start in sorted(self.entity_refs):
+            if start in depths:
+                continue
+            # depth-first search without recursion, so long chains can't overflow the stack.
+            # each entry is (key, the references of that key not visited yet)
+            depths[start] = None
+            stack = [(start, iter(sorted(self.entity_refs[start])))]
+            while stack:
+                (key, refs) = stack[-1]
+                for name in refs:
+                    ref_key = names.get(name)
+                    if ref_key is None:
+                        if name not in declared:
+                            self._log_warning(diagnostic.Diagnostic(
+                                diagnostic.UNDECLARED_ENTITY,
+                                "The value for '{0}' refers to entity '{1}', "
+                                "which is not declared in any .dtd file in {2}",
+                                (key, name, self.loc_dir), self.get_file_name(key), key,
+                                location=self.get_location(key)), self.name)
+                    elif ref_key not in depths:
+                        depths[ref_key] = None
+                        stack.append((ref_key, iter(sorted(self.entity_refs[ref_key]))))
+                        break
+                    elif depths[ref_key] is None:
+                        loop = [visiting for (visiting, _) in stack]
+                        loop = loop[loop.index(ref_key):] + [ref_key]
+                        self._log_error(diagnostic.Diagnostic(
+                            diagnostic.ENTITY_REFERENCE,
+                            "The value for '{0}' refers back to itself: {1}",
+                            (key, ' -> '.join(self.get_key_name(k) for k in loop)),
+                            self.get_file_name(key), key, location=self.get_location(key)))
+                else:
+                    # every reference has been visited
+                    stack.pop()
+                    depth = 0
+                    for name in self.entity_refs[key]:
+                        if name in names:
+                            depth = max(depth, (depths[names[name]] or 0) + 1)
+                    depths[key] = depth
+                    if depth == self._MAX_ENTITY_DEPTH + 1:
+                        # only warn about the innermost value that is too deep,
+                        # rather than every value that refers to it as well
+                        self._log_warning(diagnostic.Diagnostic(
+                            diagnostic.DEEP_ENTITY_REFERENCE,
+                            "The value for '{0}' nests entity references {1} levels deep; "
+                            "values should not nest references more than {2} levels deep.",
+                            (key, depth, self._MAX_ENTITY_DEPTH),
+                            self.get_file_name(key), key,
+                            location=self.get_location(key)), self.name)
+
+    @classmethod
+    def _iter_properties_lines(cls, data, base_offset=0):
+        """
+        Yield a tuple (line, offset) for every line of .properties file data
+        that is not a comment, where 'offset' is the byte offset of the start of the line
+        plus 'base_offset' (the offset of 'data' inside its file).
+        """
+        # Rather than removing all comments and then splitting what is left,
+        # split only the text between comments, so we know where every line starts.
+        # Comments always begin at the start of a line and end after a line break,
+        # so this produces exactly the same lines.
+        segments = []
+        start = 0
+        for comment in cls._PROP_COMMENT.finditer(data):
+            segments.append((start, comment.start()))
+            start = comment.end()
+        segments.append((start, len(data)))
+
+        for (start, end) in segments:
+            for separator in cls._PROP_SEP.finditer(data, start, end):
+                yield (data[start:separator.start()], base_offset + start)
+                start = separator.end()
+            yield (data[start:end], base_offset + start)
+
+    @classmethod
+    def _scan_properties_lines(cls, data, base_offset=0):
+        """
+        Yield a tuple for every line of .properties file data that is not blank or a comment,
+        with everything that can be found from the line alone:
+        - ('key', line offset, key name, value, offset of the key, offset of the value, subs)
+          where 'subs' is None if the value has no %,
+          an int position in the value if it uses % improperly,
+          or a tuple (sorted list of numbered substitutions, count of other substitutions).
+        - ('error', line offset, line) for a line that is not a key and value.
+        Checks that depend on the rest of the file, such as duplicate keys, are left to the caller,
+        so separate parts of a file can be scanned at the same time.
+        """
+        for (line, line_offset) in cls._iter_properties_lines(data, base_offset):
+            if not line.strip():
+                continue # skip blank lines
+            logging.info(".prop line: '%s'", line)
+            # match on the raw bytes; only keys and values are decoded
+            match = cls._PROP_LINE.match(line)
+            if not match:
+                yield ('error', line_offset, line)
+                continue
+
+            value = file_source.to_text(match.group(2))
+            subs = None
+            # the only special character for .properties files is %
+            # used to substitute values when calling strbundle.getFormattedString().
+            # https://developer.mozilla.org/en-US/docs/Mozilla/Tech/XUL/Tutorial/Property_Files#Text_Formatting
+            # there are three valid options:
+            # 1. no % on a line
+            # 2. %% to escape and print a regular %
+            # 3. %S or %n$S , where n is a number
+            if '%' in value:
+                numeric_subs_list = [] # list of numbered string substitutions, like %1$S.
+                regular_subs = 0
+                pos = value.find('%')
+                while pos < len(value) and pos != -1:
+                    # we don't save the (n$) group for anything;
+                    # we simply specify a group so we can make the entire group optional
+                    # with a trailing ?
+                    pmatch = re.match(r'%([0-9]+\$)?S', value[pos:])
+
+                    if (pos + 1 < len(value)) and value[pos + 1] == '%':
+                        pos += 1 # double %% for escape sequence; print actual %
+                    elif pmatch:
+                        # advance 1 char for the trailing S
+                        # plus however many chars make up the numerical reference (if any)
+                        pos += 1
+                        if pmatch.group(1):
+                            numeric_subs_list.append(int(pmatch.group(1).replace('$', '')))
+                            logging.info(
+                                "String substitution found. %s", numeric_subs_list)
+                            pos += len(pmatch.group(1))
+                        else:
+                            regular_subs += 1
+                    else:
+                        subs = pos
+                        break
+
+                    pos = value.find('%', pos + 1)
+
+                if subs is None:
+                    # different languages can use substitutions in different orders
+                    # sort to ensure the count and type are the same
+                    numeric_subs_list.sort()
+                    subs = (numeric_subs_list, regular_subs)
 
-    def _parse_properties_file(self, file_path):
+            yield ('key', line_offset, file_source.to_text(match.group(1)), value,
+                   line_offset + match.start(1), line_offset + match.start(2), subs)
+
+    def _scan_properties_file(self, data):
+        """
+        Yield the scanned lines of .properties file data in order,
+        as from _scan_properties_lines().
+        If there is a parse pool, large files are split into chunks at line boundaries
+        and the chunks are scanned by the pool's processes.
+        """
+        chunks = self._split_properties_data(data) if self.get_parse_pool else []
+        if len(chunks) < 2:
+            for scanned in self._scan_properties_lines(data):
+                yield scanned
+            return
+
+        # imap() returns the chunks in order, as soon as each one is ready.
+        # if we stop early (e.g. at the parse time limit) the pool still scans the rest
+        # of the chunks, since it is shared, but nothing waits for them
+        for scanned_lines in self.get_parse_pool().imap(_scan_properties_chunk, chunks):
+            for scanned in scanned_lines:
+                yield scanned
+
+    def _split_properties_data(self, data):
+        """
+        Return a list of (chunk, offset) tuples that together make up .properties file data,
+        with one chunk for files smaller than _PARALLEL_PROPERTIES_BYTES.
+        """
+        if len(data) < self._PARALLEL_PROPERTIES_BYTES:
+            return [(data, 0)]
+        chunks = []
+        start = 0
+        while len(data) - start > self._PROPERTIES_CHUNK_BYTES:
+            boundary = self._PROP_CHUNK_BOUNDARY.search(data, start + self._PROPERTIES_CHUNK_BYTES)
+            if not boundary:
+                break
+            chunks.append((data[start:boundary.end()], start))
+            start = boundary.end()
+        chunks.append((data[start:], start))
+        return chunks
+
+    def _parse_properties_file(self, current_file, data):
         """
         Extract localization string keys and values from a mozilla-style ".properties" file
         and add the results to the 'keys' and 'subs' dictionaries.
 
         https://developer.mozilla.org/en-US/docs/Mozilla/Tech/XUL/Tutorial/Property_Files
         """
-        file_name = os.path.basename(file_path).replace(self._LSEP, '')
+        file_name = current_file.name
+        file_path = current_file.path
         lang = os.path.basename(os.path.dirname(file_path))
 
-        with open(file_path, 'r') as openfile:
-            data = openfile.read()
+        if len(data) < 1:
+            self._log_warning(diagnostic.Diagnostic(
+                diagnostic.EMPTY_FILE,
+                "{0} does not contain any lines",
+                (file_path,), file_name,
+                location=line_index.FileLocation(file_path)), self.name)
+            return
+
+        # lines are scanned (possibly in parallel) and then checked here in file order,
+        # so duplicate keys and the order of diagnostics are the same however the file was scanned
+        for scanned in self._scan_properties_file(data):
+            self._check_parse_time()
+            if scanned[0] == 'error':
+                (_, line_offset, line) = scanned
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.PARSE_ERROR,
+                    "line '{0}' does not match any .properties file patterns for {1}",
+                    (file_source.to_text(line), file_path), file_name,
+                    location=current_file.get_offset_location(line_offset)))
+                continue
+
+            (_, line_offset, key_name, value, offset, value_offset, subs) = scanned
+            key = file_name + self._LSEP + key_name
+            location = current_file.get_offset_location(offset)
+            if key in self.keys:
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.DUPLICATE_KEY,
+                    "Duplicate property key '{0}' found in {1}",
+                    (key, file_path), file_name, key, location=location))
+            elif len(value) < 1:
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.BLANK_VALUE,
+                    "Key '{0}' in {1} has a blank value",
+                    (key, file_path), file_name, key, location=location))
+            elif subs is None:
+                self._add_key(current_file, key_name, value, offset)
+            elif not isinstance(subs, tuple):
+                pos = subs
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.INVALID_VALUE,
+                    "key '{0}' contains improper use of % in {1}. "
+                    "Position marked by ^ below:\n{2}\n{3}^",
+                    (key, file_path, value, " " * pos), file_name, key,
+                    location=current_file.get_offset_location(value_offset + pos)))
+            else:
+                (numeric_subs_list, regular_subs) = subs
+                self._add_key(
+                    current_file, key_name, value, offset,
+                    ''.join(str(numeric_subs_list)))
+                max_subs = self._MOZILLA_MAX_PROPERTIES_STRING_SUBS
+                if (numeric_subs_list and numeric_subs_list[-1] > max_subs) or \
+                    regular_subs > max_subs or \
+                    (numeric_subs_list and ((numeric_subs_list[-1] + regular_subs) > max_subs)):
+                    self._log_error(diagnostic.Diagnostic(
+                        diagnostic.TOO_MANY_SUBS,
+                        "More than {0} string substitutions found for key '{1}' in '{2}'. "
+                        "Mozilla does not allow this for performance reasons. "
+                        "See https://mxr.mozilla.org/mozilla-central/source/"
+                        "intl/strres/nsStringBundle.cpp ",
+                        (max_subs, key, lang),
+                        file_name, key, location=location))
+
+def _scan_properties_chunk(chunk_and_offset):
+    """
+    Return a list of the scanned lines in one chunk of a .properties file.
+    Called in a separate process; 'chunk_and_offset' is a tuple (chunk, offset of the chunk).
+    """
+    (chunk, offset) = chunk_and_offset
+    return list(LocalizationLanguage._scan_properties_lines(chunk, offset))
 
-            if len(data) < 1:
-                self._log_warning("{0} does not contain any lines".format(file_path), self.name)
-                return
+class _ParseTimeLimit(Exception):
+    """
+    Raised when a file takes longer to parse than its resource limit allows.
+    """
+    pass
 
-            data = re.sub(self._PROP_COMMENT, '', data)
-            data = re.split(self._PROP_SEP, data)
-            for line in data:
-                if not line.strip():
-                    continue # skip blank lines
-                logging.info(".prop line: '%s'", line)
-                numeric_subs_list = [] # list of numbered string substitutions, like %1$S.
-                regular_subs = 0
-                match = self._PROP_LINE.match(line)
-                if match:
-                    key = file_name + self._LSEP + match.group(1)
-                    value = match.group(2)
-                    if key in self.keys:
-                        self._log_error(
-                            "Duplicate property key '{0}' found in {1}"
-                            .format(key, file_path))
-                    elif len(value) < 1:
-                        self._log_error(
-                            "Key '{0}' in {1} has a blank value"
-                            .format(key, file_path))
-                    # the only special character for .properties files is %
-                    # used to substitute values when calling strbundle.getFormattedString().
-                    # https://developer.mozilla.org/en-US/docs/Mozilla/Tech/XUL/Tutorial/Property_Files#Text_Formatting
-                    # there are three valid options:
-                    # 1. no % on a line
-                    # 2. %% to escape and print a regular %
-                    # 3. %S or %n$S , where n is a number
-                    elif '%' in value:
-                        valid = True
-                        pos = value.find('%')
-                        while pos < len(value) and pos != -1:
-                            # we don't save the (n$) group for anything;
-                            # we simply specify a group so we can make the entire group optional
-                            # with a trailing ?
-                            pmatch = re.match(r'%([0-9]+\$)?S', value[pos:])
-
-                            if (pos + 1 < len(value)) and value[pos + 1] == '%':
-                                pos += 1 # double %% for escape sequence; print actual %
-                            elif pmatch:
-                                # advance 1 char for the trailing S
-                                # plus however many chars make up the numerical reference (if any)
-                                pos += 1
-                                if pmatch.group(1):
-                                    numeric_subs_list.append(int(pmatch.group(1).replace('$', '')))
-                                    logging.info(
-                                        "String substitution found. %s", numeric_subs_list)
-                                    pos += len(pmatch.group(1))
-                                else:
-                                    regular_subs += 1
-                            else:
-                                self._log_error(
-                                    "key '{0}' contains improper use of % in {1}. "
-                                    "Position marked by ^ below:\n{2}\n{3}"
-                                    .format(key, file_path, value, "{0}^".format(" " * pos)))
-                                valid = False
-                                break
-
-                            pos = value.find('%', pos + 1)
-
-                        if valid:
-                            self.keys[key] = value
-                            # different languages can use substitutions in different orders
-                            # sort to ensure the count and type are the same
-                            numeric_subs_list.sort()
-                            if (numeric_subs_list and numeric_subs_list[-1] > self._MOZILLA_MAX_PROPERTIES_STRING_SUBS) or \
-                                regular_subs > self._MOZILLA_MAX_PROPERTIES_STRING_SUBS or \
-                                (numeric_subs_list and \
-                                    ((numeric_subs_list[-1] + regular_subs) > self._MOZILLA_MAX_PROPERTIES_STRING_SUBS)):
-                                self._log_error(
-                                    "More than {0} string substitutions found for key '{1}' in '{2}'. "
-                                    "Mozilla does not allow this for performance reasons. "
-                                    "See https://mxr.mozilla.org/mozilla-central/source/intl/strres/nsStringBundle.cpp "
-                                    "".format(self._MOZILLA_MAX_PROPERTIES_STRING_SUBS, key, lang))
-
-                            self.subs[key] = ''.join(str(numeric_subs_list))
+# the most accurate clock available for measuring parse time
+_clock = getattr(time, 'monotonic', time.time)
 
-                    else:
-                        self.keys[key] = value
-                elif len(line) > 0: # not an empty string
-                    self._log_error(
-                        "line '{0}' does not match any .properties file patterns for {1}"
-                        .format(line, file_path))
+class _DTDErrorContext(object):
+    """
+    Describe where a DTD parsing error happened:
+    the line and column, the text of the line itself, and the full lxml error log.
+    The text is only built when the message is displayed.
+    """
 
-        return
+    def __init__(self, error_info, error_log, data, current_file):
+        (_, self.line, self.column, _, _, _, self.message) = error_info
+        self.error_log = error_log
+        self.data = data
+        self.current_file = current_file
+
+    def __str__(self):
+        # get the error line so we can show the user where the problem may be.
+        # the file contents are still in memory, so there is no need to read it again.
+        error_line = ''
+        line = int(self.line)
+        if line <= self.current_file.line_index.get_line_count():
+            (start, end) = self.current_file.line_index.get_line_offsets(line)
+            error_line = file_source.to_text(self.data[start:end].strip())
+        highlight_string = (" " * (int(self.column) - 1)) + "^"
+
+        return "DTD syntax error starting at "\
+            "Line {0}, Col {1}: {2}\n{3}\n{4}\n{5}\n{6}\n{7}".format(
+                self.line,
+                self.column,
+                self.message,
+                "Error line shown below, problem marked with ^:",
+                error_line,
+                highlight_string,
+                "Full error details:",
+                self.error_log)
 
 if __name__ == '__main__':
     pass
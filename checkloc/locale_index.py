@@ -0,0 +1,129 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Look up locale codes, allowing for differences in case and separators,
+and suggest known codes that are close to unknown ones.
+"""
+
+class LocaleIndex(object):
+    """
+    Look up locale codes, allowing for differences in case and separators,
+    and suggest known codes that are close to unknown ones.
+
+    Suggestions come from a BK-tree of the normalized codes:
+    each child is stored under its edit distance from its parent,
+    so by the triangle inequality a query only has to visit the children
+    whose distance is within the allowed distance of the query's distance to the parent.
+    The tree is built once, and most of it is never visited by a query.
+    """
+
+    def __init__(self, codes):
+        """
+        Create a new LocaleIndex of the given locale codes.
+        """
+        # the code as given, by normalized code
+        self._codes = {}
+        # BK-tree nodes are tuples (normalized code, dict of child nodes by distance)
+        self._root = None
+
+        for code in codes:
+            normal = normalize(code)
+            if normal in self._codes:
+                continue
+            self._codes[normal] = code
+            self._add(normal)
+
+    def __contains__(self, code):
+        """
+        Return True if the exact code is in the index.
+        """
+        return self._codes.get(normalize(code)) == code
+
+    def __len__(self):
+        return len(self._codes)
+
+    def find(self, code):
+        """
+        Return the known code that only differs from the given code
+        in case or separators (e.g. 'pt-BR' for 'pt_br'), or None.
+        """
+        return self._codes.get(normalize(code))
+
+    def suggest(self, code, max_distance=2):
+        """
+        Return a list of known codes that are at most 'max_distance' edits
+        away from the given code, ignoring case and separators, closest first.
+        """
+        normal = normalize(code)
+        if normal in self._codes:
+            return [self._codes[normal]]
+        if self._root is None:
+            return []
+
+        matches = []
+        nodes = [self._root]
+        while nodes:
+            (node_code, children) = nodes.pop()
+            distance = edit_distance(normal, node_code)
+            if distance <= max_distance:
+                matches.append((distance, self._codes[node_code]))
+            for child_distance in children:
+                if abs(child_distance - distance) <= max_distance:
+                    nodes.append(children[child_distance])
+        return [match for (_, match) in sorted(matches)]
+
+    def _add(self, normal):
+        """
+        Add a normalized code to the BK-tree.
+        """
+        if self._root is None:
+            self._root = (normal, {})
+            return
+        (node_code, children) = self._root
+        while True:
+            distance = edit_distance(normal, node_code)
+            if distance not in children:
+                children[distance] = (normal, {})
+                return
+            (node_code, children) = children[distance]
+
+def normalize(code):
+    """
+    Return a locale code in lower case, with '-' as its only separator.
+    """
+    return code.strip().lower().replace('_', '-')
+
+def edit_distance(first, second):
+    """
+    Return the Levenshtein distance between two strings:
+    the number of single-character insertions, deletions, or substitutions
+    needed to change one into the other.
+    """
+    if len(first) < len(second):
+        (first, second) = (second, first)
+    previous = list(range(len(second) + 1))
+    for (i, first_char) in enumerate(first):
+        current = [i + 1]
+        for (j, second_char) in enumerate(second):
+            current.append(min(
+                previous[j + 1] + 1,
+                current[j] + 1,
+                previous[j] + (first_char != second_char)))
+        previous = current
+    return previous[-1]
+
+if __name__ == '__main__':
+    pass
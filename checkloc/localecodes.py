@@ -15,170 +15,40 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
-List of many Mozilla locale codes
-Kept in a separate file so it doesn't take up space in the main module.
+List of many Mozilla locale codes, read from localecodes.txt
+so the list can be updated without changing any code.
 The base list was taken from
 https://svn.mozilla.org/libs/product-details/json/languages.json
 Other codes are added as extensions make use of them.
 """
 
-MOZILLA_LOCALE_CODES = {
-    'ach': True,
-    'af': True,
-    'ak': True,
-    'am-et': True,
-    'an': True,
-    'ar': True,
-    'as': True,
-    'ast': True,
-    'az': True,
-    'be': True,
-    'bg': True,
-    'bg-BG': True,
-    'bn-BD': True,
-    'bn-IN': True,
-    'br': True,
-    'bs': True,
-    'ca': True,
-    'ca-valencia': True,
-    'cs': True,
-    'cs-CZ': True,
-    'csb': True,
-    'cy': True,
-    'da': True,
-    'dbg': True,
-    'de': True,
-    'de-AT': True,
-    'de-CH': True,
-    'de-DE': True,
-    'dsb': True,
-    'ee': True,
-    'el': True,
-    'en-AU': True,
-    'en-CA': True,
-    'en-GB': True,
-    'en-NZ': True,
-    'en-US': True,
-    'en-ZA': True,
-    'eo': True,
-    'es': True,
-    'es-AR': True,
-    'es-CL': True,
-    'es-ES': True,
-    'es-MX': True,
-    'et': True,
-    'et-EE': True,
-    'eu': True,
-    'fa': True,
-    'ff': True,
-    'fi': True,
-    'fj-FJ': True,
-    'fr': True,
-    'fur-IT': True,
-    'fy-NL': True,
-    'ga': True,
-    'ga-IE': True,
-    'gd': True,
-    'gl': True,
-    'gl-ES': True,
-    'gu': True,
-    'gu-IN': True,
-    'he': True,
-    'hi': True,
-    'hi-IN': True,
-    'hr': True,
-    'hr-HR': True,
-    'hsb': True,
-    'hu': True,
-    'hu-HU': True,
-    'hy-AM': True,
-    'id': True,
-    'is': True,
-    'it': True,
-    'ja': True,
-    'ja-JP': True,
-    'ja-JP-mac': True,
-    'ka': True,
-    'kk': True,
-    'km': True,
-    'kn': True,
-    'ko': True,
-    'ku': True,
-    'la': True,
-    'lg': True,
-    'lij': True,
-    'ln': True,
-    'lo': True,
-    'lt': True,
-    'lv': True,
-    'lv-LV': True,
-    'mai': True,
-    'mg': True,
-    'mi': True,
-    'mk': True,
-    'ml': True,
-    'mn': True,
-    'mr': True,
-    'ms': True,
-    'ms-MY': True,
-    'my': True,
-    'nb-NO': True,
-    'ne-NP': True,
-    'nl': True,
-    'nn-NO': True,
-    'nr': True,
-    'nso': True,
-    'oc': True,
-    'or': True,
-    'pa': True,
-    'pa-IN': True,
-    'pl': True,
-    'pt-BR': True,
-    'pt-PT': True,
-    'rm': True,
-    'ro': True,
-    'ru': True,
-    'rw': True,
-    'sa': True,
-    'sah': True,
-    'sat': True,
-    'si': True,
-    'sk': True,
-    'sk-SK': True,
-    'sl': True,
-    'sl-SI': True,
-    'son': True,
-    'sq': True,
-    'sr': True,
-    'sr-Cyrl': True,
-    'sr-Latn': True,
-    'ss': True,
-    'st': True,
-    'sv-SE': True,
-    'sw': True,
-    'ta': True,
-    'ta-IN': True,
-    'ta-LK': True,
-    'te': True,
-    'tl': True,
-    'th': True,
-    'tn': True,
-    'tr': True,
-    'ts': True,
-    'tt-RU': True,
-    'uk': True,
-    'uk-UA': True,
-    'ur': True,
-    'uz': True,
-    've': True,
-    'vi': True,
-    'wo': True,
-    'x-testing': True,
-    'xh': True,
-    'zh-CN': True,
-    'zh-TW': True,
-    'zu': True
-}
+import io
+import os
+
+# allow importing both as a package and from the command line
+try:
+    from . import locale_index
+except (ImportError, ValueError):
+    import locale_index
+
+# one code per line; lines starting with # are comments
+LOCALE_CODES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'localecodes.txt')
+
+def read_locale_codes(path=LOCALE_CODES_FILE):
+    """
+    Return the list of locale codes in the given file.
+    """
+    with io.open(path, 'r', encoding='utf-8') as codes_file:
+        lines = [line.strip() for line in codes_file]
+    return [line for line in lines if line and not line.startswith('#')]
+
+_CODES = read_locale_codes()
+
+# look up codes allowing for case and separator differences, and suggest close matches
+MOZILLA_LOCALE_INDEX = locale_index.LocaleIndex(_CODES)
+
+# kept for code that looks codes up directly
+MOZILLA_LOCALE_CODES = dict((code, True) for code in _CODES)
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,552 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Check localization files as they are edited,
+by running as a Language Server Protocol server over stdin and stdout.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import warnings
+
+try:
+    from urllib.parse import quote, unquote, urlparse
+except ImportError:
+    from urllib import quote, unquote
+    from urlparse import urlparse
+
+# allow importing both as a package and from the command line
+try:
+    from . import checkloc
+    from . import diagnostic
+    from . import file_source
+    from . import line_index
+    from . import loc_language
+except (ImportError, ValueError):
+    import checkloc
+    import diagnostic
+    import file_source
+    import line_index
+    import loc_language
+
+# LSP diagnostic severities
+_SEVERITY_ERROR = 1
+_SEVERITY_WARNING = 2
+
+# LSP error code for requests the server does not support
+_METHOD_NOT_FOUND = -32601
+
+# categories of problems found by comparing a language to its baseline.
+# these are shown in the language's own file,
+# even when the problem (e.g. a missing key) is located in the baseline.
+_COMPARISON_CATEGORIES = frozenset([
+    diagnostic.MISSING_KEY, diagnostic.EXTRA_KEY, diagnostic.SUBS_MISMATCH])
+
+class LanguageServer(checkloc.CheckLoc):
+    """
+    Check localization files as they are edited,
+    by running as a Language Server Protocol server over stdin and stdout.
+
+    Every language is parsed once when the server starts and kept in memory.
+    When a file is edited only that file is parsed again,
+    and only its language (and the languages that use it as a baseline)
+    are compared again.
+    """
+
+    def __init__(self, manifest_dir=None, locales_only=False, baselines=None,
+                 default_baseline=None, input_stream=None, output_stream=None,
+                 known_entities=None):
+        """
+        Create a new LanguageServer.
+        If 'manifest_dir' is not given the workspace folder sent by the editor is used.
+        """
+        super(LanguageServer, self).__init__(
+            locales_only=locales_only, manifest_dir=manifest_dir,
+            baselines=baselines, default_baseline=default_baseline,
+            known_entities=known_entities)
+        self.input_stream = input_stream or getattr(sys.stdin, 'buffer', sys.stdin)
+        self.output_stream = output_stream or getattr(sys.stdout, 'buffer', sys.stdout)
+
+        # folder of every language, by language name
+        self.langs = {}
+        self.assigned_baselines = {}
+        # every parsed LocalizationLanguage, by language name
+        self.parsed = {}
+        # problems found while parsing each file, by file path
+        self.file_diagnostics = {}
+        # problems found by comparing each language to its baseline, by language name
+        self.comparison_diagnostics = {}
+        # problems found by resolving the entity references in each language, by language name
+        self.reference_diagnostics = {}
+        # a tuple (UTF-8 contents, line_index.LineIndex) for every file open in the editor,
+        # by file path
+        self.open_files = {}
+        # LSP diagnostics last sent for each file, by file path
+        self.published = {}
+
+        # the list that diagnostics are added to while they are being collected
+        self._collected = None
+        self._shutdown = False
+
+    def _log_message(self, msg, lang, log_func):
+        """
+        Collect diagnostics rather than printing them,
+        since stdout is used to talk to the editor.
+        """
+        if log_func == logging.error:
+            severity = _SEVERITY_ERROR
+        elif log_func == warnings.warn:
+            severity = _SEVERITY_WARNING
+        else:
+            return
+        if self._collected is not None and isinstance(msg, diagnostic.Diagnostic):
+            self._collected.append((msg, lang, severity))
+
+    def serve(self):
+        """
+        Handle messages from the editor until it asks the server to exit.
+        Return the exit code.
+        """
+        while True:
+            message = self._read_message()
+            if message is None:
+                return 1
+            if message.get('method') == 'exit':
+                return 0 if self._shutdown else 1
+            self._handle_message(message)
+
+    def _handle_message(self, message):
+        """
+        Handle one request or notification from the editor.
+        """
+        method = message.get('method')
+        params = message.get('params') or {}
+        handlers = {
+            'initialize': self._on_initialize,
+            'initialized': self._on_initialized,
+            'shutdown': self._on_shutdown,
+            'textDocument/didOpen': self._on_did_open,
+            'textDocument/didChange': self._on_did_change,
+            'textDocument/didClose': self._on_did_close,
+            'textDocument/definition': self._on_definition,
+        }
+
+        if method in handlers:
+            result = handlers[method](params)
+            if 'id' in message:
+                self._send({'jsonrpc': '2.0', 'id': message['id'], 'result': result})
+        elif 'id' in message:
+            self._send({
+                'jsonrpc': '2.0', 'id': message['id'],
+                'error': {'code': _METHOD_NOT_FOUND, 'message': "Unknown method " + str(method)}})
+
+    def _on_initialize(self, params):
+        """
+        Remember the workspace folder and describe what the server can do.
+        """
+        if self.manifest_dir is None:
+            if params.get('rootUri'):
+                self.manifest_dir = _uri_to_path(params['rootUri'])
+            else:
+                self.manifest_dir = params.get('rootPath') or os.getcwd()
+        return {
+            'capabilities': {
+                # the editor sends the full text of a file whenever it changes
+                'textDocumentSync': 1,
+                'definitionProvider': True,
+            }
+        }
+
+    def _on_initialized(self, _params):
+        """
+        Parse and compare every language, and show everything that was found.
+        """
+        self.load_all()
+        self._publish(set(self._get_all_paths()))
+
+    def _on_shutdown(self, _params):
+        """
+        Get ready to exit.
+        """
+        self._shutdown = True
+        if self.source:
+            self.source.close()
+
+    def _on_did_open(self, params):
+        """
+        Check the text of a file opened in the editor,
+        in case it differs from the file on disk.
+        """
+        document = params['textDocument']
+        self._update_open_file(_uri_to_path(document['uri']), document['text'])
+
+    def _on_did_change(self, params):
+        """
+        Check the new text of an edited file.
+        """
+        self._update_open_file(
+            _uri_to_path(params['textDocument']['uri']), params['contentChanges'][-1]['text'])
+
+    def _update_open_file(self, path, text):
+        """
+        Remember and check the text of a file that is open in the editor.
+        """
+        data = text.encode('utf-8')
+        self.open_files[path] = (data, line_index.LineIndex(data))
+        self.update_file(path, data)
+
+    def _on_did_close(self, params):
+        """
+        Go back to checking the file on disk, since unsaved edits are gone.
+        """
+        path = _uri_to_path(params['textDocument']['uri'])
+        self.open_files.pop(path, None)
+        if self.source.exists(path):
+            self.update_file(path, self.source.read(path))
+
+    def _on_definition(self, params):
+        """
+        Return the location of the baseline key
+        for the key at the given position, or None if there isn't one.
+        """
+        path = _uri_to_path(params['textDocument']['uri'])
+        found = self._find_file(path)
+        if found is None:
+            return None
+        (lang, file_name) = found
+        loc = self.parsed[lang]
+        if file_name not in loc.files:
+            return None
+
+        key_name = _get_key_at_line(loc.files[file_name], params['position']['line'] + 1)
+        if key_name is None:
+            return None
+        key = loc.get_key(file_name, key_name)
+        for base_name in (self.assigned_baselines.get(lang), self.default_baseline):
+            base = self.parsed.get(base_name)
+            if base is not None and base is not loc and key in base.keys:
+                location = base.get_location(key)
+                return {
+                    'uri': _path_to_uri(location.path),
+                    'range': self._get_range(location, location.path, key_name),
+                }
+        return None
+
+    def load_all(self):
+        """
+        Find, parse, and compare every language.
+        """
+        self.source = file_source.FileSource()
+        self.langs = {}
+        self.parsed = {}
+        self.file_diagnostics = {}
+        self.comparison_diagnostics = {}
+        self.reference_diagnostics = {}
+
+        self._collected = []
+        self.langs = self._find_languages() or {}
+        self.assigned_baselines = self._assign_baselines(self.langs) or {}
+        # setup and manifest problems are shown in the file they were found in, if any
+        for (msg, lang, severity) in self._collected:
+            if msg.location is not None:
+                self.file_diagnostics.setdefault(msg.location.path, []).append(
+                    (msg, lang, severity))
+        self._collected = None
+
+        for lang in sorted(self.langs):
+            loc = loc_language.LocalizationLanguage(
+                self.langs[lang], lang, self._log_warning, self._log_error, self.source,
+                self.limits, self.known_entities)
+            self.parsed[lang] = loc
+            for (file_name, file_path) in loc.get_file_paths():
+                if loc.is_loc_file(file_path):
+                    self._load_file(loc, file_name, file_path, self.source.read(file_path))
+            self._check_references(lang)
+
+        for lang in self.assigned_baselines:
+            self._compare(lang)
+
+    def update_file(self, path, data):
+        """
+        Parse the new contents of one file,
+        compare it again to the matching baseline and translations,
+        and show any changes in what was found.
+        """
+        found = self._find_file(path)
+        if found is None:
+            return
+        (lang, file_name) = found
+        loc = self.parsed[lang]
+        if not loc.is_loc_file(path):
+            return
+
+        self._load_file(loc, file_name, path, data)
+        paths = set([path])
+        if path.endswith('.dtd'):
+            # any file in the language may refer to entities in this one
+            paths.update(self._get_comparison_paths(lang, self.reference_diagnostics))
+            self._check_references(lang)
+            paths.update(self._get_comparison_paths(lang, self.reference_diagnostics))
+
+        # the file may have changed the results of comparing its own language to its baseline
+        # or of comparing any language that uses this one as a baseline
+        compare_langs = [
+            other for other in self.assigned_baselines
+            if other == lang or self.assigned_baselines[other] == lang]
+        for other in compare_langs:
+            paths.update(self._get_comparison_paths(other))
+            self._compare(other)
+            paths.update(self._get_comparison_paths(other))
+        self._publish(paths)
+
+    def _load_file(self, loc, file_name, file_path, data):
+        """
+        Parse one file and remember what was found.
+        """
+        self._collected = []
+        loc.load_file(file_name, file_path, data)
+        self.file_diagnostics[file_path] = self._collected
+        self._collected = None
+
+    def _compare(self, lang):
+        """
+        Compare a language to its baseline and remember what was found.
+        """
+        self._collected = []
+        self._compare_languages(self.parsed[self.assigned_baselines[lang]], self.parsed[lang])
+        self.comparison_diagnostics[lang] = self._collected
+        self._collected = None
+
+    def _check_references(self, lang):
+        """
+        Resolve the entity references in a language and remember what was found.
+        """
+        self._collected = []
+        self.parsed[lang].check_entity_references()
+        self.reference_diagnostics[lang] = self._collected
+        self._collected = None
+
+    def _find_file(self, path):
+        """
+        Return a tuple (language, file name) for the given file path,
+        or None if it is not inside a language folder.
+        """
+        folder = os.path.normcase(os.path.dirname(os.path.abspath(path)))
+        for lang in self.langs:
+            if os.path.normcase(os.path.abspath(self.langs[lang])) == folder:
+                return (lang, os.path.basename(path))
+        return None
+
+    def _get_comparison_path(self, msg, lang):
+        """
+        Return the path of the file that a diagnostic should be shown in.
+        """
+        if msg.category in _COMPARISON_CATEGORIES and msg.file_name and lang in self.langs:
+            return os.path.normpath(os.path.join(self.langs[lang], msg.file_name))
+        if msg.location is not None:
+            return msg.location.path
+        return None
+
+    def _get_comparison_paths(self, lang, diagnostics=None):
+        """
+        Return the set of file paths with problems found by comparing the given language,
+        or with the given per-language problems.
+        """
+        if diagnostics is None:
+            diagnostics = self.comparison_diagnostics
+        paths = set()
+        for (msg, msg_lang, _) in diagnostics.get(lang, []):
+            path = self._get_comparison_path(msg, msg_lang)
+            if path is not None:
+                paths.add(path)
+        return paths
+
+    def _get_all_paths(self):
+        """
+        Return every file path with known problems.
+        """
+        paths = set(self.file_diagnostics)
+        for lang in self.comparison_diagnostics:
+            paths.update(self._get_comparison_paths(lang))
+        for lang in self.reference_diagnostics:
+            paths.update(self._get_comparison_paths(lang, self.reference_diagnostics))
+        return paths
+
+    def _publish(self, paths):
+        """
+        Send the editor the current diagnostics for each of the given files,
+        if they have changed since they were last sent.
+        """
+        by_path = {}
+        for path in paths:
+            by_path[path] = list(self.file_diagnostics.get(path, []))
+        for diagnostics in (self.comparison_diagnostics, self.reference_diagnostics):
+            for lang in diagnostics:
+                for entry in diagnostics[lang]:
+                    path = self._get_comparison_path(entry[0], entry[1])
+                    if path in by_path:
+                        by_path[path].append(entry)
+
+        for path in sorted(by_path):
+            lsp_diagnostics = []
+            for (msg, _, severity) in by_path[path]:
+                key_name = msg.key.split('/', 1)[-1] if msg.key else None
+                lsp_diagnostics.append({
+                    'range': self._get_range(msg.location, path, key_name),
+                    'severity': severity,
+                    'source': 'checkloc',
+                    'code': msg.category,
+                    'message': msg.template.format(*msg.args),
+                })
+            if self.published.get(path, []) == lsp_diagnostics:
+                continue
+            self.published[path] = lsp_diagnostics
+            self._send({
+                'jsonrpc': '2.0',
+                'method': 'textDocument/publishDiagnostics',
+                'params': {'uri': _path_to_uri(path), 'diagnostics': lsp_diagnostics},
+            })
+
+    def _get_range(self, location, path, key_name=None):
+        """
+        Return an LSP range for a location in the given file.
+        Locations in other files (e.g. in the baseline) are shown at the start of the file.
+        """
+        if location is None or \
+                os.path.normcase(location.path) != os.path.normcase(path):
+            return {'start': {'line': 0, 'character': 0}, 'end': {'line': 0, 'character': 0}}
+
+        (line, column) = location.get_line_and_column()
+        # LSP counts characters in UTF-16 code units rather than bytes
+        character = column - 1
+        if path in self.open_files:
+            # lines end where the parsers end them, so the line agrees with checkloc's path:line:col
+            (data, index) = self.open_files[path]
+            if line <= index.get_line_count():
+                (start, _) = index.get_line_offsets(line)
+                prefix = data[start:start + column - 1].decode('utf-8', 'replace')
+                character = _utf16_length(prefix)
+        end = character + (_utf16_length(key_name) if key_name else 0)
+        return {
+            'start': {'line': line - 1, 'character': character},
+            'end': {'line': line - 1, 'character': end},
+        }
+
+    def _read_message(self):
+        """
+        Read one JSON-RPC message from the editor,
+        or return None if the input has ended.
+        """
+        length = None
+        while True:
+            header = self.input_stream.readline()
+            if not header:
+                return None
+            header = header.decode('ascii').strip()
+            if not header:
+                break
+            (name, _, value) = header.partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value.strip())
+        if length is None:
+            return None
+        return json.loads(self.input_stream.read(length).decode('utf-8'))
+
+    def _send(self, message):
+        """
+        Send one JSON-RPC message to the editor.
+        """
+        body = json.dumps(message).encode('utf-8')
+        self.output_stream.write(
+            'Content-Length: {0}\r\n\r\n'.format(len(body)).encode('ascii') + body)
+        self.output_stream.flush()
+
+def _get_key_at_line(current_file, line):
+    """
+    Return the name of the key defined on the given line (from 1) of a file,
+    or None if there isn't one.
+    """
+    for key_name in current_file.key_names:
+        location = current_file.get_location(key_name)
+        if location.get_line_and_column()[0] == line:
+            return key_name
+    return None
+
+def _utf16_length(text):
+    """
+    Return the length of some text in UTF-16 code units.
+    """
+    if not isinstance(text, type(u'')):
+        text = text.decode('utf-8', 'replace')
+    return len(text) + sum(1 for char in text if ord(char) > 0xFFFF)
+
+def _uri_to_path(uri):
+    """
+    Return the file path for a file:// URI.
+    """
+    path = unquote(urlparse(uri).path)
+    if os.name == 'nt' and path.startswith('/'):
+        path = path[1:] # /C:/path
+    return os.path.normpath(path)
+
+def _path_to_uri(path):
+    """
+    Return a file:// URI for a file path.
+    """
+    path = os.path.abspath(path).replace(os.sep, '/')
+    if not path.startswith('/'):
+        path = '/' + path
+    return 'file://' + quote(path)
+
+def main(argv):
+    """
+    Parse args and run the server.
+    """
+    parser = argparse.ArgumentParser(
+        prog='checkloc lsp',
+        description=__doc__)
+    parser.add_argument(
+        'manifest_dir',
+        nargs='?',
+        default=None,
+        help="Directory where chrome.manifest file is located. "
+        "Default: the workspace folder opened in the editor.")
+    parser.add_argument(
+        '--locales-only', '-l',
+        default=False,
+        action='store_true',
+        help="Treat every subfolder of the directory as a locale, "
+        "rather than reading chrome.manifest.")
+    parser.add_argument(
+        '--known-entity',
+        metavar='NAME',
+        action='append',
+        default=[],
+        help="The name of an entity declared outside the extension "
+        "that DTD values can refer to. Can be specified more than once.")
+    args = parser.parse_args(argv)
+
+    # stdout carries the protocol, so log anything else to stderr
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.WARNING)
+    server = LanguageServer(
+        args.manifest_dir, args.locales_only, known_entities=args.known_entity)
+    sys.exit(server.serve())
+
+if __name__ == '__main__':
+    pass
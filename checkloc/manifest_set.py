@@ -19,6 +19,7 @@ to create, hold, and work with one particular set of Mozilla extension
 manifest files (chrome.manifest and install.rdf).
 """
 
+import io
 import os
 import re
 import sys
@@ -31,7 +32,17 @@ except ImportError:
         "Please install the python 'lxml' library to run localization tests.")
     sys.exit(1)
 
-import localecodes
+# allow importing both as a package and from the command line
+try:
+    from . import diagnostic
+    from . import file_source
+    from . import line_index
+    from . import localecodes
+except (ImportError, ValueError):
+    import diagnostic
+    import file_source
+    import line_index
+    import localecodes
 
 class ManifestSet(object):
     """
@@ -42,13 +53,18 @@ class ManifestSet(object):
 
     # start of string used to register locale packages - see
     # https://developer.mozilla.org/en-US/docs/Chrome_Registration#locale
-    _MANIFEST_LOCALE_START = 'locale'
-    _MANIFEST_LOCALE_LINE = re.compile(r'^\s*locale\s+\S+\s+(\S+)\s+(\S+)')
+    _MANIFEST_LOCALE_START = b'locale'
+    _MANIFEST_LOCALE_LINE = re.compile(br'^\s*locale\s+\S+\s+(\S+)\s+(\S+)')
+    # locale files can also be packed inside an archive, e.g.
+    #   locale extension-name pl jar:chrome/extension.jar!/locale/pl/
+    _JAR_URI_START = 'jar:'
 
-    def __init__(self, manifest_dir, log_error, log_warning):
+    def __init__(self, manifest_dir, log_error, log_warning, source=None):
         """
         Create a new ManifestSet.
         Argument: path to the directory that contains chrome.manifest
+        'source' is the file_source.FileSource used to read files,
+        so manifests inside .xpi archives can be read.
         """
         self.loc_base_dirs = {}
         self.manifest_lines = {}
@@ -59,6 +75,7 @@ class ManifestSet(object):
         self.manifest_dir = manifest_dir
         self._log_error = log_error
         self._log_warning = log_warning
+        self.source = source or file_source.FileSource()
 
     def validate_manifests(self):
         """
@@ -70,21 +87,23 @@ class ManifestSet(object):
         self.manifest_lines = {}
         self.rdf_locs = {}
 
-        if not (os.path.exists(self.manifest_dir) and os.path.isdir(self.manifest_dir)):
-            self._log_error(
+        if not (self.source.exists(self.manifest_dir) and self.source.isdir(self.manifest_dir)):
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.MANIFEST,
                 "Main plugin directory {0} does not exist; cannot validate chrome.manifest. "
                 "If you wish to skip validation of chrome.manifest please specify the "
-                "--locales-only switch when running tests."
-                .format(self.manifest_dir))
+                "--locales-only switch when running tests.",
+                (self.manifest_dir,), 'chrome.manifest'))
             return
 
         manifest = os.path.join(self.manifest_dir, 'chrome.manifest')
-        if not os.path.exists(manifest):
-            self._log_error(
+        if not self.source.exists(manifest):
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.MANIFEST,
                 "File chrome.manifest does not exist in {0} ; cannot validate chrome.manifest. "
                 "If you wish to skip validation of chrome.manifest please specify the "
-                "--locales-only switch when running tests."
-                .format(self.manifest_dir))
+                "--locales-only switch when running tests.",
+                (self.manifest_dir,), 'chrome.manifest'))
             return
 
         # parse the chrome.manfiest file and save locale data.
@@ -96,15 +115,19 @@ class ManifestSet(object):
         # e.g.
         #   locale extension-name pl chrome/locale/pl/
         #
-        with open(manifest, 'r') as m:
+        with io.BytesIO(self.source.read(manifest)) as m:
             lines = m.readlines()
             i = 1 # save the line number to help users troubleshoot any problems
             for line in lines:
                 if line.startswith(self._MANIFEST_LOCALE_START):
                     match = self._MANIFEST_LOCALE_LINE.match(line)
                     if match:
-                        locale = match.groups(1)[0]
-                        locale_subdir = match.group(2)
+                        locale = file_source.to_text(match.group(1))
+                        locale_subdir = file_source.to_text(match.group(2))
+                        if locale_subdir.startswith(self._JAR_URI_START):
+                            # read the locale files straight from the archive.
+                            # file_source paths use the same 'archive!/path' form as jar: URIs
+                            locale_subdir = locale_subdir[len(self._JAR_URI_START):]
                         # go one dir up to get the main locale directory
                         base_dir = os.path.abspath(os.path.join(
                             self.manifest_dir, locale_subdir, '..'))
@@ -118,29 +141,34 @@ class ManifestSet(object):
                         if locale not in self.manifest_lines:
                             self.manifest_lines[locale] = i
                         else:
-                            self._log_error(
+                            self._log_error(diagnostic.Diagnostic(
+                                diagnostic.MANIFEST,
                                 "Locale '{0}' is defined more than once inside chrome.manifest. "
-                                "Each locale should only be defined once."
-                                .format(locale))
+                                "Each locale should only be defined once.",
+                                (locale,), 'chrome.manifest',
+                                location=line_index.FileLocation(manifest, line=i)))
                     else:
-                        self._log_error(
-                            "Invalid locale line found in chrome.manifest on line {0}:\n  {1}"
-                            .format(i, line))
+                        self._log_error(diagnostic.Diagnostic(
+                            diagnostic.MANIFEST,
+                            "Invalid locale line found in chrome.manifest on line {0}:\n  {1}",
+                            (i, file_source.to_text(line)), 'chrome.manifest',
+                            location=line_index.FileLocation(manifest, line=i)))
                 i += 1
 
 
         # also parse install.rdf
         install_rdf = os.path.abspath(os.path.join(self.manifest_dir, 'install.rdf'))
-        if not os.path.exists(install_rdf):
-            self._log_error(
+        if not self.source.exists(install_rdf):
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.MANIFEST,
                 "File install.rdf does not exist in {0} ; cannot validate. "
                 "If you wish to skip validation please specify the "
-                "--locales-only switch when running tests."
-                .format(self.manifest_dir))
+                "--locales-only switch when running tests.",
+                (self.manifest_dir,), 'install.rdf'))
             return
 
         try:
-            xml = etree.parse(install_rdf)
+            xml = etree.parse(io.BytesIO(self.source.read(install_rdf)))
             root = xml.getroot()
             # lxml 3.5.0 raises a ValueError if the namespace map
             # contains a 'None' entry, even if it also contains
@@ -152,27 +180,40 @@ class ManifestSet(object):
                 if loc not in self.rdf_locs:
                     self.rdf_locs[loc] = True
                 else:
-                    self._log_error(
+                    self._log_error(diagnostic.Diagnostic(
+                        diagnostic.MANIFEST,
                         "Locale '{0}' is defined more than once inside install.rdf. "
-                        "Each locale should only be defined once."
-                        .format(loc))
+                        "Each locale should only be defined once.",
+                        (loc,), 'install.rdf',
+                        location=line_index.FileLocation(install_rdf, line=locale.sourceline)))
         except etree.XMLSyntaxError as ex:
-            self._log_error("Could not parse {0}: {1}".format(install_rdf, ex))
+            self._log_error(diagnostic.Diagnostic(
+                diagnostic.MANIFEST,
+                "Could not parse {0}: {1}",
+                (install_rdf, ex), 'install.rdf',
+                location=line_index.FileLocation(
+                    install_rdf, line=ex.position[0], column=ex.position[1])))
 
 
         # check every chrome.manifest entry to make sure a locale folder exists
         for locale in self.manifest_paths:
             locale_path = self.manifest_paths[locale]
-            if not os.path.exists(locale_path):
-                self._log_error(
+            if not self.source.exists(locale_path):
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.MANIFEST,
                     "Locale folder '{0}' is specified in chrome.manifest "
-                    "line {1}, but {2} does not exist!"
-                    .format(locale, self.manifest_lines[locale], locale_path), locale)
-            elif not os.path.isdir(locale_path):
-                self._log_error(
+                    "line {1}, but {2} does not exist!",
+                    (locale, self.manifest_lines[locale], locale_path), 'chrome.manifest',
+                    location=line_index.FileLocation(
+                        manifest, line=self.manifest_lines[locale])), locale)
+            elif not self.source.isdir(locale_path):
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.MANIFEST,
                     "Locale folder '{0}' is specified in chrome.manifest "
-                    "line {1}, but {2} is not a folder!"
-                    .format(locale, self.manifest_lines[locale], locale_path), locale)
+                    "line {1}, but {2} is not a folder!",
+                    (locale, self.manifest_lines[locale], locale_path), 'chrome.manifest',
+                    location=line_index.FileLocation(
+                        manifest, line=self.manifest_lines[locale])), locale)
 
             # if an entry exists in chrome.manifest then it must exist on disk
             # or we will raise an error.
@@ -181,42 +222,50 @@ class ManifestSet(object):
             # thus we do *not* need to check here whether locales in chrome.manifest
             # also exist inside install.rdf.
 
-            if locale not in localecodes.MOZILLA_LOCALE_CODES:
-                self._log_warning(
+            if locale not in localecodes.MOZILLA_LOCALE_INDEX:
+                self._log_warning(diagnostic.Diagnostic(
+                    diagnostic.MANIFEST_WARNING,
                     "chrome.manifest locale '{0}' does not exist "
-                    "in the list of Mozilla locale codes."
-                    .format(locale), locale)
+                    "in the list of Mozilla locale codes.{1}",
+                    (locale, _get_suggestion(locale)), 'chrome.manifest',
+                    location=line_index.FileLocation(
+                        manifest, line=self.manifest_lines[locale])), locale)
 
         # check every install.rdf entry to make sure a locale folder exists
         for locale in self.rdf_locs:
             if locale not in self.manifest_paths:
-                self._log_warning(
+                self._log_warning(diagnostic.Diagnostic(
+                    diagnostic.MANIFEST_WARNING,
                     "Locale '{0}' is specified in install.rdf "
-                    "but is not specified in chrome.manifest."
-                    .format(locale), locale)
+                    "but is not specified in chrome.manifest.",
+                    (locale,), 'install.rdf'), locale)
             else:
                 locale_path = self.manifest_paths[locale]
-                if not os.path.exists(locale_path):
-                    self._log_warning(
+                if not self.source.exists(locale_path):
+                    self._log_warning(diagnostic.Diagnostic(
+                        diagnostic.MANIFEST_WARNING,
                         "Locale folder '{0}' is specified in install.rdf "
-                        "line {1}, but {2} does not exist!"
-                        .format(locale, self.manifest_lines[locale], locale_path), locale)
-                elif not os.path.isdir(locale_path):
-                    self._log_warning(
+                        "line {1}, but {2} does not exist!",
+                        (locale, self.manifest_lines[locale], locale_path), 'install.rdf'), locale)
+                elif not self.source.isdir(locale_path):
+                    self._log_warning(diagnostic.Diagnostic(
+                        diagnostic.MANIFEST_WARNING,
                         "Locale folder '{0}' is specified in install.rdf "
-                        "line {1}, but {2} is not a folder!"
-                        .format(locale, self.manifest_lines[locale], locale_path), locale)
+                        "line {1}, but {2} is not a folder!",
+                        (locale, self.manifest_lines[locale], locale_path), 'install.rdf'), locale)
 
-            if locale not in localecodes.MOZILLA_LOCALE_CODES:
-                self._log_warning(
-                    "install.rdf locale '{0}' does not exist in the list of Mozilla locale codes."
-                    .format(locale), locale)
+            if locale not in localecodes.MOZILLA_LOCALE_INDEX:
+                self._log_warning(diagnostic.Diagnostic(
+                    diagnostic.MANIFEST_WARNING,
+                    "install.rdf locale '{0}' does not exist "
+                    "in the list of Mozilla locale codes.{1}",
+                    (locale, _get_suggestion(locale)), 'install.rdf'), locale)
 
 
         # now calculate the locale subdirectories
         langs = {}
         for ld in self.loc_base_dirs:
-            for (_, dirs, _) in os.walk(ld):
+            for (_, dirs, _) in self.source.walk(ld):
                 for d in dirs:
                     langs[d] = os.path.join(ld, d)
 
@@ -229,15 +278,17 @@ class ManifestSet(object):
                 dir_path = os.path.abspath(os.path.join(self.manifest_paths[lang], '..'))
 
             if lang not in self.manifest_paths:
-                self._log_error(
+                self._log_error(diagnostic.Diagnostic(
+                    diagnostic.MANIFEST,
                     "Locale folder '{0}' exists in {1}, but no corresponding entry "
-                    "exists in the chrome.manifest."
-                    .format(lang, dir_path), lang)
+                    "exists in the chrome.manifest.",
+                    (lang, dir_path), 'chrome.manifest'), lang)
             if lang not in self.rdf_locs:
-                self._log_warning(
+                self._log_warning(diagnostic.Diagnostic(
+                    diagnostic.MANIFEST_WARNING,
                     "Locale folder '{0}' exists in {1}, but no corresponding entry "
-                    "exists in install.rdf."
-                    .format(lang, dir_path), lang)
+                    "exists in install.rdf.",
+                    (lang, dir_path), 'install.rdf'), lang)
 
         self.manifests_parsed = True
 
@@ -249,7 +300,18 @@ class ManifestSet(object):
         if not self.manifests_parsed:
             self.validate_manifests()
 
-        return self.loc_base_dirs.keys()
+        return list(self.loc_base_dirs)
+
+def _get_suggestion(locale):
+    """
+    Return a sentence suggesting the known locale codes closest to an unknown one,
+    or '' if there are none.
+    """
+    suggestions = localecodes.MOZILLA_LOCALE_INDEX.suggest(locale)
+    if not suggestions:
+        return ''
+    return " Did you mean {0}?".format(
+        ' or '.join("'{0}'".format(code) for code in suggestions[:3]))
 
 if __name__ == '__main__':
     pass
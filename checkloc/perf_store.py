@@ -0,0 +1,274 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Remember how long each run took and how much it read,
+so runs can be compared to find when, and why, checking got slower.
+"""
+
+import math
+import sqlite3
+import time
+
+# sizes of the input recorded for every run, in the order they are shown
+SIZE_FIELDS = ['languages', 'files', 'bytes', 'keys']
+
+class PerfStore(object):
+    """
+    Remember how long each run took and how much it read,
+    so runs can be compared to find when, and why, checking got slower.
+
+    Data is kept in an SQLite database:
+    - runs records the size of the input, the peak memory used,
+      and the total time of every run, along with a label (e.g. a revision).
+    - phases records the time taken by each phase of every run.
+    """
+
+    def __init__(self, db_path):
+        """
+        Open (or create) the performance database at the given path.
+        """
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                started REAL NOT NULL,
+                label TEXT NOT NULL,
+                version TEXT NOT NULL,
+                python TEXT NOT NULL,
+                languages INTEGER NOT NULL,
+                files INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                keys INTEGER NOT NULL,
+                peak_memory_kb INTEGER,
+                seconds REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS runs_by_label ON runs (label);
+            CREATE TABLE IF NOT EXISTS phases (
+                run_id INTEGER NOT NULL,
+                phase TEXT NOT NULL,
+                seconds REAL NOT NULL,
+                PRIMARY KEY (run_id, phase));
+            """)
+
+    def record_run(self, label, version, python, sizes, peak_memory_kb, seconds, phase_times):
+        """
+        Save the details of one run and return its id.
+        'sizes' is a dict with an entry for each of SIZE_FIELDS,
+        and 'phase_times' is a dict of the seconds taken by each phase.
+        """
+        cursor = self.connection.execute(
+            "INSERT INTO runs (started, label, version, python, languages, files, bytes, keys, "
+            "peak_memory_kb, seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [time.time(), label or '', version, python] +
+            [sizes[field] for field in SIZE_FIELDS] + [peak_memory_kb, seconds])
+        run_id = cursor.lastrowid
+        self.connection.executemany(
+            "INSERT INTO phases (run_id, phase, seconds) VALUES (?, ?, ?)",
+            [(run_id, phase, phase_times[phase]) for phase in phase_times])
+        return run_id
+
+    def get_runs(self, selector):
+        """
+        Return a list of the runs with the given id or label, oldest first.
+        Each run is a dict with an entry for each of SIZE_FIELDS,
+        'id', 'label', 'peak_memory_kb', 'seconds',
+        and 'phases': a dict of the seconds taken by each phase.
+        """
+        query = (
+            "SELECT id, label, languages, files, bytes, keys, peak_memory_kb, seconds "
+            "FROM runs WHERE ")
+        if selector.isdigit():
+            rows = self.connection.execute(query + "id = ?", (int(selector),)).fetchall()
+        else:
+            rows = self.connection.execute(query + "label = ? ORDER BY id", (selector,)).fetchall()
+
+        runs = []
+        for row in rows:
+            run = dict(zip(
+                ['id', 'label'] + SIZE_FIELDS + ['peak_memory_kb', 'seconds'], row))
+            run['phases'] = dict(self.connection.execute(
+                "SELECT phase, seconds FROM phases WHERE run_id = ?", (run['id'],)))
+            runs.append(run)
+        return runs
+
+    def close(self):
+        """
+        Save all changes and close the database.
+        """
+        self.connection.commit()
+        self.connection.close()
+
+def compare_runs(old_runs, new_runs, alpha=0.05, min_change=0.05):
+    """
+    Compare two groups of runs.
+    Times are divided by the megabytes read in each run,
+    so a bigger input does not look like a slowdown.
+    Return a list of tuples (name, old mean, new mean, p-value, verdict) with a row for:
+    each input size, the peak memory, the total time per megabyte,
+    and the time per megabyte of each phase.
+    The p-value is from a one-sided Welch's t-test for the new runs being slower,
+    or None if either group has fewer than two runs.
+    The verdict is 'slower' if the new runs are significantly slower (p-value below 'alpha')
+    by more than 'min_change' (e.g. 0.05 for 5%), 'faster' for the reverse, or ''.
+    """
+    rows = []
+    for field in SIZE_FIELDS + ['peak_memory_kb']:
+        old = [run[field] for run in old_runs if run[field] is not None]
+        new = [run[field] for run in new_runs if run[field] is not None]
+        rows.append((field, _mean(old), _mean(new), None, ''))
+
+    phases = set()
+    for run in old_runs + new_runs:
+        phases.update(run['phases'])
+
+    for name in ['total'] + sorted(phases):
+        old = [_per_megabyte(run, name) for run in old_runs]
+        new = [_per_megabyte(run, name) for run in new_runs]
+        old = [value for value in old if value is not None]
+        new = [value for value in new if value is not None]
+        if not old or not new:
+            continue
+
+        (old_mean, new_mean) = (_mean(old), _mean(new))
+        p_slower = welch_t_test(old, new)
+        verdict = ''
+        if p_slower is not None:
+            if p_slower < alpha and new_mean > old_mean * (1 + min_change):
+                verdict = 'slower'
+            elif 1 - p_slower < alpha and new_mean < old_mean * (1 - min_change):
+                verdict = 'faster'
+        rows.append((name + ' s/MB', old_mean, new_mean, p_slower, verdict))
+    return rows
+
+def format_comparison(rows):
+    """
+    Return the rows from compare_runs() as a table.
+    """
+    table = [['Measure', 'Old', 'New', 'Change', 'p', '']]
+    for (name, old, new, p_slower, verdict) in rows:
+        change = '-'
+        if old and new is not None:
+            change = '{0:+.1f}%'.format((new - old) * 100.0 / old)
+        table.append([
+            name, _format_number(old), _format_number(new), change,
+            '-' if p_slower is None else '{0:.3f}'.format(p_slower), verdict])
+
+    widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+    lines = []
+    for row in table:
+        cells = [row[0].ljust(widths[0])]
+        cells.extend(cell.rjust(width) for (cell, width) in zip(row[1:5], widths[1:5]))
+        cells.append(row[5])
+        lines.append('  '.join(cells).rstrip())
+    return '\n'.join(lines)
+
+def welch_t_test(first, second):
+    """
+    Return the one-sided p-value of Welch's t-test
+    for the mean of 'second' being larger than the mean of 'first',
+    or None if either list has fewer than two values.
+    """
+    if len(first) < 2 or len(second) < 2:
+        return None
+    (first_mean, second_mean) = (_mean(first), _mean(second))
+    first_error = _variance(first, first_mean) / len(first)
+    second_error = _variance(second, second_mean) / len(second)
+    standard_error = math.sqrt(first_error + second_error)
+    if standard_error == 0:
+        # every run took exactly the same time
+        return 0.0 if second_mean > first_mean else 1.0
+
+    t_value = (second_mean - first_mean) / standard_error
+    # Welch-Satterthwaite degrees of freedom
+    freedom = (first_error + second_error) ** 2 / (
+        first_error ** 2 / (len(first) - 1) + second_error ** 2 / (len(second) - 1))
+    # the chance of a t value at least this far from 0 in either direction
+    two_sided = _incomplete_beta(freedom / 2.0, 0.5, freedom / (freedom + t_value ** 2))
+    if t_value > 0:
+        return two_sided / 2
+    return 1 - two_sided / 2
+
+def _incomplete_beta(a, b, x):
+    """
+    Return the regularized incomplete beta function I_x(a, b),
+    using its continued fraction (see Numerical Recipes, section 6.4).
+    """
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    # the continued fraction converges quickly for x < (a + 1) / (a + b + 2);
+    # otherwise use the symmetry I_x(a, b) = 1 - I_(1-x)(b, a)
+    if x > (a + 1) / (a + b + 2):
+        return 1 - _incomplete_beta(b, a, 1 - x)
+
+    front = math.exp(
+        math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+        a * math.log(x) + b * math.log(1 - x)) / a
+
+    # modified Lentz's method
+    tiny = 1e-30
+    (c, d) = (1.0, 1 - (a + b) * x / (a + 1))
+    d = 1 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 200):
+        for numerator in (
+                m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= c * d
+        if abs(c * d - 1) < 1e-12:
+            break
+    return front * result
+
+def _per_megabyte(run, phase):
+    """
+    Return the seconds a run spent on the given phase (or 'total') per megabyte read,
+    or None if the run has no time for that phase.
+    """
+    seconds = run['seconds'] if phase == 'total' else run['phases'].get(phase)
+    if seconds is None:
+        return None
+    return seconds / max(run['bytes'] / 1048576.0, 1e-6)
+
+def _mean(values):
+    """
+    Return the mean of a list of numbers, or None if it is empty.
+    """
+    if not values:
+        return None
+    return sum(values) / float(len(values))
+
+def _variance(values, mean):
+    """
+    Return the sample variance of a list of numbers with the given mean.
+    """
+    return sum((value - mean) ** 2 for value in values) / (len(values) - 1)
+
+def _format_number(value):
+    """
+    Return a number with a sensible number of digits, or '-' if there is none.
+    """
+    if value is None:
+        return '-'
+    if value == int(value) or abs(value) >= 1000:
+        return '{0:.0f}'.format(value)
+    return '{0:.4g}'.format(value)
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,146 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Profile each phase of a run separately,
+and save the results both as pstats files and as collapsed stacks for flame graphs.
+"""
+
+import cProfile
+import os
+import pstats
+import re
+
+class PhaseProfiler(object):
+    """
+    Profile each phase of a run separately,
+    and save the results both as pstats files and as collapsed stacks for flame graphs.
+
+    Each phase has its own profile, named after the phase and the language it was for
+    (e.g. 'parse-fr'), so slow languages stand out.
+    Time spent in the same phase more than once is added to the same profile.
+    """
+
+    def __init__(self, output_dir):
+        """
+        Create a new PhaseProfiler that saves its results in the given folder.
+        """
+        self.output_dir = output_dir
+        # the cProfile.Profile of every phase, by profile name
+        self.profiles = {}
+
+    def enable(self, name):
+        """
+        Start profiling the phase with the given profile name.
+        Only one phase can be profiled at a time.
+        """
+        if name not in self.profiles:
+            self.profiles[name] = cProfile.Profile()
+        self.profiles[name].enable()
+
+    def disable(self, name):
+        """
+        Stop profiling the phase with the given profile name.
+        """
+        self.profiles[name].disable()
+
+    def write(self):
+        """
+        Save every profile as a .pstats file, for pstats or a profile viewer,
+        and a .collapsed file of stacks and microseconds, for flamegraph.pl or speedscope.
+        Return the list of files written.
+        """
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        written = []
+        for name in sorted(self.profiles):
+            base_path = os.path.join(self.output_dir, _UNSAFE_NAME_CHARS.sub('_', name))
+            stats = pstats.Stats(self.profiles[name])
+            stats.dump_stats(base_path + '.pstats')
+            with open(base_path + '.collapsed', 'w') as collapsed_file:
+                for line in get_collapsed_stacks(stats):
+                    collapsed_file.write(line + '\n')
+            written.extend([base_path + '.pstats', base_path + '.collapsed'])
+        return written
+
+# characters that are not safe in file names on every system
+_UNSAFE_NAME_CHARS = re.compile(r'[^A-Za-z0-9_.@\-]')
+
+# stacks that would be given less time than this, in microseconds, are left out
+_MIN_MICROSECONDS = 1
+
+def get_collapsed_stacks(stats):
+    """
+    Return a list of 'caller;callee;... microseconds' lines for the given pstats.Stats,
+    in the collapsed stack format used by flame graph tools.
+
+    cProfile only records which function called which, not whole stacks,
+    so the time of a function that is called from several places
+    is split between them in proportion to the time spent on each call,
+    and the time of each of those calls is split between the functions it calls the same way.
+    """
+    # the time spent in each function called by each function
+    callees = {}
+    roots = []
+    for (func, (_, _, _, _, callers)) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for (caller, caller_stats) in callers.items():
+            callees.setdefault(caller, []).append((func, caller_stats[3]))
+
+    lines = {}
+    # depth-first, without recursion, so deep call chains can't overflow the stack.
+    # each entry is (function, stack of names so far, functions on the stack, seconds)
+    pending = [
+        (func, [_get_frame_name(func)], set([func]), stats.stats[func][3])
+        for func in sorted(roots)]
+    while pending:
+        (func, stack, on_stack, seconds) = pending.pop()
+        (_, _, own_seconds, total_seconds, _) = stats.stats[func]
+        if total_seconds <= 0:
+            continue
+        share = seconds / total_seconds
+
+        microseconds = int(round(own_seconds * share * 1000000))
+        if microseconds >= _MIN_MICROSECONDS:
+            line = ';'.join(stack)
+            lines[line] = lines.get(line, 0) + microseconds
+
+        for (callee, callee_seconds) in callees.get(func, []):
+            # recursive calls are already counted in the time of the outer call
+            if callee in on_stack or callee_seconds * share * 1000000 < _MIN_MICROSECONDS:
+                continue
+            pending.append((
+                callee, stack + [_get_frame_name(callee)], on_stack | set([callee]),
+                callee_seconds * share))
+
+    return ['{0} {1}'.format(line, lines[line]) for line in sorted(lines)]
+
+def _get_frame_name(func):
+    """
+    Return the name shown in a collapsed stack for a pstats (file, line, function) tuple,
+    e.g. 'get_loc_keys (loc_language.py:201)'.
+    """
+    (file_name, line, name) = func
+    if file_name == '~':
+        # built-in functions have no file
+        frame = name
+    else:
+        frame = '{0} ({1}:{2})'.format(name, os.path.basename(file_name), line)
+    # ';' separates frames in a collapsed stack
+    return frame.replace(';', ':')
+
+if __name__ == '__main__':
+    pass
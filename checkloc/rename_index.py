@@ -0,0 +1,170 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Find keys that look like they were renamed,
+by pairing keys missing from a language with extra keys that are similar to them.
+"""
+
+import random
+import re
+import zlib
+
+class RenameIndex(object):
+    """
+    Find sets of features that are similar to a given set,
+    without comparing it to every set in the index.
+
+    Each set is given a MinHash signature: the smallest value of each of several
+    hash functions over its features. Two sets share each signature value
+    with a probability equal to their Jaccard similarity.
+    Signatures are split into bands, and sets that share any whole band
+    are candidates (locality-sensitive hashing),
+    so a query only looks at sets that are likely to be similar.
+    Candidates are then checked with their exact similarity.
+    """
+
+    # 16 bands of 2 rows: sets with a similarity of 0.5
+    # share at least one band more than 98% of the time
+    _BANDS = 16
+    _ROWS = 2
+    # a Mersenne prime larger than any 32-bit feature hash
+    _PRIME = (1 << 61) - 1
+
+    # the same hash functions are used in every run, so results can be reproduced
+    _SEED = 2014
+
+    def __init__(self, threshold=0.5):
+        """
+        Create a new RenameIndex.
+        'threshold' is the smallest Jaccard similarity a match can have.
+        """
+        self.threshold = threshold
+        self._features = {}
+        # items that share each band of their signature, by (band number, band)
+        self._buckets = {}
+
+        rand = random.Random(self._SEED)
+        self._hashes = [
+            (rand.randint(1, self._PRIME - 1), rand.randint(0, self._PRIME - 1))
+            for _ in range(self._BANDS * self._ROWS)]
+
+    def add(self, item, features):
+        """
+        Add an item with the given set of features to the index.
+        """
+        if not features:
+            return
+        self._features[item] = features
+        for bucket in self._get_buckets(features):
+            self._buckets.setdefault(bucket, []).append(item)
+
+    def query(self, features):
+        """
+        Return a list of tuples (similarity, item) for every item in the index
+        whose features are at least 'threshold' similar to the given features,
+        most similar first.
+        """
+        if not features:
+            return []
+        candidates = set()
+        for bucket in self._get_buckets(features):
+            candidates.update(self._buckets.get(bucket, ()))
+
+        matches = []
+        for item in candidates:
+            similarity = _jaccard(features, self._features[item])
+            if similarity >= self.threshold:
+                matches.append((similarity, item))
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return matches
+
+    def _get_buckets(self, features):
+        """
+        Return the (band number, band) buckets for the MinHash signature of a set of features.
+        """
+        feature_hashes = [zlib.crc32(_to_bytes(feature)) & 0xffffffff for feature in features]
+        signature = [
+            min((a * value + b) % self._PRIME for value in feature_hashes)
+            for (a, b) in self._hashes]
+        return [
+            (band, tuple(signature[band * self._ROWS:(band + 1) * self._ROWS]))
+            for band in range(self._BANDS)]
+
+# parts of a value that are usually the same in every language,
+# and so survive translation: string substitutions, numbers, entity references,
+# markup, web addresses, and capitalized names (e.g. brand names).
+_VALUE_TOKEN = re.compile(
+    r'%(?:[0-9]+\$)?S|[0-9]+|&[#A-Za-z0-9.\-]+;|</?[A-Za-z][^>]*>|https?://\S+|[A-Z][A-Za-z]{2,}')
+
+def get_features(key_name, value):
+    """
+    Return the set of features used to find renamed keys:
+    every three-character piece of the key name,
+    and every piece of the value that is usually left as it is by translators.
+    """
+    name = '^' + key_name.lower() + '$'
+    features = set('k:' + name[i:i + 3] for i in range(len(name) - 2))
+    features.update('v:' + token for token in _VALUE_TOKEN.findall(value))
+    return features
+
+def find_renames(missing, extra, threshold=0.5):
+    """
+    Pair keys missing from a language with extra keys that look like their old names.
+
+    'missing' and 'extra' are dicts of (group, features) tuples by key.
+    Only keys in the same group are paired (e.g. keys with the same string substitutions).
+    Each key is paired at most once, most similar pairs first.
+    Return a dict of the missing key for each paired extra key.
+    """
+    indexes = {}
+    for key in missing:
+        (group, features) = missing[key]
+        if group not in indexes:
+            indexes[group] = RenameIndex(threshold)
+        indexes[group].add(key, features)
+
+    pairs = []
+    for key in extra:
+        (group, features) = extra[key]
+        if group in indexes:
+            for (similarity, missing_key) in indexes[group].query(features):
+                pairs.append((-similarity, key, missing_key))
+
+    renames = {}
+    paired = set()
+    for (_, extra_key, missing_key) in sorted(pairs):
+        if extra_key not in renames and missing_key not in paired:
+            renames[extra_key] = missing_key
+            paired.add(missing_key)
+    return renames
+
+def _jaccard(first, second):
+    """
+    Return the Jaccard similarity of two sets: the size of their intersection
+    divided by the size of their union.
+    """
+    return len(first & second) / float(len(first | second))
+
+def _to_bytes(text):
+    """
+    Return the given text as bytes, so it can be hashed.
+    """
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+if __name__ == '__main__':
+    pass
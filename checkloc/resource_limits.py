@@ -0,0 +1,167 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Limit the resources used to read any one localization file,
+so a broken or hostile file can't make a run take too long.
+"""
+
+import re
+
+# allow importing both as a package and from the command line
+try:
+    from . import file_source
+except (ImportError, ValueError):
+    import file_source
+
+class ResourceLimits(object):
+    """
+    Limit the resources used to read any one localization file,
+    so a broken or hostile file can't make a run take too long.
+
+    The defaults are far larger than any real localization file needs.
+    Everything except the parse time is checked before a file is parsed,
+    using simple scans that take time linear in the size of the file.
+    A limit of None is off: there is no parse time limit unless one is given,
+    since the time taken depends on the machine as much as on the file.
+    """
+
+    # the default value of each limit, by the name used on the command line
+    DEFAULTS = {
+        'bytes': 256 * 1024 * 1024,
+        'line-length': 64 * 1024,
+        'entities': 20000,
+        'entity-depth': 8,
+        'parse-seconds': None,
+    }
+
+    # DTD parameter entities are expanded while the DTD is parsed, e.g.
+    #   <!ENTITY % part "some text">
+    #   <!ENTITY whole "%part;%part;">
+    _PARAMETER_ENTITY_DECL = re.compile(
+        br'<!--.*?-->|<!ENTITY\s+%\s+([^\s"\'>]+)\s+(?:"([^"]*)"|\'([^\']*)\')', re.DOTALL)
+    _PARAMETER_ENTITY_REF = re.compile(br'%([A-Za-z_:][A-Za-z0-9_:.\-]*);')
+    _LINE_SEP = re.compile(br'[\n\r\f]')
+
+    def __init__(self, **limits):
+        """
+        Create a new ResourceLimits.
+        Any limit in DEFAULTS can be given, with '_' in place of '-'
+        (e.g. line_length=1000). Every other limit keeps its default.
+        """
+        for name in limits:
+            if name.replace('_', '-') not in self.DEFAULTS:
+                raise ValueError("Unknown limit '{0}'".format(name))
+        get = lambda name: limits.get(name.replace('-', '_'), self.DEFAULTS[name])
+        self.max_bytes = get('bytes')
+        self.max_line_length = get('line-length')
+        self.max_entities = get('entities')
+        self.max_entity_depth = get('entity-depth')
+        self.max_parse_seconds = get('parse-seconds')
+
+    def check_size(self, size):
+        """
+        Return a description of the limit exceeded by a file of 'size' bytes, or None.
+        """
+        if size > self.max_bytes:
+            return "it is {0} bytes long; the limit is {1} bytes".format(size, self.max_bytes)
+        return None
+
+    def check_data(self, data, is_dtd):
+        """
+        Return a description of the first limit exceeded by the contents of a file, or None.
+        """
+        problem = self.check_size(len(data))
+        if problem:
+            return problem
+
+        # no line can be too long in a file that is shorter than the limit,
+        # which is almost every file
+        if len(data) > self.max_line_length:
+            longest = 0
+            start = 0
+            for separator in self._LINE_SEP.finditer(data):
+                longest = max(longest, separator.start() - start)
+                start = separator.end()
+            longest = max(longest, len(data) - start)
+            if longest > self.max_line_length:
+                return "it has a line {0} bytes long; the limit is {1} bytes".format(
+                    longest, self.max_line_length)
+
+        if is_dtd:
+            entities = data.count(b'<!ENTITY')
+            if entities > self.max_entities:
+                return "it declares {0} entities; the limit is {1}".format(
+                    entities, self.max_entities)
+            return self._check_parameter_entities(data)
+        return None
+
+    def _check_parameter_entities(self, data):
+        """
+        Return a description of the limit exceeded by expanding the parameter entities
+        declared in DTD data, or None.
+        Expanding them would take too long if they nest too deeply,
+        loop back on themselves, or would expand to more than the byte limit.
+        """
+        refs = {}
+        sizes = {}
+        for match in self._PARAMETER_ENTITY_DECL.finditer(data):
+            name = match.group(1)
+            if name is None or name in refs:
+                continue
+            value = match.group(2) if match.group(2) is not None else match.group(3)
+            refs[name] = self._PARAMETER_ENTITY_REF.findall(value)
+            sizes[name] = len(value)
+
+        # depth-first, without recursion, remembering the depth and size of each entity.
+        # each entry is (name, the references of that entity not visited yet)
+        results = {}
+        for start in refs:
+            if start in results:
+                continue
+            results[start] = None
+            stack = [(start, iter(refs[start]))]
+            while stack:
+                (name, pending) = stack[-1]
+                for ref in pending:
+                    if ref not in refs:
+                        continue
+                    if ref not in results:
+                        results[ref] = None
+                        stack.append((ref, iter(refs[ref])))
+                        break
+                    if results[ref] is None:
+                        return "parameter entity '{0}' refers back to itself".format(
+                            file_source.to_text(ref))
+                else:
+                    stack.pop()
+                    (depth, size) = (0, sizes[name])
+                    for ref in refs[name]:
+                        if ref in results:
+                            depth = max(depth, results[ref][0] + 1)
+                            size += results[ref][1]
+                    if depth > self.max_entity_depth:
+                        return (
+                            "parameter entity '{0}' nests {1} levels deep; the limit is {2}"
+                            .format(file_source.to_text(name), depth, self.max_entity_depth))
+                    if size > self.max_bytes:
+                        return (
+                            "parameter entity '{0}' expands to {1} bytes; the limit is {2}"
+                            .format(file_source.to_text(name), size, self.max_bytes))
+                    results[name] = (depth, size)
+        return None
+
+if __name__ == '__main__':
+    pass
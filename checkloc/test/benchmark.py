@@ -0,0 +1,114 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Time how long checkloc takes to validate a large generated extension,
+so different versions of checkloc and of Python can be compared.
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import timeit
+
+# allow importing and running both as a package and from the command line
+if __package__ is None:
+    import sys
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import checkloc
+else:
+    from .. import checkloc
+
+def make_locales(base_dir, languages, files, keys):
+    """
+    Write a locale folder for each language into 'base_dir',
+    each with the given number of .properties and .dtd files and keys per file.
+    Every language has the same keys, plus a few problems so errors are also reported.
+    """
+    lang_names = ['en-US'] + ['l{0:03d}'.format(i) for i in range(1, languages)]
+    for (lang_number, lang) in enumerate(lang_names):
+        lang_dir = os.path.join(base_dir, lang)
+        os.makedirs(lang_dir)
+        for file_number in range(files):
+            prop_lines = ['# file {0} for {1}'.format(file_number, lang)]
+            dtd_lines = ['<!-- file {0} for {1} -->'.format(file_number, lang)]
+            for key_number in range(keys):
+                # every tenth language is missing a key, or has a different substitution
+                if lang_number % 10 == 9 and key_number == file_number:
+                    continue
+                sub = '%S' if lang_number % 10 != 8 or key_number != 0 else '%1$S'
+                prop_lines.append(
+                    'key.{0}=Value {0} in {1} with {2} and caf\xc3\xa9'
+                    .format(key_number, lang, sub))
+                dtd_lines.append(
+                    '<!ENTITY key.{0} "Value {0} in {1} &amp; caf\xc3\xa9">'
+                    .format(key_number, lang))
+
+            for (extension, lines) in (('properties', prop_lines), ('dtd', dtd_lines)):
+                path = os.path.join(lang_dir, 'file{0}.{1}'.format(file_number, extension))
+                data = '\n'.join(lines) + '\n'
+                if not isinstance(data, bytes):
+                    data = data.encode('latin-1') # i.e. the UTF-8 bytes written above
+                with open(path, 'wb') as openfile:
+                    openfile.write(data)
+
+def main():
+    """
+    Parse arguments, generate the test extension, and print timings.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--languages', type=int, default=100,
+        help="Number of languages to generate. Default: %(default)s.")
+    parser.add_argument(
+        '--files', type=int, default=10,
+        help="Number of .properties and of .dtd files in each language. Default: %(default)s.")
+    parser.add_argument(
+        '--keys', type=int, default=100,
+        help="Number of keys in each file. Default: %(default)s.")
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help="Number of times to run the validation. The fastest run is reported. "
+        "Default: %(default)s.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    base_dir = tempfile.mkdtemp()
+    try:
+        make_locales(base_dir, args.languages, args.files, args.keys)
+
+        def run():
+            """
+            Validate the generated extension once.
+            """
+            checker = checkloc.CheckLoc(locales_only=True, manifest_dir=base_dir, summary=True)
+            checker.validate_loc_files()
+
+        times = timeit.repeat(run, number=1, repeat=args.repeat)
+    finally:
+        shutil.rmtree(base_dir)
+
+    print("{0} {1}: {2} languages x {3} files x {4} keys: best {5:.3f}s, mean {6:.3f}s".format(
+        platform.python_implementation(), platform.python_version(),
+        args.languages, args.files * 2, args.keys,
+        min(times), sum(times) / len(times)))
+
+if __name__ == '__main__':
+    main()
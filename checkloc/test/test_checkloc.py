@@ -21,18 +21,46 @@ from __future__ import print_function
 
 from abc import ABCMeta
 import argparse
+import io
+import json
 import logging
+import multiprocessing
 import os
+import shutil
+import sys
+import tempfile
 import unittest
 import warnings
+import zipfile
 
 # allow importing and running both as a package and from the command line
 if __package__ is None:
-    import sys
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     import checkloc
+    import diagnostic
+    import history_store
+    import key_index
+    import line_index
+    import loc_file
+    import loc_language
+    import locale_index
+    import lsp_server
+    import perf_store
+    import rename_index
+    import resource_limits
 else:
     from .. import checkloc
+    from .. import diagnostic
+    from .. import history_store
+    from .. import key_index
+    from .. import line_index
+    from .. import loc_file
+    from .. import loc_language
+    from .. import locale_index
+    from .. import lsp_server
+    from .. import perf_store
+    from .. import rename_index
+    from .. import resource_limits
 
 # relative directory that contains test data
 TEST_DATA_SUBDIR = 'test_data'
@@ -245,6 +273,915 @@ class TestChecklocModule(unittest.TestCase):
         errors = checker.validate_loc_files()
         self.assertTrue(errors)
 
+    def test_summary_mode_counts_diagnostics_by_language_file_and_category(self):
+        base_dir = os.path.join(self.test_data_dir, 'invalid_lang_has_extra_key')
+        checker = checkloc.CheckLoc(locales_only=True, manifest_dir=base_dir, summary=True)
+        errors = checker.validate_loc_files()
+        self.assertTrue(errors)
+        self.assertEqual(
+            checker.summary_counts,
+            {'test': {'two.properties': {'extra-key': 1}}})
+        self.assertEqual(checker.messages_by_language, {})
+
+    def test_summary_table_has_one_row_per_language_and_file(self):
+        table = checkloc._format_summary_table({
+            'fr': {
+                'one.properties': {'missing-key': 3, 'extra-key': 1},
+                'two.dtd': {'missing-key': 2}}})
+        lines = table.split('\n')
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0].split(), ['Language', 'File', 'extra-key', 'missing-key'])
+        self.assertEqual(lines[1].split(), ['fr', '(all', 'files)', '1', '5'])
+        self.assertEqual(lines[3].split(), ['two.dtd', '-', '2'])
+
+    def test_missing_keys_are_grouped_into_runs_of_sorted_keys(self):
+        baseline = loc_file.LocalizationFile('one.properties', None)
+        loc = loc_file.LocalizationFile('one.properties', None)
+        for name in ['h', 'b', 'a', 'c', 'e', 'd', 'g', 'f']:
+            baseline.add_key_name(name)
+        for name in ['a', 'd', 'z']:
+            loc.add_key_name(name)
+        (missing, extra) = baseline.compare_keys(loc)
+        self.assertEqual(missing, [(1, 2), (4, 7)])
+        self.assertEqual(extra, [(2, 2)])
+
+    def test_missing_file_is_reported_once_but_counts_every_key(self):
+        base_dir = os.path.join(self.test_data_dir, 'invalid_base_has_extra_key')
+        checker = checkloc.CheckLoc(locales_only=True, manifest_dir=base_dir, summary=True)
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(
+            checker.summary_counts,
+            {'test': {'two.properties': {'missing-key': 1}}})
+
+    def test_file_fingerprint_ignores_key_order_but_not_substitutions(self):
+        first = loc_file.LocalizationFile('one.properties', None)
+        second = loc_file.LocalizationFile('one.properties', None)
+        first.add_key_name('a', subs='[1, 2]')
+        first.add_key_name('b')
+        second.add_key_name('b')
+        self.assertNotEqual(first.get_fingerprint(), second.get_fingerprint())
+        second.add_key_name('a', subs='[1, 2]')
+        self.assertEqual(first.get_fingerprint(), second.get_fingerprint())
+
+        third = loc_file.LocalizationFile('one.properties', None)
+        third.add_key_name('a', subs='[]')
+        third.add_key_name('b')
+        self.assertNotEqual(first.get_fingerprint(), third.get_fingerprint())
+
+    def test_line_index_maps_offsets_to_lines_and_columns(self):
+        index = line_index.LineIndex(b'one\ntwo\n\nfour')
+        self.assertEqual(index.get_line_count(), 4)
+        self.assertEqual(index.get_line_and_column(0), (1, 1))
+        self.assertEqual(index.get_line_and_column(3), (1, 4))
+        self.assertEqual(index.get_line_and_column(4), (2, 1))
+        self.assertEqual(index.get_line_and_column(9), (4, 1))
+        self.assertEqual(index.get_line_offsets(2), (4, 7))
+        self.assertEqual(index.get_line_offsets(4), (9, None))
+
+        # the same line breaks as .properties files, with '\r\n' as one break
+        index = line_index.LineIndex(b'one\rtwo\r\nthree\ffour')
+        self.assertEqual(index.get_line_count(), 4)
+        self.assertEqual(index.get_line_and_column(4), (2, 1))
+        self.assertEqual(index.get_line_and_column(9), (3, 1))
+        self.assertEqual(index.get_line_and_column(15), (4, 1))
+        self.assertEqual(index.get_line_offsets(2), (4, 7))
+        self.assertEqual(index.get_line_offsets(3), (9, 14))
+
+    def test_every_key_knows_its_line_and_column(self):
+        loc_dir = os.path.join(self.test_data_dir, 'valid_characters', 'en-US')
+        loc = loc_language.LocalizationLanguage(
+            loc_dir, 'en-US', lambda msg, lang: None, lambda msg, lang: None)
+        self.assertFalse(loc.get_loc_keys())
+        location = loc.get_location('valid_data.properties/keyWithWhitespaceBeforeItOnTheLine')
+        self.assertEqual(location.get_line_and_column(), (8, 12))
+        location = loc.get_location('valid_data.dtd/numbers')
+        self.assertEqual(location.get_line_and_column(), (5, 10))
+        self.assertTrue(str(location).endswith('valid_data.dtd:5:10'))
+
+    def test_keys_in_files_with_cr_line_endings_know_their_line_and_column(self):
+        loc_dir = os.path.join(self.test_data_dir, 'valid_properties_cr_line_endings', 'en-US')
+        loc = loc_language.LocalizationLanguage(
+            loc_dir, 'en-US', lambda msg, lang: None, lambda msg, lang: None)
+        self.assertFalse(loc.get_loc_keys())
+        location = loc.get_location('valid_data.properties/first')
+        self.assertEqual(location.get_line_and_column(), (2, 1))
+        location = loc.get_location('valid_data.properties/second')
+        self.assertEqual(location.get_line_and_column(), (3, 3))
+        location = loc.get_location('valid_data.properties/third')
+        self.assertEqual(location.get_line_and_column(), (5, 1))
+
+    def test_invalid_utf8_is_reported_at_the_first_bad_byte(self):
+        errors = []
+        loc = loc_language.LocalizationLanguage(
+            '', 'en-US', lambda msg, lang: None, lambda msg, lang: errors.append(msg))
+        loc.load_file('ok.properties', 'ok.properties', b'a=Caf\xc3\xa9\nb=\xe2\x82\xac\n')
+        self.assertEqual(errors, [])
+        loc.load_file('bad.properties', 'bad.properties', b'a=Caf\xc3\xa9\nb=\xe2\x82\n')
+        self.assertEqual([msg.category for msg in errors], ['encoding'])
+        self.assertEqual(errors[0].location.get_line_and_column(), (2, 3))
+        self.assertIn('byte offset 10 (line 2)', str(errors[0]))
+
+    def test_entity_references_are_resolved_across_dtd_files(self):
+        found = []
+        loc = loc_language.LocalizationLanguage(
+            '', 'en-US', lambda msg, lang: found.append(msg), lambda msg, lang: found.append(msg))
+        loc.load_file('names.dtd', 'names.dtd', b'<!ENTITY name "Extension">\n')
+        loc.load_file('main.dtd', 'main.dtd', (
+            b'<!ENTITY title "&name; for &brandShortName; &amp; &#38;">\n'
+            b'<!ENTITY self "&self;">\n'
+            b'<!ENTITY typo "&nmae;">\n'
+            b'<!ENTITY global "&global.name;">\n'))
+        loc.check_entity_references()
+        self.assertEqual(
+            sorted((msg.category, msg.key) for msg in found),
+            [('entity-reference', 'main.dtd/self'),
+             ('undeclared-entity', 'main.dtd/global'), ('undeclared-entity', 'main.dtd/typo')])
+
+        # entities from outside the extension can be allowed,
+        # and entities that were declared but not kept are not undeclared
+        found[:] = []
+        loc = loc_language.LocalizationLanguage(
+            '', 'en-US', lambda msg, lang: found.append(msg), lambda msg, lang: found.append(msg),
+            known_entities=['global.name'])
+        loc.load_file('main.dtd', 'main.dtd', (
+            b'<!ENTITY global "&global.name;">\n'
+            b'<!ENTITY markup "<b>">\n'
+            b'<!ENTITY uses "&markup;">\n'))
+        loc.check_entity_references()
+        self.assertEqual([msg.category for msg in found], ['invalid-value'])
+
+        # a long chain is only reported once, at the value that is first too deep
+        found[:] = []
+        chain = [b'<!ENTITY e0 "end">']
+        chain += [
+            '<!ENTITY e{0} "&e{1};">'.format(i, i - 1).encode('ascii') for i in range(1, 3000)]
+        loc.load_file('main.dtd', 'main.dtd', b'\n'.join(chain))
+        loc.check_entity_references()
+        self.assertEqual(
+            [(msg.category, msg.key) for msg in found],
+            [('deep-entity-reference', 'main.dtd/e9')])
+
+    def test_files_that_exceed_a_resource_limit_are_skipped(self):
+        errors = []
+        loc = loc_language.LocalizationLanguage(
+            '', 'en-US', lambda msg, lang: None, lambda msg, lang: errors.append(msg),
+            limits=resource_limits.ResourceLimits(
+                bytes=1000, line_length=50, entities=3, entity_depth=2))
+        loc.load_file('ok.properties', 'ok.properties', b'a=b\n')
+        loc.load_file('long.properties', 'long.properties', b'a=b\nc=' + b'x' * 60 + b'\n')
+        loc.load_file('many.dtd', 'many.dtd', b'<!ENTITY a "a">\n' * 4)
+        loc.load_file('deep.dtd', 'deep.dtd', (
+            b'<!ENTITY % a "x">\n<!ENTITY % b "%a;">\n'
+            b'<!ENTITY % c "%b;">\n<!ENTITY % d "%c;">\n'))
+        loc.load_file('wide.dtd', 'wide.dtd', (
+            b'<!ENTITY % a "' + b'x' * 30 + b'">\n<!ENTITY % b "' + b'%a;' * 10 + b'">\n'
+            b'<!ENTITY % c "%b;%b;%b;%b;">\n'))
+        loc.load_file('loop.dtd', 'loop.dtd', b'<!ENTITY % a "%b;">\n<!ENTITY % b "%a;">\n')
+        self.assertEqual(sorted(loc.keys), ['ok.properties/a'])
+        self.assertEqual(
+            [(msg.category, msg.file_name) for msg in errors],
+            [('resource-limit', name) for name in
+             ['long.properties', 'many.dtd', 'deep.dtd', 'wide.dtd', 'loop.dtd']])
+        self.assertIn('expands to 1332 bytes', str(errors[3]))
+
+        # a file that takes too long is skipped, and none of its keys are kept
+        errors[:] = []
+        loc.limits = resource_limits.ResourceLimits(parse_seconds=0)
+        loc.load_file('ok.properties', 'ok.properties', b'a=b\n')
+        self.assertEqual(loc.keys, {})
+        self.assertIn('took longer than 0 seconds', str(errors[0]))
+
+    def test_default_resource_limits_allow_large_valid_files(self):
+        errors = []
+        loc = loc_language.LocalizationLanguage(
+            '', 'en-US', lambda msg, lang: None, lambda msg, lang: errors.append(msg),
+            limits=resource_limits.ResourceLimits())
+        self.assertIsNone(loc.limits.max_parse_seconds)
+        # larger than the old 4 MB default
+        loc.load_file('large.dtd', 'large.dtd', (
+            b'<!-- ' + b'x' * 1000 + b' -->\n') * 5000 + b'<!ENTITY a "a">\n')
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(loc.keys), ['large.dtd/a'])
+        # limits that are off by default can still be turned on
+        self.assertEqual(checkloc._parse_limit('parse-seconds=2'), ('parse_seconds', 2.0))
+
+    def _make_large_properties_data(self):
+        """
+        Return .properties data large enough to be scanned in parallel, and its number of lines.
+        """
+        line_count = loc_language.LocalizationLanguage._PARALLEL_PROPERTIES_BYTES // 200 + 1
+        data = b''.join(
+            'key{0}='.format(i).encode('ascii') + b'v' * 200 + b'\n' for i in range(line_count))
+        self.assertGreater(len(data), loc_language.LocalizationLanguage._PARALLEL_PROPERTIES_BYTES)
+        return (data, line_count)
+
+    def _record_pools(self):
+        """
+        Record the arguments of every multiprocessing.Pool created until the test is done,
+        and whether it was terminated. Return the list they are recorded in.
+        """
+        pools = []
+        make_pool = multiprocessing.Pool
+        def record_pool(*args, **kwargs):
+            pool = make_pool(*args, **kwargs)
+            record = {'args': args, 'terminated': False}
+            pools.append(record)
+            terminate = pool.terminate
+            def record_terminate():
+                record['terminated'] = True
+                terminate()
+            pool.terminate = record_terminate
+            return pool
+        multiprocessing.Pool = record_pool
+        self.addCleanup(setattr, multiprocessing, 'Pool', make_pool)
+        return pools
+
+    def test_large_properties_files_are_scanned_in_parallel_with_default_limits(self):
+        (data, line_count) = self._make_large_properties_data()
+        pools = self._record_pools()
+        errors = []
+        pool = multiprocessing.Pool(2)
+        self.addCleanup(pool.terminate)
+        get_pool_calls = []
+        def get_pool():
+            get_pool_calls.append(pool)
+            return pool
+        loc = loc_language.LocalizationLanguage(
+            '', 'en-US', lambda msg, lang: None, lambda msg, lang: errors.append(msg),
+            limits=resource_limits.ResourceLimits(), get_parse_pool=get_pool)
+        loc.load_file('small.properties', 'small.properties', b'a=b\n')
+        self.assertEqual(get_pool_calls, [])
+        loc.load_file('large.properties', 'large.properties', data)
+        self.assertEqual(get_pool_calls, [pool])
+        self.assertEqual(len(pools), 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(loc.keys), line_count + 1)
+        self.assertEqual(
+            loc.files['large.properties'].get_location('key{0}'.format(line_count - 1))
+            .get_line_and_column(), (line_count, 1))
+
+        # without a pool, e.g. from the library or the language server,
+        # large files are scanned in this process
+        loc = loc_language.LocalizationLanguage(
+            '', 'en-US', lambda msg, lang: None, lambda msg, lang: errors.append(msg))
+        loc.load_file('large.properties', 'large.properties', data)
+        self.assertEqual(len(pools), 1)
+        self.assertEqual(len(loc.keys), line_count)
+
+    def test_one_parse_pool_is_shared_by_every_language_in_a_run(self):
+        (data, _) = self._make_large_properties_data()
+        base_dir = self._make_temp_dir()
+        for lang in ['en-US', 'fr']:
+            os.makedirs(os.path.join(base_dir, lang))
+            with open(os.path.join(base_dir, lang, 'large.properties'), 'wb') as out_file:
+                out_file.write(data)
+        pools = self._record_pools()
+
+        # off by default for the library
+        check = checkloc.CheckLoc(locales_only=True, manifest_dir=base_dir, summary=True)
+        self.assertFalse(check.validate_loc_files())
+        self.assertEqual(pools, [])
+
+        check = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, parse_processes=2)
+        self.assertFalse(check.validate_loc_files())
+        self.assertEqual(pools, [{'args': (2,), 'terminated': True}])
+        self.assertIsNone(check._parse_pool)
+        # each run has its own pool
+        self.assertFalse(check.validate_loc_files())
+        self.assertEqual(len(pools), 2)
+        self.assertTrue(pools[1]['terminated'])
+
+        self.assertEqual(checkloc._parse_process_count('3'), 3)
+        for value in ['0', 'x']:
+            self.assertRaises(argparse.ArgumentTypeError, checkloc._parse_process_count, value)
+
+    def _make_temp_dir(self):
+        """
+        Create a temporary folder that is removed when the test is done, and return its path.
+        """
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        return temp_dir
+
+    def _copy_test_data(self, name):
+        """
+        Copy the named folder of test data to a temporary folder, so a test can change it,
+        and return the path of the copy.
+        """
+        base_dir = os.path.join(self._make_temp_dir(), name)
+        shutil.copytree(os.path.join(self.test_data_dir, name), base_dir)
+        return base_dir
+
+    def _write_file(self, base_dir, path, lines):
+        """
+        Replace the file at 'path' inside 'base_dir' with the given lines,
+        creating any folders it needs.
+        """
+        full_path = os.path.join(base_dir, path)
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        with open(full_path, 'w') as out_file:
+            out_file.write(''.join(line + '\n' for line in lines))
+
+    def test_history_flags_translations_not_updated_after_baseline_changes(self):
+        base_dir = self._make_temp_dir()
+        history_path = os.path.join(self._make_temp_dir(), 'history.db')
+        def write_value(lang, value):
+            self._write_file(
+                base_dir, os.path.join(lang, 'one.properties'),
+                ['greeting=' + value, 'farewell=Bye'])
+
+        def check(baselines=None):
+            checker = checkloc.CheckLoc(
+                locales_only=True, manifest_dir=base_dir, summary=True,
+                history_path=history_path, baselines=baselines)
+            self.assertFalse(checker.validate_loc_files())
+            return checker.summary_counts
+
+        write_value('en-US', 'Hello')
+        write_value('fr', 'Bonjour')
+        self.assertEqual(check(), {})
+
+        write_value('en-US', 'Hello there')
+        stale = {'fr': {'one.properties': {'stale-translation': 1}}}
+        self.assertEqual(check(), stale)
+        # still stale until the translation itself changes
+        self.assertEqual(check(), stale)
+
+        write_value('fr', 'Bonjour toi')
+        self.assertEqual(check(), {})
+
+        # a translation is only compared against the history of its own baseline
+        write_value('en-CA', 'Hello, eh')
+        self.assertEqual(check({'fr': ['en-CA']}), {})
+        self.assertEqual(check(), {})
+        # runs are only kept when a baseline changed
+        history = history_store.HistoryStore(history_path)
+        self.addCleanup(history.close)
+        self.assertEqual(
+            history.connection.execute("SELECT COUNT(*) FROM runs").fetchone()[0], 3)
+
+    def test_languages_are_compared_against_their_assigned_baseline(self):
+        base_dir = os.path.join(self.test_data_dir, 'other_assigned_baselines')
+
+        checker = checkloc.CheckLoc(locales_only=True, manifest_dir=base_dir, summary=True)
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(sorted(checker.summary_counts), ['pt-BR', 'pt-PT'])
+
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True,
+            baselines={'pt-BR': ['xx', 'pt-PT']})
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(
+            checker.summary_counts,
+            {'pt-PT': {'one.properties': {'extra-key': 1}}})
+
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True,
+            default_baseline='pt-PT')
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(
+            checker.summary_counts,
+            {'en-US': {'one.properties': {'missing-key': 1}}})
+
+    def _make_xpi(self, source_dir, jar_locales=False):
+        """
+        Pack the extension in 'source_dir' into a temporary .xpi file and return its path.
+        If 'jar_locales' is True, pack the locale folders into a .jar file inside the .xpi
+        and register them in chrome.manifest with jar: URIs.
+        """
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        xpi_path = os.path.join(temp_dir, 'test.xpi')
+        jar_path = os.path.join(temp_dir, 'test.jar')
+
+        with zipfile.ZipFile(xpi_path, 'w') as xpi, zipfile.ZipFile(jar_path, 'w') as jar:
+            for (dir_path, _, files) in os.walk(source_dir):
+                for file_name in files:
+                    full_path = os.path.join(dir_path, file_name)
+                    name = os.path.relpath(full_path, source_dir).replace(os.sep, '/')
+                    if jar_locales and name.startswith('chrome/locale/'):
+                        jar.write(full_path, name[len('chrome/'):])
+                    elif jar_locales and name == 'chrome.manifest':
+                        with open(full_path) as manifest:
+                            xpi.writestr(name, manifest.read().replace(
+                                'chrome/locale/', 'jar:chrome/test.jar!/locale/'))
+                    else:
+                        xpi.write(full_path, name)
+        if jar_locales:
+            with zipfile.ZipFile(xpi_path, 'a') as xpi:
+                xpi.write(jar_path, 'chrome/test.jar')
+        return xpi_path
+
+    def test_xpi_files_are_read_without_extracting_them(self):
+        for jar_locales in (False, True):
+            xpi_path = self._make_xpi(
+                os.path.join(self.test_data_dir, 'manifest_valid_data'), jar_locales)
+            checker = checkloc.CheckLoc(manifest_dir=xpi_path)
+            self.assertFalse(checker.validate_loc_files())
+
+            xpi_path = self._make_xpi(
+                os.path.join(self.test_data_dir, 'manifest_invalid_manifest_locale_not_on_disk'),
+                jar_locales)
+            checker = checkloc.CheckLoc(manifest_dir=xpi_path)
+            self.assertTrue(checker.validate_loc_files())
+
+        xpi_path = self._make_xpi(os.path.join(self.test_data_dir, 'invalid_lang_has_extra_key'))
+        checker = checkloc.CheckLoc(locales_only=True, manifest_dir=xpi_path, summary=True)
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(
+            checker.summary_counts,
+            {'test': {'two.properties': {'extra-key': 1}}})
+
+    def test_shards_check_every_language_once_and_merge_into_one_result(self):
+        base_dir = os.path.join(self.test_data_dir, 'other_many_languages')
+
+        checker = checkloc.CheckLoc(locales_only=True, manifest_dir=base_dir, summary=True)
+        self.assertTrue(checker.validate_loc_files())
+        full_counts = checker.summary_counts
+
+        shard_counts = []
+        shard_messages = []
+        for index in range(1, 4):
+            checker = checkloc.CheckLoc(
+                locales_only=True, manifest_dir=base_dir, summary=True, shard=(index, 3))
+            checker.validate_loc_files()
+            shard_counts.append(checker.summary_counts)
+            checker = checkloc.CheckLoc(
+                locales_only=True, manifest_dir=base_dir, output_json=True, shard=(index, 3))
+            checker.validate_loc_files()
+            shard_messages.append(checker.messages_by_language)
+
+        langs = [lang for counts in shard_counts for lang in counts]
+        self.assertEqual(sorted(langs), sorted(full_counts))
+        self.assertEqual(checkloc._merge_results(shard_counts), (full_counts, True))
+
+        (merged, errors) = checkloc._merge_results(shard_messages)
+        self.assertTrue(errors)
+        self.assertEqual(sorted(merged), sorted(full_counts))
+        self.assertEqual(
+            checkloc._merge_results([{'Main': ['WARNING: (Main) x']}] * 2),
+            ({'Main': ['WARNING: (Main) x']}, False))
+        # copies found by one shard are kept; copies found by every shard are merged
+        self.assertEqual(
+            checkloc._merge_results([
+                {'Main': ['ERROR: (Main) x', 'ERROR: (Main) x']},
+                {'Main': ['ERROR: (Main) x', 'WARNING: (Main) y']}]),
+            ({'Main': ['ERROR: (Main) x', 'ERROR: (Main) x', 'WARNING: (Main) y']}, True))
+
+    def test_merging_shards_that_ran_out_of_time_is_a_partial_result(self):
+        base_dir = os.path.join(self.test_data_dir, 'other_matching_languages')
+        for (summary, output_json) in ((True, False), (False, True)):
+            results = []
+            for (index, time_budget) in ((1, None), (2, 0)):
+                checker = checkloc.CheckLoc(
+                    locales_only=True, manifest_dir=base_dir, summary=summary,
+                    output_json=output_json, shard=(index, 2), time_budget=time_budget)
+                self.assertFalse(checker.validate_loc_files())
+                results.append(checker.summary_counts if summary else checker.messages_by_language)
+
+            (merged, errors) = checkloc._merge_results(results)
+            self.assertFalse(errors)
+            self.assertTrue(checkloc._is_partial_result(merged))
+            self.assertFalse(checkloc._is_partial_result(results[0]))
+
+    def test_only_changed_files_are_checked(self):
+        base_dir = os.path.join(self.test_data_dir, 'other_changed_files')
+
+        def check(*changed):
+            checker = checkloc.CheckLoc(
+                locales_only=True, manifest_dir=base_dir, summary=True,
+                changed_files=[os.path.join(base_dir, path) for path in changed])
+            checker.validate_loc_files()
+            return checker.summary_counts
+
+        self.assertEqual(check('fr/two.properties'), {})
+        self.assertEqual(
+            check('fr/one.properties'),
+            {'fr': {'one.properties': {'missing-key': 1}}})
+        self.assertEqual(
+            check('de/two.properties', 'README'),
+            {'de': {'two.properties': {'extra-key': 1}}})
+        # a change to the baseline checks that file in every language
+        self.assertEqual(
+            check('en-US/one.properties'),
+            {'fr': {'one.properties': {'missing-key': 1}},
+             'de': {'one.properties': {'extra-key': 1}}})
+
+        # the extension folder can come before or after the files
+        parser = checkloc._get_parser()
+        for argv in (['ext', '--files', 'fr/one.properties', '--files', 'de/two.properties'],
+                     ['--files', 'fr/one.properties', '--files', 'de/two.properties', 'ext']):
+            args = parser.parse_args(argv)
+            self.assertEqual(args.manifest_dir, 'ext')
+            self.assertEqual(args.files, ['fr/one.properties', 'de/two.properties'])
+        self.assertEqual(parser.parse_args(['--files', '-', 'ext']).files, ['-'])
+
+    def test_language_server_updates_diagnostics_as_files_are_edited(self):
+        base_dir = os.path.join(self.test_data_dir, 'other_missing_key')
+        fr_path = os.path.join(base_dir, 'fr', 'one.properties')
+        fr_uri = lsp_server._path_to_uri(fr_path)
+
+        messages = [
+            {'id': 1, 'method': 'initialize', 'params': {}},
+            {'method': 'initialized', 'params': {}},
+            {'method': 'textDocument/didOpen', 'params': {'textDocument': {
+                'uri': fr_uri, 'text': 'a=value\nb=value\n'}}},
+            {'id': 2, 'method': 'textDocument/definition', 'params': {
+                'textDocument': {'uri': fr_uri}, 'position': {'line': 1, 'character': 0}}},
+            {'method': 'textDocument/didChange', 'params': {
+                'textDocument': {'uri': fr_uri},
+                'contentChanges': [{'text': 'a=%S\nb=value\n'}]}},
+            # lines that end with '\r' are counted like the parsers count them
+            {'method': 'textDocument/didChange', 'params': {
+                'textDocument': {'uri': fr_uri},
+                'contentChanges': [{'text': u'a=value\r    b=%S\n#\u00e9\u00e9\u00e9\n'}]}},
+            {'id': 3, 'method': 'shutdown'},
+            {'method': 'exit'},
+        ]
+        input_stream = io.BytesIO()
+        for message in messages:
+            message['jsonrpc'] = '2.0'
+            body = json.dumps(message).encode('utf-8')
+            input_stream.write('Content-Length: {0}\r\n\r\n'.format(len(body)).encode('ascii'))
+            input_stream.write(body)
+        input_stream.seek(0)
+        output_stream = io.BytesIO()
+
+        server = lsp_server.LanguageServer(
+            base_dir, locales_only=True, input_stream=input_stream, output_stream=output_stream)
+        self.assertEqual(server.serve(), 0)
+
+        output = output_stream.getvalue().decode('utf-8')
+        responses = [json.loads(part[part.index('{'):])
+                     for part in output.split('Content-Length: ')[1:]]
+        published = [response['params'] for response in responses
+                     if response.get('method') == 'textDocument/publishDiagnostics']
+        results = dict((response['id'], response['result'])
+                       for response in responses if 'id' in response)
+
+        self.assertTrue(results[1]['capabilities']['definitionProvider'])
+        # 'b' is missing until the file is opened with it added
+        self.assertEqual(published[0]['uri'], fr_uri)
+        self.assertEqual(
+            [diag['code'] for diag in published[0]['diagnostics']], ['missing-key'])
+        self.assertEqual(published[1], {'uri': fr_uri, 'diagnostics': []})
+        # go to definition finds 'b' in en-US
+        self.assertEqual(
+            results[2]['uri'],
+            lsp_server._path_to_uri(os.path.join(base_dir, 'en-US', 'one.properties')))
+        self.assertEqual(results[2]['range']['start'], {'line': 1, 'character': 0})
+        # a substitution only in fr is a problem on the first line
+        self.assertEqual(
+            [(diag['code'], diag['range']['start']['line'])
+             for diag in published[2]['diagnostics']],
+            [('subs-mismatch', 0)])
+        self.assertEqual(
+            [(diag['code'], diag['range']) for diag in published[3]['diagnostics']],
+            [('subs-mismatch', {'start': {'line': 1, 'character': 4},
+                                'end': {'line': 1, 'character': 5}})])
+
+    def test_languages_not_started_within_the_time_budget_are_listed(self):
+        base_dir = os.path.join(self.test_data_dir, 'other_changed_files')
+
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, time_budget=60)
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(checker.unchecked_languages, [])
+
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, time_budget=0)
+        self.assertFalse(checker.validate_loc_files())
+        self.assertEqual(checker.unchecked_languages, ['de', 'fr'])
+        self.assertEqual(checker.summary_counts, {
+            'de': {'-': {'not-checked': 1}}, 'fr': {'-': {'not-checked': 1}}})
+
+    def test_renamed_keys_are_reported_once(self):
+        base_dir = self._make_temp_dir()
+        def write_file(lang, lines):
+            self._write_file(base_dir, os.path.join(lang, 'one.properties'), lines)
+
+        write_file('en-US', ['menu.open.label=Open %S', 'old.name=Close', 'other=Other'])
+        write_file('fr', ['menu.open.label=Ouvrir %S', 'old.name=Fermer', 'other=Autre'])
+        history_path = os.path.join(self._make_temp_dir(), 'history.db')
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, history_path=history_path)
+        self.assertFalse(checker.validate_loc_files())
+
+        # one key renamed to a similar name, one to a different name with the same value,
+        # and one key that was really added
+        write_file('en-US', [
+            'menu.openFile.label=Open %S', 'completely.different=Close', 'added=New'])
+        write_file('fr', [
+            'menu.open.label=Ouvrir %S', 'old.name=Fermer', 'other=Autre'])
+
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, detect_renames=True,
+            history_path=history_path)
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(
+            checker.summary_counts,
+            {'fr': {'one.properties': {'renamed-key': 2, 'missing-key': 1, 'extra-key': 1}}})
+
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, detect_renames=True)
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(
+            checker.summary_counts,
+            {'fr': {'one.properties': {'renamed-key': 1, 'missing-key': 2, 'extra-key': 2}}})
+
+    def test_untranslated_values_are_counted_except_allowed_ones(self):
+        base_dir = os.path.join(self.test_data_dir, 'other_untranslated')
+
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, untranslated=True,
+            untranslated_allowlist=['one.properties/key2', 'https://*'])
+        self.assertFalse(checker.validate_loc_files())
+        self.assertEqual(
+            checker.summary_counts, {'fr': {'one.properties': {'untranslated': 2}}})
+
+        checker = checkloc.CheckLoc(locales_only=True, manifest_dir=base_dir, summary=True)
+        self.assertFalse(checker.validate_loc_files())
+        self.assertEqual(checker.summary_counts, {})
+
+        # --json messages give the counts as numbers as well
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, output_json=True, untranslated=True)
+        self.assertFalse(checker.validate_loc_files())
+        self.assertEqual(checker.untranslated_counts, {'fr': {'one.properties': 4}})
+        counts = {'fr': {'one.properties': 4}}
+        shards = [
+            {'fr': ['WARNING: (fr) x'], checkloc.UNTRANSLATED_COUNTS: counts},
+            {'de': [], checkloc.UNTRANSLATED_COUNTS: {'de': {'one.properties': 1}}}]
+        self.assertFalse(checkloc._is_summary_result(shards[0]))
+        self.assertEqual(
+            checkloc._merge_results(shards),
+            ({'fr': ['WARNING: (fr) x'], 'de': [], checkloc.UNTRANSLATED_COUNTS: {
+                'fr': {'one.properties': 4}, 'de': {'one.properties': 1}}}, False))
+
+    def test_perf_store_records_runs_and_finds_slowdowns(self):
+        base_dir = os.path.join(self.test_data_dir, 'other_matching_languages')
+        db_path = os.path.join(self._make_temp_dir(), 'perf.db')
+        for _ in range(2):
+            checker = checkloc.CheckLoc(
+                locales_only=True, manifest_dir=base_dir, summary=True,
+                perf_store_path=db_path, perf_label='r1')
+            self.assertFalse(checker.validate_loc_files())
+
+        store = perf_store.PerfStore(db_path)
+        self.addCleanup(store.close)
+        runs = store.get_runs('r1')
+        self.assertEqual([run['id'] for run in runs], [1, 2])
+        self.assertEqual(
+            [runs[0][field] for field in perf_store.SIZE_FIELDS], [3, 3, 48, 6])
+        self.assertEqual(
+            sorted(runs[0]['phases']), ['baseline', 'compare', 'manifest', 'parse'])
+
+        def make_runs(seconds, size=1048576):
+            return [{'languages': 1, 'files': 1, 'bytes': size, 'keys': 1,
+                     'peak_memory_kb': None, 'seconds': value, 'phases': {}}
+                    for value in seconds]
+        old = make_runs([1.0, 1.1, 0.9, 1.05, 0.95])
+        verdicts = dict((row[0], row[4]) for row in perf_store.compare_runs(
+            old, make_runs([1.2, 1.3, 1.25, 1.15, 1.22])))
+        self.assertEqual(verdicts['total s/MB'], 'slower')
+        # twice the time for twice the input is not a slowdown
+        verdicts = dict((row[0], row[4]) for row in perf_store.compare_runs(
+            old, make_runs([2.0, 2.2, 1.8, 2.1, 1.9], 2 * 1048576)))
+        self.assertEqual(verdicts['total s/MB'], '')
+        self.assertAlmostEqual(
+            perf_store.welch_t_test([1.0, 1.1, 0.9, 1.05, 0.95], [1.2, 1.3, 1.25, 1.15, 1.22]),
+            0.000591, places=5)
+
+    def test_profile_saves_each_phase_for_each_language(self):
+        base_dir = os.path.join(self.test_data_dir, 'other_missing_key')
+        profile_dir = os.path.join(self._make_temp_dir(), 'profile')
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, profile_dir=profile_dir)
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(sorted(os.listdir(profile_dir)), [
+            'baseline-en-US.collapsed', 'baseline-en-US.pstats',
+            'compare-fr.collapsed', 'compare-fr.pstats',
+            'manifest.collapsed', 'manifest.pstats',
+            'parse-fr.collapsed', 'parse-fr.pstats'])
+        with open(os.path.join(profile_dir, 'parse-fr.collapsed')) as collapsed_file:
+            stacks = [line.rsplit(' ', 1) for line in collapsed_file.read().splitlines()]
+        self.assertTrue(all(int(count) > 0 for (_, count) in stacks))
+        self.assertTrue(any('get_loc_keys (loc_language.py:' in stack for (stack, _) in stacks))
+
+    def test_key_index_looks_up_keys_files_and_languages(self):
+        base_dir = self._copy_test_data('other_key_index')
+        db_path = os.path.join(self._make_temp_dir(), 'index.db')
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, index_path=db_path)
+        checker.validate_loc_files()
+
+        index = key_index.KeyIndex(db_path)
+        self.addCleanup(index.close)
+        self.assertEqual(index.get_languages(), {'en-US': None, 'fr': 'en-US'})
+        self.assertEqual(
+            [(name, lang) for (name, lang, _, _, _) in index.find_keys('one.properties/menu.*')],
+            [('one.properties/menu.close', 'en-US'), ('one.properties/menu.open', 'en-US'),
+             ('one.properties/menu.open', 'fr')])
+        self.assertEqual(
+            [row[1:] for row in index.find_keys('title')],
+            [('en-US', 'value', os.path.join(base_dir, 'en-US', 'one.properties'), 3),
+             ('fr', 'value', os.path.join(base_dir, 'fr', 'one.properties'), 2)])
+        self.assertEqual(index.find_keys('menu'), [])
+        self.assertEqual(index.get_missing(['en-US']), ['fr'])
+        self.assertEqual(
+            index.find_files('*.properties'), {'one.properties': {'en-US': 3, 'fr': 2}})
+        self.assertEqual(index.get_files('fr'), {'one.properties': 2})
+
+        # languages replace their own entries, and removed languages are forgotten
+        shutil.rmtree(os.path.join(base_dir, 'fr'))
+        checker.validate_loc_files()
+        self.assertEqual(index.get_languages(), {'en-US': None})
+        self.assertEqual(index.find_files('one.properties'), {'one.properties': {'en-US': 3}})
+
+    def test_baseline_report_only_fails_on_new_problems(self):
+        base_dir = self._copy_test_data('other_missing_key')
+        report_path = os.path.join(self._make_temp_dir(), 'report.json')
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, report_path=report_path)
+        self.assertTrue(checker.validate_loc_files())
+        with open(report_path) as report_file:
+            report = json.load(report_file)['fingerprints']
+        self.assertEqual(
+            [(entry['category'], entry['language'], entry['key']) for entry in report.values()],
+            [('missing-key', 'fr', 'one.properties/b')])
+
+        # the known problem is only counted; a new one is shown and fails the run
+        with open(os.path.join(base_dir, 'fr', 'one.properties'), 'a') as prop_file:
+            prop_file.write('c=value\n')
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True,
+            baseline_report=set(report))
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(checker.summary_counts, {'fr': {'one.properties': {'extra-key': 1}}})
+        self.assertEqual(checker.known_counts, {'error': 1})
+
+        # fingerprints do not depend on where in the file the key is
+        with open(os.path.join(base_dir, 'fr', 'one.properties'), 'w') as prop_file:
+            prop_file.write('\n\nc=value\na=value\n')
+        checker.baseline_report = set(report) | set(
+            [diagnostic.Diagnostic(
+                'extra-key', '', file_name='one.properties',
+                key='one.properties/c').get_fingerprint('fr')])
+        self.assertFalse(checker.validate_loc_files())
+        self.assertEqual(checker.known_counts, {'error': 2})
+
+    def test_known_baseline_errors_do_not_stop_other_languages_being_checked(self):
+        base_dir = self._copy_test_data('other_missing_key')
+        report_path = os.path.join(self._make_temp_dir(), 'report.json')
+        self._write_file(base_dir, 'en-US/one.properties', ['a=value', 'b=value', 'not a key'])
+        self._write_file(base_dir, 'fr/one.properties', ['a=value', 'b=value'])
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, report_path=report_path)
+        self.assertTrue(checker.validate_loc_files())
+        with open(report_path) as report_file:
+            report = json.load(report_file)['fingerprints']
+
+        self._write_file(base_dir, 'fr/one.properties', ['c=value'])
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True,
+            baseline_report=set(report))
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(checker.known_counts, {'error': 1})
+        self.assertEqual(
+            checker.summary_counts,
+            {'fr': {'one.properties': {'missing-key': 2, 'extra-key': 1}}})
+
+    def test_baseline_report_finds_new_problems_without_keys_in_the_same_file(self):
+        base_dir = self._copy_test_data('other_missing_key')
+        report_path = os.path.join(self._make_temp_dir(), 'report.json')
+        self._write_file(base_dir, 'fr/one.properties', ['a=value', 'b=value', 'not a key'])
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, report_path=report_path)
+        self.assertTrue(checker.validate_loc_files())
+        with open(report_path) as report_file:
+            report = json.load(report_file)['fingerprints']
+
+        # the known parse error has moved down a line; the second one is new
+        self._write_file(
+            base_dir, 'fr/one.properties', ['', 'a=value', 'b=value', 'not a key', 'nor this'])
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True,
+            baseline_report=set(report))
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(checker.known_counts, {'error': 1})
+        self.assertEqual(checker.summary_counts, {'fr': {'one.properties': {'parse-error': 1}}})
+
+        # different problems in chrome.manifest have different fingerprints
+        fingerprints = set(
+            diagnostic.Diagnostic(
+                'manifest', template, args, file_name='chrome.manifest').get_fingerprint('Main')
+            for (template, args) in [
+                ("Locale '{0}' is defined more than once on line {1}", ('fr', 3)),
+                ("Locale '{0}' is defined more than once on line {1}", ('de', 4)),
+                ("Invalid locale line found in chrome.manifest on line {0}", (5,))])
+        self.assertEqual(len(fingerprints), 3)
+        self.assertEqual(
+            diagnostic.Diagnostic('manifest', "on line {0}", (3,)).get_fingerprint('Main'),
+            diagnostic.Diagnostic('manifest', "on line {0}", (7,)).get_fingerprint('Main'))
+
+    def test_plain_text_errors_and_warnings_work_with_a_baseline_report(self):
+        checker = checkloc.CheckLoc(summary=True, baseline_report=set())
+        with warnings.catch_warnings(record=True):
+            checker._log_warning("a plain text warning")
+        checker._log_error("a plain text error")
+        self.assertTrue(checker.any_new_errors)
+        self.assertEqual(checker.summary_counts, {'Main': {'-': {'setup': 2}}})
+
+    def test_baseline_report_finds_keys_added_to_a_group(self):
+        base_dir = self._copy_test_data('other_missing_keys')
+        report_path = os.path.join(self._make_temp_dir(), 'report.json')
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True, report_path=report_path)
+        self.assertTrue(checker.validate_loc_files())
+        with open(report_path) as report_file:
+            report = json.load(report_file)['fingerprints']
+        # the group of missing keys is saved one key at a time
+        self.assertEqual(
+            sorted(entry['key'] for entry in report.values()),
+            ['one.properties/b', 'one.properties/c'])
+
+        with open(os.path.join(base_dir, 'en-US', 'one.properties'), 'a') as prop_file:
+            prop_file.write('d=value\n')
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True,
+            baseline_report=set(report))
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(checker.summary_counts, {'fr': {'one.properties': {'missing-key': 3}}})
+        self.assertEqual(checker.known_counts, {})
+
+        # a key reported alone has the same fingerprint as in a group
+        single = diagnostic.Diagnostic(
+            'missing-key', '', file_name='one.properties', key='one.properties/b')
+        group = diagnostic.Diagnostic(
+            'missing-key', '', file_name='one.properties', count=2,
+            keys=['one.properties/b', 'one.properties/c'])
+        self.assertEqual(single.get_fingerprints('fr'), group.get_fingerprints('fr')[:1])
+
+    def test_rename_index_finds_similar_feature_sets(self):
+        index = rename_index.RenameIndex()
+        index.add('a', set(['one', 'two', 'three', 'four']))
+        index.add('b', set(['five', 'six', 'seven', 'eight']))
+        self.assertEqual(
+            index.query(set(['one', 'two', 'three', 'nine'])), [(0.6, 'a')])
+        self.assertEqual(index.query(set(['ten'])), [])
+
+    def test_locale_index_matches_variants_and_suggests_close_codes(self):
+        index = locale_index.LocaleIndex(['pt-BR', 'pt-PT', 'sv-SE', 'en-US', 'de'])
+        self.assertTrue('pt-BR' in index)
+        self.assertFalse('pt_br' in index)
+        self.assertEqual(index.find('pt_br'), 'pt-BR')
+        self.assertEqual(index.suggest('SV_se'), ['sv-SE'])
+        self.assertEqual(index.suggest('pt-BT'), ['pt-BR', 'pt-PT'])
+        self.assertEqual(index.suggest('ja-JP'), [])
+        self.assertEqual(locale_index.edit_distance('kitten', 'sitting'), 3)
+
+    def test_baselines_that_loop_raise_an_error(self):
+        base_dir = os.path.join(self.test_data_dir, 'other_assigned_baselines')
+        checker = checkloc.CheckLoc(
+            locales_only=True, manifest_dir=base_dir, summary=True,
+            baselines={'pt-BR': ['pt-PT'], 'pt-PT': ['pt-BR']})
+        self.assertTrue(checker.validate_loc_files())
+        self.assertEqual(checker.summary_counts, {'Main': {'-': {'setup': 1}}})
+
+    @unittest.skipIf(sys.version_info < (3, 6), "the asyncio API needs Python 3.6 or higher")
+    def test_async_api_yields_a_result_for_each_language(self):
+        import asyncio
+        if __package__ is None:
+            import async_api
+        else:
+            from .. import async_api
+
+        base_dir = os.path.join(self.test_data_dir, 'other_changed_files')
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.addCleanup(loop.close)
+        self.addCleanup(asyncio.set_event_loop, None)
+
+        results = loop.run_until_complete(async_api.validate(base_dir, locales_only=True))
+        self.assertEqual(
+            [(result.lang, result.any_errors) for result in results],
+            [('de', True), ('fr', True)])
+        self.assertEqual(
+            [msg.category for msg in results[1].errors], ['missing-key'])
+
+        # several extensions can be checked at once
+        other_dir = os.path.join(self.test_data_dir, 'other_matching_languages')
+        both = loop.run_until_complete(asyncio.gather(
+            async_api.validate(base_dir, locales_only=True),
+            async_api.validate(other_dir, locales_only=True)))
+        self.assertEqual([len(results) for results in both], [2, 2])
+
+        with self.assertRaises(asyncio.TimeoutError):
+            loop.run_until_complete(
+                async_api.validate(base_dir, timeout=0, locales_only=True))
+
 def main():
     """
     Parse arguments and run the tests.
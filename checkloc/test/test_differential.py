@@ -0,0 +1,541 @@
+#
+#   Copyright (C) 2014 Dave Schaefer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, version 3 of the License.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the localization file parsers against a simple reference parser
+using random and adversarial .properties and .dtd files,
+to make sure faster parsers find exactly the same keys, substitutions, and problems.
+"""
+
+from __future__ import print_function
+
+import argparse
+import atexit
+import codecs
+import logging
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+from lxml import etree
+
+# allow importing and running both as a package and from the command line
+if __package__ is None:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import diagnostic
+    import file_source
+    import loc_language
+else:
+    from .. import diagnostic
+    from .. import file_source
+    from .. import loc_language
+
+# the same seed is used every run, so any failure can be reproduced.
+# use --seed to try other inputs.
+SEED = 2014
+CASES_PER_TEST = 300
+
+ERROR = 'error'
+WARNING = 'warning'
+
+class ParseResult(object):
+    """
+    Everything one parser found in one localization file:
+    the keys and their values, the string substitutions,
+    and a list of (level, category, key, detail) tuples for each problem.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.subs = {}
+        self.diagnostics = []
+
+#
+# Reference parser.
+#
+# This is the original, straightforward way checkloc parsed files:
+# remove every .properties comment, split what is left into lines,
+# and check each line on its own; let lxml read .dtd files directly,
+# and resolve the entity references in their values recursively.
+# It is slow but easy to check by eye, so every other parser must agree with it.
+#
+
+_PROP_COMMENT = re.compile(br'^\s*[#!]+[^\n\r\f]*[\n\r\f]+', re.MULTILINE)
+_PROP_SEP = re.compile(br'[\n\r\f]')
+_PROP_LINE = re.compile(br'^\s*([A-Za-z0-9_.\-+\\{}\[\]!@#$%^&*()/<>,?;\'"`~|]+)\s*[=:]\s*([^\n\r\f]*)')
+_MAX_SUBS = 10
+_DTD_ENTITY_REF = re.compile(r'&([A-Za-z_:][A-Za-z0-9_:.\-]*);')
+# entities that values can refer to without declaring them
+_KNOWN_ENTITIES = [
+    'amp', 'lt', 'gt', 'quot', 'apos',
+    'brandShortName', 'brandShorterName', 'brandFullName', 'vendorShortName', 'trademarkInfo']
+_MAX_ENTITY_DEPTH = 8
+
+def reference_parse(file_path):
+    """
+    Parse one .properties or .dtd file the original way and return a ParseResult.
+    """
+    result = ParseResult()
+    file_name = os.path.basename(file_path)
+
+    with open(file_path, 'rb') as rawfile:
+        data = rawfile.read()
+    if data.startswith(codecs.BOM_UTF8):
+        result.diagnostics.append((ERROR, diagnostic.BOM, None, None))
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError:
+        result.diagnostics.append((ERROR, diagnostic.ENCODING, None, None))
+
+    if file_path.endswith('.dtd'):
+        _reference_parse_dtd(file_path, file_name, result)
+    else:
+        _reference_parse_properties(file_path, file_name, result)
+    return result
+
+def _reference_parse_dtd(file_path, file_name, result):
+    """
+    Parse a .dtd file the original way.
+    """
+    with open(file_path, 'rb') as openfile:
+        try:
+            dtd = etree.DTD(openfile)
+        except etree.DTDParseError:
+            result.diagnostics.append((ERROR, diagnostic.PARSE_ERROR, None, None))
+            return
+
+        declared = set(_KNOWN_ENTITIES)
+        refs = {}
+        for entity in dtd.entities():
+            declared.add(entity.name)
+            key = file_name + '/' + entity.name
+            if key in result.keys:
+                result.diagnostics.append((ERROR, diagnostic.DUPLICATE_KEY, key, None))
+            elif '<' in entity.content:
+                result.diagnostics.append((ERROR, diagnostic.INVALID_VALUE, key, None))
+            else:
+                if len(entity.content) < 1:
+                    result.diagnostics.append((WARNING, diagnostic.EMPTY_VALUE, key, None))
+                result.keys[key] = entity.content
+                refs[key] = set(_DTD_ENTITY_REF.findall(entity.orig or ''))
+    _reference_resolve_entities(file_name, refs, declared, result)
+
+def _reference_resolve_entities(file_name, refs, declared, result):
+    """
+    Follow every entity reference in the values of a .dtd file,
+    visiting the keys and their references in name order.
+    'refs' holds the names referred to by each key that was kept,
+    and 'declared' every name that can be referred to.
+    """
+    # the deepest chain of references below each key; None while it is being visited
+    depths = {}
+
+    def visit(key):
+        """
+        Check the references of one key, and those of every key it refers to first.
+        """
+        depths[key] = None
+        for name in sorted(refs[key]):
+            ref_key = file_name + '/' + name
+            if ref_key not in refs:
+                if name not in declared:
+                    result.diagnostics.append(
+                        (WARNING, diagnostic.UNDECLARED_ENTITY, key, None))
+            elif ref_key not in depths:
+                visit(ref_key)
+            elif depths[ref_key] is None:
+                result.diagnostics.append((ERROR, diagnostic.ENTITY_REFERENCE, key, None))
+        depths[key] = max([(depths[file_name + '/' + name] or 0) + 1
+                           for name in refs[key] if file_name + '/' + name in refs] or [0])
+        if depths[key] == _MAX_ENTITY_DEPTH + 1:
+            result.diagnostics.append((WARNING, diagnostic.DEEP_ENTITY_REFERENCE, key, None))
+
+    for key in sorted(refs):
+        if key not in depths:
+            visit(key)
+
+def _reference_parse_properties(file_path, file_name, result):
+    """
+    Parse a .properties file the original way.
+    """
+    with open(file_path, 'rb') as openfile:
+        data = openfile.read()
+
+    if len(data) < 1:
+        result.diagnostics.append((WARNING, diagnostic.EMPTY_FILE, None, None))
+        return
+
+    data = re.sub(_PROP_COMMENT, b'', data)
+    for line in re.split(_PROP_SEP, data):
+        if not line.strip():
+            continue
+        match = _PROP_LINE.match(line)
+        if not match:
+            result.diagnostics.append(
+                (ERROR, diagnostic.PARSE_ERROR, None, file_source.to_text(line)))
+            continue
+
+        key = file_name + '/' + file_source.to_text(match.group(1))
+        value = file_source.to_text(match.group(2))
+        if key in result.keys:
+            result.diagnostics.append((ERROR, diagnostic.DUPLICATE_KEY, key, None))
+        elif len(value) < 1:
+            result.diagnostics.append((ERROR, diagnostic.BLANK_VALUE, key, None))
+        elif '%' in value:
+            numeric_subs = []
+            regular_subs = 0
+            pos = value.find('%')
+            while pos != -1:
+                pmatch = re.match(r'%([0-9]+\$)?S', value[pos:])
+                if value[pos + 1:pos + 2] == '%':
+                    pos += 1
+                elif pmatch:
+                    pos += 1
+                    if pmatch.group(1):
+                        numeric_subs.append(int(pmatch.group(1)[:-1]))
+                        pos += len(pmatch.group(1))
+                    else:
+                        regular_subs += 1
+                else:
+                    result.diagnostics.append((ERROR, diagnostic.INVALID_VALUE, key, None))
+                    break
+                pos = value.find('%', pos + 1)
+            else:
+                numeric_subs.sort()
+                result.keys[key] = value
+                result.subs[key] = str(numeric_subs)
+                highest = numeric_subs[-1] if numeric_subs else 0
+                if highest > _MAX_SUBS or regular_subs > _MAX_SUBS or \
+                        (numeric_subs and highest + regular_subs > _MAX_SUBS):
+                    result.diagnostics.append((ERROR, diagnostic.TOO_MANY_SUBS, key, None))
+        else:
+            result.keys[key] = value
+
+#
+# Parsers under test.
+#
+
+# one pool is shared by every parse, like the pool shared by every language in a checkloc run
+_parse_pool = []
+
+def _get_parse_pool():
+    """
+    Return the pool of processes used to scan .properties chunks, creating it the first time.
+    """
+    if not _parse_pool:
+        _parse_pool.append(multiprocessing.Pool(2))
+        atexit.register(_parse_pool[0].terminate)
+    return _parse_pool[0]
+
+def loc_language_parse(file_path, chunk_bytes=None):
+    """
+    Parse one file with LocalizationLanguage and return a ParseResult.
+    If 'chunk_bytes' is given, .properties files are split into chunks of about that size
+    and scanned by a shared pool of processes, however small they are.
+    """
+    result = ParseResult()
+
+    def log(level):
+        """
+        Return a logging callback that records diagnostics at the given level.
+        """
+        def record(msg, _lang):
+            detail = None
+            if msg.category == diagnostic.PARSE_ERROR and msg.file_name.endswith('.properties'):
+                detail = msg.args[0]
+            result.diagnostics.append((level, msg.category, msg.key, detail))
+        return record
+
+    loc = loc_language.LocalizationLanguage(
+        os.path.dirname(file_path), 'test', log(WARNING), log(ERROR))
+    if chunk_bytes is not None:
+        loc._PARALLEL_PROPERTIES_BYTES = 0
+        loc._PROPERTIES_CHUNK_BYTES = chunk_bytes
+        loc.get_parse_pool = _get_parse_pool
+    loc.get_loc_keys()
+    result.keys = loc.keys
+    result.subs = loc.subs
+    return result
+
+# every parser in this list is checked against the reference parser.
+# add faster or alternative parsers here as they are written.
+PARSERS = [
+    ('LocalizationLanguage', loc_language_parse),
+    ('LocalizationLanguage in parallel chunks',
+     lambda file_path: loc_language_parse(file_path, chunk_bytes=16)),
+]
+
+#
+# Random and adversarial input.
+#
+
+_KEY_CHARS = 'abcXYZ019_.-+\\{}[]!@#$%^&*()/<>,?;\'"`~|'
+_VALUE_PIECES = [
+    'text', 'more text', ' ', '\t', '%', '%%', '%%%', '%S', '%s', '%1$S', '%2$S', '%10$S',
+    '%11$S', '%$S', '%1$', '%1S', '#', '!', '=', ':', '<', '&', '\\', '\xc3\xa9']
+_SEPARATORS = ['=', ':', ' = ', '\t: ', ' ', '==', '=:', ' =\t']
+_LINE_BREAKS = ['\n', '\n', '\n', '\r\n', '\r', '\f', '\n\n', '\n \n', '\r\r\n']
+_COMMENTS = [
+    '# a comment', '!another', '  # indented', '#', '!!', '#!# =x', '\t! %1$', '# key=value']
+# bytes that are never valid UTF-8 where they are inserted, or that break up a valid sequence
+_INVALID_UTF8 = ['\xff', '\xe9', '\xc3', '\x80', '\xed\xa0\x80']
+
+def _to_bytes(data):
+    """
+    Return test data as the bytes to write to a file.
+    Non-ASCII characters are written in the data above as their UTF-8 bytes,
+    so on Python 3 each character stands for one byte.
+    """
+    if isinstance(data, bytes):
+        return data
+    return data.encode('latin-1')
+
+def _add_invalid_utf8(rand, data):
+    """
+    Sometimes return the data with bytes that are not valid UTF-8 inserted at a random place.
+    """
+    if rand.random() < 0.05:
+        pos = rand.randint(0, len(data))
+        data = data[:pos] + rand.choice(_INVALID_UTF8) + data[pos:]
+    return data
+
+def random_properties(rand):
+    """
+    Return the contents of a random .properties file.
+    """
+    lines = []
+    for _ in range(rand.randint(0, 12)):
+        kind = rand.random()
+        if kind < 0.65:
+            key = ''.join(rand.choice(_KEY_CHARS) for _ in range(rand.randint(1, 6)))
+            if rand.random() < 0.05:
+                key += rand.choice([' ', '=', '\xc3\xa9', 'a b'])
+            value = ''.join(rand.choice(_VALUE_PIECES) for _ in range(rand.randint(0, 6)))
+            indent = rand.choice(['', '', '', ' ', '\t', '  '])
+            lines.append(indent + key + rand.choice(_SEPARATORS) + value)
+        elif kind < 0.8:
+            lines.append(rand.choice(_COMMENTS))
+        elif kind < 0.9:
+            lines.append(rand.choice(['', ' ', '\t', '  \t ']))
+        elif kind < 0.95 and lines:
+            lines.append(rand.choice(lines)) # likely a duplicate key
+        else:
+            lines.append(rand.choice(['garbage', '=value', ' : ', 'key', '%S']))
+
+    data = ''
+    for line in lines:
+        data += line + rand.choice(_LINE_BREAKS)
+    if data and rand.random() < 0.3:
+        data = data.rstrip('\n\r\f') # no line break at the end
+    data = _to_bytes(_add_invalid_utf8(rand, data))
+    if rand.random() < 0.03:
+        data = codecs.BOM_UTF8 + data
+    return data
+
+_ENTITY_NAME_CHARS = 'abcXYZ019_.-'
+_ENTITY_VALUE_PIECES = [
+    'text', ' ', '&amp;', '&#38;', '&lt;', '&', '%', '<', '>', "'", '"', '\xc3\xa9', '--', '\n',
+    '&a;', '&b;', '&missing;', '&brandShortName;']
+
+def random_dtd(rand):
+    """
+    Return the contents of a random .dtd file.
+    """
+    parts = []
+    for _ in range(rand.randint(0, 8)):
+        kind = rand.random()
+        if kind < 0.7:
+            name = ''.join(rand.choice(_ENTITY_NAME_CHARS) for _ in range(rand.randint(1, 6)))
+            if rand.random() < 0.3:
+                # a name the values refer to
+                name = rand.choice(['a', 'b'])
+            if rand.random() < 0.05:
+                name += rand.choice(['"', '%', ' x', '<'])
+            value = ''.join(
+                rand.choice(_ENTITY_VALUE_PIECES) for _ in range(rand.randint(0, 4)))
+            quote = rand.choice(['"', "'"])
+            parts.append('<!ENTITY {0} {1}{2}{1}>'.format(name, quote, value))
+        elif kind < 0.85:
+            parts.append(rand.choice([
+                '<!-- a comment -->', '<!-- <!ENTITY hidden "x"> -->',
+                '<!-- bad -- comment -->', '<!--\n-->']))
+        elif kind < 0.95 and parts:
+            parts.append(rand.choice(parts)) # likely a duplicate entity
+        else:
+            parts.append(rand.choice(['garbage', '<!ENTITY', '<!ENTITY x>', '<!ENTITY % p "v">']))
+
+    data = ''
+    for part in parts:
+        data += part + rand.choice(['\n', '\n', ' ', '\r\n', '\n\n'])
+    data = _to_bytes(_add_invalid_utf8(rand, data))
+    if rand.random() < 0.03:
+        data = codecs.BOM_UTF8 + data
+    return data
+
+ADVERSARIAL_PROPERTIES = [
+    '',
+    '\n',
+    ' \n\t\n',
+    '# comment with no line break at the end',
+    'key=value\n# comment with no line break at the end',
+    '# comment\r# comment\rkey=value\r',
+    '#\n#\n#\nkey=value',
+    'key=value\n  # indented comment\nother=value\n',
+    'key=value # not a comment\n',
+    'key = value\nkey = other value\n',
+    'key=\n',
+    'key=   \n',
+    'key:value:with:colons\n',
+    'key==value\n',
+    '!key=value\n',
+    'a!b=value\n',
+    ' \f key=value\f',
+    'key=100%% done\n',
+    'key=%\n',
+    'key=ends with %\n',
+    'key=%1$S and %1$S\n',
+    'key=%2$S %1$S %S\n',
+    'key=%11$S\n',
+    'key=%S%S%S%S%S%S%S%S%S%S%S\n',
+    'key=%5$S%S%S%S%S%S%S\n',
+    'key=%0$S\n',
+    'key with space=value\n',
+    'key\\ with\\ escaped\\ space=value\n',
+    '=value\n',
+    'key\n',
+    codecs.BOM_UTF8 + b'key=value\n',
+    'key=value\r\n\r\nother=value\r\n',
+    'k\xc3\xa9y=value\n',
+    'key=v\xc3\xa9lue\n',
+    # only a comment that starts after a line feed, or after whitespace that does,
+    # hides the rest of its line; parsers that split files must not split inside these
+    'first=some valu\n#a\n\r  #b\nkey=value\n',
+    'first=some valu\n\n  \n#a\nkey=value\n',
+    'first=some valu\n#a\n\n\n\rkey=value\n',
+    'key=v\xe9lue\n',
+    'k\xffey=value\n',
+    'key=value\xc3',
+    'first=value\r\n\x80second=value\n',
+    'key=\xed\xa0\x80\n',
+]
+
+ADVERSARIAL_DTD = [
+    '',
+    '<!ENTITY key "value">',
+    '<!ENTITY key "value">\n<!ENTITY key "other value">\n',
+    '<!ENTITY key "">\n',
+    "<!ENTITY key ''>\n",
+    '<!ENTITY key "a &amp; b">\n',
+    '<!ENTITY key "a & b">\n',
+    '<!ENTITY key "100%">\n',
+    '<!ENTITY key "a &lt; b">\n',
+    '<!ENTITY key "a < b">\n',
+    '<!ENTITY key "a\nb">\n',
+    '<!-- <!ENTITY hidden "x"> -->\n<!ENTITY key "value">\n',
+    '<!-- a -- b -->\n<!ENTITY key "value">\n',
+    '<!ENTITY key value>\n',
+    '<!ENTITY "key" "value">\n',
+    '<!ENTITY % param "value">\n<!ENTITY key "value">\n',
+    codecs.BOM_UTF8 + b'<!ENTITY key "value">\n',
+    '<!ENTITY k\xc3\xa9y "value">\n',
+    '<!ENTITY key "v\xc3\xa9lue">\n',
+    '<!ENTITY key "v\xe9lue">\n',
+    '<!-- \xff -->\n<!ENTITY key "value">\n',
+    '<!ENTITY key "a &missing; b">\n',
+    '<!ENTITY key "&brandShortName; &amp; &lt;">\n',
+    '<!ENTITY a "&b;">\n<!ENTITY b "value">\n',
+    '<!ENTITY a "&b;">\n<!ENTITY b "&a;">\n',
+    '<!ENTITY a "&a;">\n',
+    '<!ENTITY a "&b; &zz;">\n<!ENTITY b "&missing;">\n',
+    '<!ENTITY a "&b;">\n<!ENTITY b "<b>">\n',
+    '<!ENTITY a "x">\n<!ENTITY a "y">\n<!ENTITY key "&a;">\n',
+    ''.join('<!ENTITY e{0} "&e{1};">\n'.format(i, i + 1) for i in range(11)) +
+    '<!ENTITY e11 "end">\n',
+]
+
+class TestParsersAgree(unittest.TestCase):
+    """
+    Check that every parser in PARSERS agrees with the reference parser.
+    """
+
+    seed = SEED
+
+    def setUp(self):
+        """
+        Set up a temporary locale folder to write test files into.
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def assert_parsers_agree(self, data, extension):
+        """
+        Write 'data' to a file and check that every parser
+        gets exactly the same result from it as the reference parser.
+        """
+        file_path = os.path.join(self.temp_dir, 'test' + extension)
+        data = _to_bytes(data)
+        with open(file_path, 'wb') as openfile:
+            openfile.write(data)
+
+        expected = reference_parse(file_path)
+        for (name, parse) in PARSERS:
+            actual = parse(file_path)
+            context = "{0} disagrees with the reference parser for {1!r}".format(name, data)
+            self.assertEqual(actual.keys, expected.keys, context)
+            self.assertEqual(actual.subs, expected.subs, context)
+            self.assertEqual(actual.diagnostics, expected.diagnostics, context)
+
+    def test_adversarial_properties_files(self):
+        for data in ADVERSARIAL_PROPERTIES:
+            self.assert_parsers_agree(data, '.properties')
+
+    def test_adversarial_dtd_files(self):
+        for data in ADVERSARIAL_DTD:
+            self.assert_parsers_agree(data, '.dtd')
+
+    def test_random_properties_files(self):
+        rand = random.Random(self.seed)
+        for _ in range(CASES_PER_TEST):
+            self.assert_parsers_agree(random_properties(rand), '.properties')
+
+    def test_random_dtd_files(self):
+        rand = random.Random(self.seed)
+        for _ in range(CASES_PER_TEST):
+            self.assert_parsers_agree(random_dtd(rand), '.dtd')
+
+def main():
+    """
+    Parse arguments and run the tests.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=SEED,
+        help="Seed for generating random files. Default: %(default)s.")
+    (args, remaining) = parser.parse_known_args()
+
+    # parsers report every line they read at INFO level; keep the output readable
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.WARNING)
+    TestParsersAgree.seed = args.seed
+    unittest.main(argv=[sys.argv[0]] + remaining)
+
+if __name__ == '__main__':
+    main()